@@ -0,0 +1,10 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+# File Name: conftest.py
+# Inception: 17 OCT 2026
+#
+# Description: pytest settings for the 'tests' folder.
+# 'tfmp_test.py' is an example script for a device on a serial
+# port, not a test module, so pytest does not collect it.
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+collect_ignore = [ 'tfmp_test.py', 'tfmp_bench.py']
@@ -0,0 +1,1156 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+# File Name: test_tfmplus.py
+# Inception: 17 OCT 2026
+#
+# Description: Checks of the 'tfmplus' module and its companion
+# modules that run without a TFMini-Plus device: against data in
+# memory, a pty, or the device emulator of 'tfmp_emulator'.
+#
+# Run from the repository folder with pytest:
+#   python -m pytest -q tests/test_tfmplus.py
+# or as a script:
+#   python tests/test_tfmplus.py
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import os
+import re
+import pty
+import sys
+import math
+import time
+import random
+import tempfile
+import subprocess
+import asyncio
+import threading
+import urllib.error
+import urllib.request
+from array import array
+
+sys.path.insert( 0, os.path.join( os.path.dirname( __file__), '..'))
+import tfmplus as tfmP
+from tfmp_emulator import Emulator, FakeI2CBus
+from tfmp_async import AsyncTFMPlus
+from tfmp_i2c import TFMPlusI2C, I2CGroup
+from tfmp_record import Recorder, ReplayStream, RECORD_SIZE, HEADER_SIZE
+from tfmp_store import FrameStore
+from tfmp_group import SensorGroup
+from tfmp_supervisor import Supervisor
+from tfmp_filter import Median, EMA, Kalman, Pipeline
+from tfmp_shared import Publisher, Subscriber
+from tfmp_config import autoConfigure, findBaud, countFrames, flush
+from tfmp_metrics import formatMetrics, MetricsServer
+from tfmp_bridge import Bridge, BridgeClient, TFMP_REFUSED
+
+#  Build one valid data frame: Dist, Flux and Temp code
+def makeFrame( dist, flux = 500, temp = 35):
+    data = bytearray( b'\x59\x59')
+    data += dist.to_bytes( 2, 'little', signed = True)
+    data += flux.to_bytes( 2, 'little', signed = True)
+    data += ( ( temp + 256) << 3).to_bytes( 2, 'little')
+    data.append( sum( data) & 0xFF)
+    return bytes( data)
+
+#  In-memory serial port that returns 'data' once.
+class MemoryStream:
+    def __init__( self, data):
+        self.buffer = bytearray( data)
+        self.timeout = None
+    def inWaiting( self):
+        return len( self.buffer)
+    def read( self, size = 1):
+        result = bytes( self.buffer[ :size])
+        del self.buffer[ :size]
+        return result
+
+#  Return a 'TFMPlus' object on a silent pty, and the master.
+def silentPort():
+    master, slave = pty.openpty()
+    sensor = tfmP.TFMPlus()
+    sensor.begin( os.ttyname( slave), 115200)
+    os.close( slave)
+    return sensor, master
+
+# - - - - - - - - - - - -  Serial reads  - - - - - - - - - - - -
+#  'getData()' sleeps in the port's read while nothing arrives.
+def test_idle_cpu():
+    sensor, master = silentPort()
+    try:
+        start, startCpu = time.monotonic(), time.thread_time()
+        assert not sensor.getData()
+        elapsed = time.monotonic() - start
+        assert sensor.status == tfmP.TFMP_HEADER
+        assert elapsed >= tfmP.TFMP_DATA_TIMEOUT
+        assert ( time.thread_time() - startCpu) / elapsed < 0.05
+    finally:
+        sensor.pStream.close()
+        os.close( master)
+
+#  Waiting for frames does not set the port's timeout, which
+#  is a 'tcsetattr()' call, on every read.
+def test_read_no_reconfigure():
+    with Emulator( frameRate = 1000, baud = 921600) as emu:
+        sensor = tfmP.TFMPlus()
+        assert sensor.begin( emu.port, 921600)
+        calls = []
+        reconfigure = sensor.pStream._reconfigure_port
+        def counted( *args, **kwargs):
+            calls.append( args)
+            return reconfigure( *args, **kwargs)
+        sensor.pStream._reconfigure_port = counted
+        for i in range( 200):
+            assert sensor.getData()
+        sensor.pStream.close()
+    assert sensor.status == tfmP.TFMP_READY
+    assert not calls
+
+#  Junk before a good frame is discarded byte for byte, counted
+#  as one resync, and the frame is returned as soon as it arrives.
+def test_resync_after_junk():
+    sensor, master = silentPort()
+    try:
+        for size in ( 10, 100, 1000):
+            junk = bytes( ( 7 * i + 1) % 0x59 for i in range( size))
+            discarded, misses = sensor.bytesDiscarded, sensor.headerMisses
+            written = []
+            def write():
+                written.append( time.monotonic())
+                os.write( master, junk + makeFrame( 123))
+            timer = threading.Timer( 0.01, write)
+            timer.start()
+            assert sensor.getData()
+            assert time.monotonic() - written[ 0] < 0.1
+            timer.join()
+            assert ( sensor.dist, sensor.flux, sensor.temp) == ( 123, 500, 35)
+            assert sensor.bytesDiscarded - discarded == size
+            assert sensor.headerMisses - misses == 1
+    finally:
+        sensor.pStream.close()
+        os.close( master)
+
+#  Every good frame of a damaged stream is recovered, and each
+#  fault is counted once.
+def test_sync_counters():
+    frames = [ makeFrame( 100 + i) for i in range( 20)]
+    bad = bytearray( frames[ 5])
+    bad[ 8] ^= 0x5A
+    data = b''.join( frames[ :5]) + bad + b''.join( frames[ 6:10]) \
+           + b'\x01\x02\x03' + b''.join( frames[ 10:])
+    sensor = tfmP.TFMPlus()
+    sensor.pStream = MemoryStream( data)
+    dists, fluxes, temps = sensor.getFrames()
+    assert list( dists) == [ 100 + i for i in range( 20) if i != 5]
+    assert sensor.checksumErrors == 1
+    assert sensor.headerMisses == 2
+    assert sensor.bytesDiscarded == tfmP.TFMP_FRAME_SIZE + 3
+    assert sensor.metrics()[ 'frames'] == 19
+    #  A frame whose checksum byte is 0x59 is not taken for the
+    #  start of the next.
+    frame = next( makeFrame( d) for d in range( 1000) if makeFrame( d)[ -1] == 0x59)
+    for i in range( 3):
+        sensor.pStream = MemoryStream( frame)
+        assert len( sensor.getFrames()[ 0]) == 1
+    assert sensor.checksumErrors == 1 and sensor.headerMisses == 2
+    #  A frame split between reads is carried over.
+    sensor.pStream = MemoryStream( makeFrame( 7)[ :4])
+    assert not sensor.getFrames()[ 0]
+    sensor.pStream = MemoryStream( makeFrame( 7)[ 4:])
+    assert list( sensor.getFrames()[ 0]) == [ 7]
+
+#  Streaming from the emulator with corrupted frames: every
+#  frame sent intact is decoded and every bad one counted.
+def test_stream_checksum_faults():
+    with Emulator( frameRate = 1000, baud = 921600, seed = 1) as emu:
+        sensor = tfmP.TFMPlus()
+        assert sensor.begin( emu.port, 921600, stream = True)
+        #  Frames left waiting by 'begin()' are not counted.
+        time.sleep( 0.05)
+        emu.checksumRate = 0.05
+        seq = sensor.ring.seq
+        time.sleep( 1.0)
+        emu.checksumRate = 0.0
+        time.sleep( 0.05)
+        sensor.stopStream()
+        sensor.pStream.close()
+    frames = sensor.ring.seq - seq
+    assert 900 <= frames + sensor.checksumErrors <= 1100
+    assert 20 <= sensor.checksumErrors <= 90
+    assert sensor.ring.overruns == 0
+
+#  When the device is gone the stream ends: 'streaming' is
+#  cleared, and neither frame nor command waits out its time.
+def test_stream_lost():
+    emu = Emulator( frameRate = 100, baud = 115200)
+    emu.start()
+    sensor = tfmP.TFMPlus()
+    assert sensor.begin( emu.port, 115200, stream = True)
+    assert sensor.wait_next( 1.0) is not None
+    emu.close()
+    sensor.readerThread.join( 1.0)
+    assert not sensor.streaming
+    assert sensor.status == tfmP.TFMP_SERIAL
+    start = time.monotonic()
+    assert sensor.wait_next() is None
+    assert not sensor.sendCommand( tfmP.GET_FIRMWARE_VERSION, 0)
+    assert sensor.status == tfmP.TFMP_SERIAL
+    assert time.monotonic() - start < 0.05
+    sensor.stopStream()
+    sensor.pStream.close()
+
+#  When the device node goes and comes back, here a link to an
+#  emulator's pty, streaming carries on in the same ring with
+#  the frame rate sent again, and the outage is counted once.
+def test_supervisor_replug():
+    with tempfile.TemporaryDirectory() as folder:
+        link = os.path.join( folder, 'tfmini')
+        first = Emulator( frameRate = 100, baud = 115200, distance = lambda t: 111)
+        first.start()
+        os.symlink( first.port, link)
+        sensor = tfmP.TFMPlus()
+        with Supervisor( sensor, link, 115200, frameRate = tfmP.FRAME_250) as supervisor:
+            assert supervisor.ready( 2.0)
+            assert sensor.wait_next( 1.0)[ 2] == 111
+            assert first.frameRate == 250
+            os.remove( link)
+            first.close()
+            time.sleep( 0.3)
+            assert not supervisor.connected.is_set()
+            seq = sensor.ring.seq
+            with Emulator( frameRate = 100, baud = 115200, distance = lambda t: 222) as second:
+                start = time.monotonic()
+                os.symlink( second.port, link)
+                frame = sensor.wait_next( 2.0, seq)
+                assert frame is not None and frame[ 0] == seq and frame[ 2] == 222
+                assert time.monotonic() - start < 0.5
+                assert supervisor.ready( 1.0) and second.frameRate == 250
+                assert sensor.reconnects == 1 and sensor.reconnectTime.count == 1
+                assert supervisor.outage >= 0.3
+                time.sleep( 0.2)
+                assert sensor.ring.seq - seq >= 25
+                assert sensor.clock.dropped == 0
+        assert sensor.ring.ended
+
+#  A port that hangs up is dropped from the wait and reported,
+#  and the group does not spin on it.
+def test_group_hangup():
+    with Emulator( frameRate = 100, baud = 115200) as emu, \
+         tempfile.TemporaryDirectory() as folder:
+        group = SensorGroup()
+        sensor = group.add( 'front', emu.port)
+        master, slave = pty.openpty()
+        group.add( 'rear', os.ttyname( slave))
+        os.close( slave)
+        path = os.path.join( folder, 'run.tfmp')
+        sensor.record( path)
+        records = []
+        while( len( records) < 10):
+            records += group.poll( 1.0)
+        sensor.stopRecord()
+        assert os.path.getsize( path) > 0
+        assert { r[ 0] for r in records} == { 'front'}
+        os.close( master)
+        start, startCpu = time.monotonic(), time.process_time()
+        stop = start + 0.5
+        while( time.monotonic() < stop):
+            group.poll( 0.1)
+        assert ( time.process_time() - startCpu) / ( time.monotonic() - start) < 0.2
+        assert group.lost.keys() == { 'rear'}
+        assert group.sensors[ 'rear'].status == tfmP.TFMP_SERIAL
+        emu.close()
+        assert all( r[ 0] == 'front' for r in group.records())
+        assert group.lost.keys() == { 'front', 'rear'}
+        group.close()
+
+#  Recording, publishing and storing are started and stopped
+#  while the reader thread writes to them, and it carries on.
+def test_sink_swap():
+    with Emulator( frameRate = 1000, baud = 921600) as emu, \
+         tempfile.TemporaryDirectory() as folder:
+        sensor = tfmP.TFMPlus()
+        assert sensor.begin( emu.port, 921600, stream = True)
+        path = os.path.join( folder, 'run')
+        for i in range( 300):
+            sensor.record( path + '.tfmp')
+            sensor.publish()
+            sensor.store( path + '.tfms')
+            sensor.stopRecord()
+            sensor.stopPublish()
+            sensor.stopStore()
+        assert sensor.readerThread.is_alive()
+        seq = sensor.ring.seq
+        assert sensor.wait_next( 0.1, seq + 10) is not None
+        sensor.stopStream()
+        sensor.pStream.close()
+
+#  Commands outside the precompiled table are built each time
+#  and do not grow it.
+def test_command_cache():
+    size = len( tfmP.commandFrames)
+    for param in range( 1, 300):
+        assert tfmP.encodeCommand( tfmP.SET_FRAME_RATE, param) == \
+               tfmP.buildCommand( tfmP.SET_FRAME_RATE, param)
+        tfmP.encodeCommand( tfmP.SET_I2C_ADDRESS, param & 0x7F)
+    assert len( tfmP.commandFrames) == size
+    assert tfmP.encodeCommand( tfmP.SET_FRAME_RATE, tfmP.FRAME_100) is \
+           tfmP.commandFrames[ ( tfmP.SET_FRAME_RATE, tfmP.FRAME_100)]
+
+# - - - - - - - - - - - -  asyncio  - - - - - - - - - - - - - -
+#  An emulated device that answers no command.
+class MuteEmulator( Emulator):
+    def command( self, cmnd, now):
+        pass
+
+#  A distance that is the time it was measured, in 10ms units,
+#  and the age in seconds of a frame with that distance.
+def clockDistance( t):
+    return int( t % 300 * 100)
+
+def frameAge( dist):
+    return ( clockDistance( time.monotonic()) - dist) % 30000 / 100
+
+#  'begin()' is ready on the first frame, and fails on a silent
+#  port after 'TFMP_READY_TIMEOUT'.
+def test_async_begin():
+    async def check():
+        with Emulator( frameRate = 100, baud = 115200, distance = lambda t: 234) as emu:
+            sensor = AsyncTFMPlus()
+            start = time.monotonic()
+            assert await sensor.begin( emu.port, 115200)
+            assert time.monotonic() - start < tfmP.TFMP_READY_TIMEOUT
+            assert await sensor.getData() and sensor.dist == 234
+            sensor.close()
+        master, slave = pty.openpty()
+        sensor = AsyncTFMPlus()
+        start = time.monotonic()
+        assert not await sensor.begin( os.ttyname( slave), 115200)
+        assert sensor.status == tfmP.TFMP_SERIAL
+        assert time.monotonic() - start >= tfmP.TFMP_READY_TIMEOUT
+        sensor.close()
+        os.close( slave)
+        os.close( master)
+    asyncio.run( check())
+
+#  'frames()' yields every frame in order, and ends when the
+#  port is closed.
+def test_async_frames():
+    async def check():
+        with Emulator( frameRate = 1000, baud = 921600, distance = clockDistance) as emu:
+            sensor = AsyncTFMPlus()
+            assert await sensor.begin( emu.port, 921600)
+            frames = []
+            async for frame in sensor.frames():
+                frames.append( frame)
+                if( len( frames) == 500):
+                    sensor.close()
+            assert emu.bytesLost == 0
+        assert len( frames) >= 500
+        assert all( ( b[ 1] - a[ 1]) % 30000 < 100 for a, b in zip( frames, frames[ 1:]))
+        assert all( f[ 4] == tfmP.TFMP_READY for f in frames)
+        assert sensor.clock.dropped == 0 and sensor.overruns == 0
+    asyncio.run( check())
+
+#  A command with no reply fails after its time limit, and one
+#  waiting when the port is lost fails at once.
+def test_async_command_timeout():
+    async def check():
+        with MuteEmulator( frameRate = 100, baud = 115200) as emu:
+            sensor = AsyncTFMPlus()
+            assert await sensor.begin( emu.port, 115200)
+            start = time.monotonic()
+            assert not await sensor.sendCommand( tfmP.SET_FRAME_RATE, tfmP.FRAME_250)
+            assert sensor.status == tfmP.TFMP_HEADER
+            assert tfmP.TFMP_REPLY_TIMEOUT <= time.monotonic() - start < 0.2
+            assert await sensor.getData()
+            threading.Timer( 0.05, emu.close).start()
+            start = time.monotonic()
+            assert not await sensor.sendCommand( tfmP.SAVE_SETTINGS, 0, timeout = 5.0)
+            assert sensor.status == tfmP.TFMP_SERIAL
+            assert time.monotonic() - start < 0.5
+            assert not await sensor.sendCommand( tfmP.SET_FRAME_RATE, tfmP.FRAME_250)
+            assert sensor.status == tfmP.TFMP_SERIAL
+    asyncio.run( check())
+
+#  With nothing read the port stops being read once the queue
+#  is full, and 'getData()' then returns a new frame, not one
+#  from the backlog.
+def test_async_backpressure():
+    async def check():
+        with Emulator( frameRate = 1000, baud = 921600, distance = clockDistance) as emu:
+            sensor = AsyncTFMPlus( maxFrames = 64)
+            assert await sensor.begin( emu.port, 921600)
+            await asyncio.sleep( 1.0)
+            assert sensor.paused and len( sensor.queue) >= 64
+            assert await sensor.getData()
+            assert frameAge( sensor.dist) < 0.05
+            assert not sensor.paused and sensor.overruns >= 64
+            for i in range( 200):
+                assert await sensor.getData()
+            assert frameAge( sensor.dist) < 0.05
+            sensor.close()
+    asyncio.run( check())
+
+# - - - - - - - - - - - -  Emulator  - - - - - - - - - - - - -
+#  Custom baud rates are told apart: a host at 56000 gets only
+#  noise from a device at 14400.
+def test_emulator_baud():
+    with Emulator( frameRate = 100, baud = 14400) as emu:
+        sensor = tfmP.TFMPlus()
+        assert not sensor.begin( emu.port, 56000)
+        sensor.pStream.close()
+        assert sensor.begin( emu.port, 14400)
+        assert sensor.getData()
+        sensor.pStream.close()
+
+#  Settings are lost by a reset unless saved, and a factory reset
+#  brings back the factory baud rate and frame rate.
+def test_emulator_settings():
+    with Emulator( frameRate = 100, baud = 115200) as emu:
+        sensor = tfmP.TFMPlus()
+        assert sensor.begin( emu.port, 115200)
+        assert sensor.sendCommand( tfmP.SET_FRAME_RATE, tfmP.FRAME_250)
+        assert sensor.sendCommand( tfmP.SOFT_RESET, 0)
+        assert emu.frameRate == 100
+        assert sensor.sendCommand( tfmP.SET_FRAME_RATE, tfmP.FRAME_250)
+        assert sensor.sendCommand( tfmP.SET_BAUD_RATE, tfmP.BAUD_460800)
+        sensor.pStream.baudrate = 460800
+        assert sensor.sendCommand( tfmP.SAVE_SETTINGS, 0)
+        assert sensor.sendCommand( tfmP.SOFT_RESET, 0)
+        assert ( emu.baud, emu.frameRate) == ( 460800, 250)
+        time.sleep( 0.05)
+        assert sensor.getData()
+        assert sensor.sendCommand( tfmP.HARD_RESET, 0)
+        assert ( emu.baud, emu.frameRate) == ( 115200, 100)
+        sensor.pStream.baudrate = 115200
+        assert sensor.sendCommand( tfmP.SOFT_RESET, 0)
+        assert ( emu.baud, emu.frameRate) == ( 115200, 100)
+        sensor.pStream.close()
+
+# - - - - - - - - - - - -  Triggered measurement  - - - - - - -
+#  An emulated device that answers only its first 'answers'
+#  triggers.
+class DeafEmulator( Emulator):
+    answers = 0
+    def command( self, cmnd, now):
+        if( cmnd[ 2] == 0x04):       # TRIGGER_DETECTION
+            if( self.answers <= 0):
+                return
+            self.answers -= 1
+        Emulator.command( self, cmnd, now)
+
+#  In triggered mode the device sends a frame for each trigger
+#  and no others, with or without the reader thread.
+def test_trigger():
+    with Emulator( frameRate = 100, baud = 115200, distance = lambda t: 321) as emu:
+        sensor = tfmP.TFMPlus()
+        assert sensor.begin( emu.port, 115200)
+        assert sensor.triggerMode()
+        assert emu.frameRate == 0
+        time.sleep( 0.1)
+        assert not sensor.getFrames()[ 0]
+        frame = sensor.measure_now()
+        assert frame is not None
+        assert frame[ 0] == 0 and frame[ 2] == 321 and frame[ 5] == tfmP.TFMP_READY
+        frames = sensor.measure_many( 50)
+        assert len( frames) == 50
+        assert [ f[ 0] for f in frames] == list( range( 1, 51))
+        assert all( a[ 1] <= b[ 1] for a, b in zip( frames, frames[ 1:]))
+        assert all( f[ 2] == 321 for f in frames)
+        assert sensor.triggers == 51 and sensor.triggerLatency.count == 51
+        assert sensor.triggerLatency.high < tfmP.TFMP_REPLY_TIMEOUT
+        assert not sensor.getFrames()[ 0]
+        sensor.startStream()
+        seq = sensor.ring.seq
+        frames = sensor.measure_many( 20)
+        assert [ f[ 0] for f in frames] == list( range( seq, seq + 20))
+        assert sensor.ring.seq == seq + 20
+        assert sensor.dist == 321 and sensor.status == tfmP.TFMP_READY
+        sensor.stopStream()
+        sensor.pStream.close()
+
+#  A trigger that is not answered ends the measurement after
+#  'timeout', with the frames that did arrive and status HEADER.
+def test_trigger_timeout():
+    with DeafEmulator( frameRate = 100, baud = 115200) as emu:
+        sensor = tfmP.TFMPlus()
+        assert sensor.begin( emu.port, 115200)
+        assert sensor.triggerMode()
+        start = time.monotonic()
+        assert sensor.measure_now( timeout = 0.05) is None
+        assert 0.05 <= time.monotonic() - start < 0.15
+        assert sensor.status == tfmP.TFMP_HEADER
+        emu.answers = 7
+        frames = sensor.measure_many( 20, timeout = 0.05)
+        assert len( frames) == 7
+        assert sensor.status == tfmP.TFMP_HEADER
+        assert sensor.triggerLatency.count == 7
+        sensor.pStream.close()
+
+# - - - - - - - - - - - -  Filters  - - - - - - - - - - - - - -
+#  The two heap median matches a sort of each window, one sample
+#  at a time or in runs, and its heaps stay bounded.
+def test_median():
+    rand = random.Random( 3)
+    for window in range( 1, 10):
+        values = [ rand.randint( 0, rand.choice( ( 3, 100))) for i in range( 500)]
+        expect = []
+        for k in range( len( values)):
+            part = sorted( values[ max( k - window + 1, 0): k + 1])
+            half = len( part) >> 1
+            expect.append( part[ half] if len( part) & 1 else ( part[ half - 1] + part[ half]) / 2)
+        median = Median( window)
+        assert [ median.update( x) for x in values] == expect
+        median, got, i = Median( window), [], 0
+        while( i < len( values)):
+            k = rand.randint( 1, 20)
+            if( i & 1):
+                got += median.run( array( 'd', values[ i: i + k]))
+            else:
+                got += [ median.update( x) for x in values[ i: i + k]]
+            i += k
+        assert got == expect
+    median = Median( 5)
+    median.run( array( 'd', range( 10000)))
+    assert len( median.low) + len( median.high) <= 10
+
+#  'run()' on an array in pieces gives the same values as
+#  'update()' on each sample, and both follow the recurrences.
+def test_ema_kalman():
+    rand = random.Random( 5)
+    values = [ rand.randint( 100, 120) for i in range( 300)]
+    for make in ( lambda: EMA( 0.3), lambda: Kalman( 1.0, 4.0)):
+        one = make()
+        expect = [ one.update( x) for x in values]
+        stage, got, i = make(), [], 0
+        while( i < len( values)):
+            k = rand.randint( 1, 20)
+            got += stage.run( array( 'd', values[ i: i + k]))
+            i += k
+        assert all( abs( a - b) < 1e-9 for a, b in zip( got, expect))
+        assert len( got) == len( expect)
+        assert len( stage.run( array( 'd'))) == 0
+    #  A step from 0 to 100 closes by 'alpha' a sample.
+    ema = EMA( 0.25)
+    ema.update( 0)
+    steps = ema.run( array( 'd', [ 100] * 10))
+    assert all( abs( y - 100 * ( 1 - 0.75 ** ( k + 1))) < 1e-9 for k, y in enumerate( steps))
+    #  The variance of the estimate settles at the root of
+    #  p * p + q * p - q * r = 0, and a constant is kept.
+    kalman = Kalman( 1.0, 4.0)
+    assert list( kalman.run( array( 'd', [ 250] * 100))) == [ 250.0] * 100
+    p = ( math.sqrt( 1.0 + 16.0) - 1.0) / 2
+    assert abs( kalman.p - p) < 1e-9
+    kalman.reset()
+    assert kalman.value is None and kalman.p == 4.0
+
+#  Frames with a WEAK, STRONG or FLOOD status are dropped by
+#  both 'update()' and 'run()', and counted in 'dropped'.
+def test_pipeline_drops():
+    frames = [ ( 100, 500), ( -1, 50), ( 102, -1), ( -4, 800), ( 104, 500),
+               ( -1, -1), ( 106, 500), ( 0, 0), ( -4, -1)]
+    valid = [ d for d, f in frames if tfmP.frameStatus( d, f) == tfmP.TFMP_READY]
+    assert valid == [ 100, 104, 106, 0]
+    one = Pipeline( Median( 3), EMA( 0.5))
+    expect = [ one.update( d, f) for d, f in frames]
+    assert [ e is None for e in expect] == [ tfmP.frameStatus( d, f) != tfmP.TFMP_READY for d, f in frames]
+    assert one.dropped == 5
+    bulk = Pipeline( Median( 3), EMA( 0.5))
+    dists = array( 'h', [ d for d, f in frames])
+    fluxes = array( 'h', [ f for d, f in frames])
+    assert list( bulk.run( dists, fluxes)) == [ e for e in expect if e is not None]
+    assert bulk.dropped == 5
+    assert list( Pipeline().run( dists, fluxes)) == valid
+    assert len( bulk.run( array( 'h', [ -1, -4]), array( 'h', [ 0, 0]))) == 0
+    assert bulk.dropped == 7
+
+# - - - - - - - - - - - -  Shared memory  - - - - - - - - - - -
+#  Frames published are read back in order, a subscriber that
+#  ends does not remove the ring, and overwritten frames are
+#  counted, not returned.
+def test_shared():
+    with Publisher( size = 64) as publisher:
+        subscriber = Subscriber( publisher.name)
+        publisher.write( 10.0, array( 'h', range( 100, 150)), array( 'h', [ 300] * 50),
+                         array( 'h', [ 35] * 50), 0, 0.01)
+        frames = subscriber.read()
+        assert [ f[ 0] for f in frames] == list( range( 50))
+        assert [ f[ 2] for f in frames] == list( range( 100, 150))
+        assert math.isclose( frames[ 0][ 1], 9.51) and frames[ -1][ 1] == 10.0
+        assert subscriber.get( 49) == frames[ -1] and subscriber.get( 50) is None
+        code = 'import sys; sys.path.insert( 0, sys.argv[ 1]);' \
+               'from tfmp_shared import Subscriber; print( Subscriber( sys.argv[ 2]).latest()[ 0])'
+        folder = os.path.join( os.path.dirname( __file__), '..')
+        result = subprocess.run( [ sys.executable, '-c', code, folder, publisher.name],
+                                 capture_output = True, text = True, timeout = 30)
+        assert result.stdout.strip() == '49' and 'leaked' not in result.stderr
+        for i in range( 100):
+            publisher.push( 11.0 + i, i, 300, 35)
+        assert len( subscriber.read()) == 64
+        assert subscriber.overruns == 150 - 64 - 50
+        assert Subscriber( publisher.name).latest()[ 0] == 149
+        subscriber.close()
+
+#  A read that finds every slot overwritten while it copies
+#  still moves on, so the frames are not counted lost again.
+def test_shared_overrun():
+    with Publisher( size = 64) as publisher:
+        subscriber = Subscriber( publisher.name)
+        for i in range( 64):
+            publisher.push( 1.0 + i, i, 300, 35)
+        seq = subscriber.seq
+        def racing():
+            last = seq()
+            for i in range( 64):
+                publisher.push( 100.0 + i, 1000 + i, 300, 35)
+            return last
+        subscriber.seq = racing
+        assert subscriber.read() == []
+        assert subscriber.overruns == 64 and subscriber.next == 64
+        subscriber.seq = seq
+        frames = subscriber.read()
+        assert [ f[ 2] for f in frames] == list( range( 1000, 1064))
+        assert subscriber.overruns == 64 and subscriber.next == 128
+        assert subscriber.read() == [] and subscriber.next == 128
+        subscriber.close()
+
+# - - - - - - - - - - - -  Link setup  - - - - - - - - - - - - -
+#  An emulated device that takes no baud rate above 460800.  It
+#  echoes the command at the old rate, as if it were taken.
+class SlowEmulator( Emulator):
+    def command( self, cmnd, now):
+        if( cmnd[ 2] == 0x06 and int.from_bytes( cmnd[ 3:6], 'little') > 460800):
+            self.write( cmnd)
+        else:
+            super().command( cmnd, now)
+
+#  The device is stepped up to the fastest baud rate and frame
+#  rate allowed, and the result is saved.
+def test_configure():
+    with Emulator( frameRate = 100, baud = 115200) as emu:
+        sensor = tfmP.TFMPlus()
+        result = autoConfigure( sensor, emu.port, maxBaud = 460800, maxRate = 250, seconds = 0.3)
+        assert result == ( 460800, 250)
+        assert ( emu.baud, emu.frameRate) == result
+        assert sensor.pStream.baudrate == 460800
+        sensor.pStream.close()
+
+#  A baud rate the device does not take is rolled back, and the
+#  next one down is used.
+def test_configure_rollback():
+    with SlowEmulator( frameRate = 100, baud = 115200) as emu:
+        sensor = tfmP.TFMPlus()
+        result = autoConfigure( sensor, emu.port, maxRate = 100, seconds = 0.3)
+        assert result == ( 460800, 100)
+        assert ( emu.baud, emu.frameRate) == result
+        flush( sensor)
+        assert countFrames( sensor, 0.2)[ 0] >= 15
+        sensor.pStream.close()
+
+#  An emulated device that loses frames above 'limit' baud.
+class LossyEmulator( Emulator):
+    limit = 115200
+    def command( self, cmnd, now):
+        super().command( cmnd, now)
+        if( cmnd[ 2] == 0x06):
+            self.dropRate = 0.2 if self.baud > self.limit else 0.0
+
+#  An emulated device that stops answering once asked to save.
+class FailingEmulator( Emulator):
+    def command( self, cmnd, now):
+        if( cmnd[ 2] == 0x11):
+            self.output = False
+            self.command = lambda cmnd, now: None
+        else:
+            super().command( cmnd, now)
+
+#  A baud rate the device takes but loses frames at is rolled
+#  back too.
+def test_configure_drops():
+    with LossyEmulator( frameRate = 100, baud = 115200) as emu:
+        sensor = tfmP.TFMPlus()
+        result = autoConfigure( sensor, emu.port, maxRate = 100, seconds = 0.3)
+        assert result == ( 115200, 100)
+        assert ( emu.baud, emu.frameRate, emu.dropRate) == ( 115200, 100, 0.0)
+        sensor.pStream.close()
+
+#  A device in triggered mode is found by its command reply and
+#  left in triggered mode.
+def test_configure_trigger():
+    with Emulator( frameRate = 0, baud = 115200) as emu:
+        sensor = tfmP.TFMPlus()
+        saved = dict( emu.saved)
+        assert autoConfigure( sensor, emu.port, seconds = 0.3) == ( 115200, 0)
+        assert ( emu.baud, emu.frameRate) == ( 115200, 0)
+        assert emu.saved == saved
+        sensor.pStream.close()
+
+#  A device that cannot be put back after a failed step is
+#  reported as lost.
+def test_configure_lost():
+    with FailingEmulator( frameRate = 100, baud = 115200) as emu:
+        sensor = tfmP.TFMPlus()
+        assert autoConfigure( sensor, emu.port, maxBaud = 115200, maxRate = 250,
+                              seconds = 0.3) == ( 0, 0)
+        sensor.pStream.close()
+
+#  A device left at an unknown baud rate is found.
+def test_find_baud():
+    with Emulator( frameRate = 100, baud = 19200) as emu:
+        sensor = tfmP.TFMPlus()
+        assert findBaud( sensor, emu.port) == 19200
+        assert sensor.pStream.baudrate == 19200
+        sensor.pStream.close()
+
+# - - - - - - - - - - - -  Output formats  - - - - - - - - - - -
+#  Distances are given in the unit the device sends, unless the
+#  decoder is asked for one.
+def test_mm_format():
+    sensor = tfmP.TFMPlus()
+    sensor.decoder.setFormat( tfmP.STANDARD_FORMAT_MM)
+    sensor.pStream = MemoryStream( makeFrame( 1234) + makeFrame( -1))
+    assert list( sensor.getFrames()[ 0]) == [ 1234, -1]
+    sensor.decoder.millimeters = False
+    sensor.pStream = MemoryStream( makeFrame( 1234))
+    assert list( sensor.getFrames()[ 0]) == [ 123]
+    with Emulator( frameRate = 100, baud = 115200, distance = lambda t: 123) as emu:
+        sensor = tfmP.TFMPlus()
+        assert sensor.begin( emu.port, 115200)
+        assert sensor.getData() and sensor.dist == 123
+        assert sensor.sendCommand( tfmP.STANDARD_FORMAT_MM, 0)
+        time.sleep( 0.05)
+        sensor.getFrames()
+        assert sensor.getData() and sensor.dist == 1230
+        sensor.pStream.close()
+    bus = FakeI2CBus()
+    bus.addDevice( distance = lambda t: 123)
+    sensor = TFMPlusI2C( bus, format = tfmP.I2C_FORMAT_MM)
+    assert sensor.getData() and sensor.dist == 1230
+    sensor.setFormat( tfmP.I2C_FORMAT_CM)
+    assert sensor.getData() and sensor.dist == 123
+
+# - - - - - - - - - - - -  I2C  - - - - - - - - - - - - - - - -
+#  A group reads every device in one transaction a cycle, at
+#  no more than the frame rate over 2.5.
+def test_i2c_group():
+    assert I2CGroup( FakeI2CBus(), frameRate = 100).readRate == 40
+    assert I2CGroup( FakeI2CBus(), frameRate = 1000).readRate == 100
+    assert I2CGroup( FakeI2CBus(), frameRate = 1000, readRate = 400).readRate == 400
+    for frameRate, readRate in ( ( 100, 41), ( 250, 101), ( 100, 0)):
+        try:
+            I2CGroup( FakeI2CBus(), frameRate = frameRate, readRate = readRate)
+            assert False
+        except ValueError:
+            pass
+    bus = FakeI2CBus()
+    devices = [ bus.addDevice( 0x10 + i, 250, distance = lambda t, i = i: 100 + i) for i in range( 3)]
+    with I2CGroup( bus, frameRate = 250) as group:
+        assert group.readRate == 100
+        for i in range( 3):
+            group.add( 'lidar%d' % i, 0x10 + i)
+        try:
+            group.setReadRate( 101)
+            assert False
+        except ValueError:
+            assert group.readRate == 100
+        start = time.monotonic()
+        records = [ group.poll() for i in range( 20)]
+        assert 0.18 <= time.monotonic() - start < 0.3
+        assert bus.transactions == 20 and bus.messages == 120
+        assert all( [ r[ 0] for r in batch] == [ 'lidar0', 'lidar1', 'lidar2'] for batch in records)
+        assert all( [ r[ 2] for r in batch] == [ 100, 101, 102] for batch in records)
+        assert sum( d.staleReads for d in devices) <= 2
+        #  A device that does not answer is left out of the batch.
+        missing = bus.devices.pop( 0x11)
+        transactions = bus.transactions
+        assert [ r[ 0] for r in group.cycle()] == [ 'lidar0', 'lidar2']
+        sensor = group.sensors[ 'lidar1']
+        assert group.failures == 1 and 'lidar1' in group.missing
+        assert sensor.status == tfmP.TFMP_I2CNACK
+        assert sensor.statusCounts[ tfmP.TFMP_I2CNACK] == 1
+        assert len( group.cycle()) == 2
+        assert bus.transactions - transactions == 1 + 3 + 1
+        bus.devices[ 0x11] = missing
+        group.missing[ 'lidar1'] = 0.0      #  tried now, not in a second
+        assert sorted( r[ 0] for r in group.cycle()) == [ 'lidar0', 'lidar1', 'lidar2']
+        assert not group.missing
+        assert len( group.cycle()) == 3 and group.failures == 1
+
+#  A failed read returns no frame and is told apart from a frame
+#  that was read with a WEAK, STRONG or FLOOD status.
+def test_i2c_status():
+    bus = FakeI2CBus()
+    bus.addDevice( 0x10, distance = lambda t: -1)
+    sensor = TFMPlusI2C( bus, 0x10)
+    dists, fluxes, temps = sensor.getFrames()
+    assert list( dists) == [ -1] and sensor.status == tfmP.TFMP_WEAK
+    sensor.address = 0x20
+    sensor.cycle = None
+    dists, fluxes, temps = sensor.getFrames()
+    assert not dists and sensor.status == tfmP.TFMP_I2CNACK
+    assert sensor.statusCounts[ tfmP.TFMP_I2CNACK] == 1
+    assert sensor.statusCounts[ tfmP.TFMP_WEAK] == 1
+
+# - - - - - - - - - - - -  Frame timing  - - - - - - - - - - -
+#  Reads of a device 100ppm slow, up to 2ms late, with bursts of
+#  lost frames: every lost frame is counted once, the period is
+#  found to a few ppm, and frame times follow the device.
+def test_frame_clock():
+    period = 0.01 * ( 1 + 100e-6)
+    byteTime = 10 / 115200
+    for nominal in ( None, 100):
+        rand = random.Random( 7)
+        clock = tfmP.FrameClock( nominal, 115200)
+        k, lost, times = 0, 0, []
+        while( k < 5000):
+            if( k > 500 and k % 700 == 0):
+                gap = rand.randint( 1, 5)
+                k += gap
+                lost += gap
+            count = 3 if k % 50 == 0 else 1
+            k += count
+            sent = 1000.0 + ( k - 1) * period
+            stamp = clock.update( sent + tfmP.TFMP_FRAME_SIZE * byteTime + rand.uniform( 0, 0.002), count, 0)
+            times.append( ( sent, stamp))
+        assert clock.frames == k - lost
+        assert clock.dropped == lost
+        assert abs( clock.period / period - 1) < 5e-6
+        stats = clock.stats()
+        if( nominal):
+            assert abs( stats[ 'drift_ppm'] - 100) < 5
+        else:
+            assert stats[ 'drift_ppm'] == 0.0
+        settled = times[ 1000:]
+        assert all( 0 <= stamp - sent < 0.002 for sent, stamp in settled)
+        assert all( a[ 1] < b[ 1] for a, b in zip( settled, settled[ 1:]))
+        last = clock.stamps( 3)
+        assert last[ -1] == clock.last and math.isclose( last[ -1] - last[ 0], 2 * clock.period)
+        #  A restart is not a gap.
+        clock.restart()
+        clock.update( times[ -1][ 0] + 10.0, 1, 0)
+        assert clock.dropped == lost
+    #  In triggered mode each frame stands alone.
+    clock = tfmP.FrameClock( 0, 115200)
+    for stamp in ( 5.0, 5.3, 9.1):
+        assert clock.update( stamp, 1, 0) == stamp - tfmP.TFMP_FRAME_SIZE * byteTime
+    assert clock.dropped == 0 and clock.period == 0.0 and clock.frames == 3
+
+# - - - - - - - - - - - -  Ring buffer  - - - - - - - - - - - -
+def test_ring():
+    ring = tfmP.FrameRing( 8)
+    assert ring.latest() is None
+    assert ring.wait_next( 0.01) is None
+    for i in range( 20):
+        ring.push( float( i), i, 0, 0, 0)
+    assert ring.latest() == ( 19, 19.0, 19, 0, 0, 0)
+    frames = ring.since( 0)
+    assert [ f[ 0] for f in frames] == list( range( 13, 20))
+    assert ring.overruns == 13
+    assert ring.wait_next( 0, 5) == ring.get( 5)
+    threading.Timer( 0.02, lambda: ( ring.push( 20.0, 20, 0, 0, 0), ring.notify())).start()
+    assert ring.wait_next( 1.0)[ 0] == 20
+    ring.end()
+    assert ring.wait_next() is None
+
+# - - - - - - - - - - - -  Metrics  - - - - - - - - - - - - - -
+#  Parse Prometheus text into the 'TYPE' of each metric and the
+#  value of each sample by ( name, labels).
+def parseMetrics( text):
+    types, samples = {}, {}
+    assert text.endswith( '\n')
+    for line in text.splitlines():
+        if( line.startswith( '# TYPE ')):
+            name, kind = line[ 7:].split( ' ')
+            types[ name] = kind
+        elif( line.startswith( '# HELP ')):
+            assert len( line[ 7:].split( ' ', 1)) == 2
+        else:
+            match = re.fullmatch( r'(\w+)\{(.*)\} (\S+)', line)
+            assert match is not None, line
+            labels = tuple( re.findall( r'(\w+)="((?:[^"\\]|\\.)*)"', match[ 2]))
+            samples[ ( match[ 1], labels)] = float( match[ 3])
+    return types, samples
+
+#  Every counter, gauge and histogram of 'metrics()' is in the
+#  text, labelled by device, the same from the server as from
+#  'formatMetrics()'.
+def test_metrics_text():
+    frames = [ makeFrame( 100), makeFrame( -1, 20), makeFrame( 120, -1),
+               makeFrame( -4), makeFrame( 130)]
+    front, rear = tfmP.TFMPlus(), tfmP.TFMPlus()
+    front.pStream = MemoryStream( b''.join( frames) + b'\x01\x02')
+    front.getFrames()
+    front.pStream = MemoryStream( makeFrame( 140))
+    front.getFrames()
+    rear.pStream = MemoryStream( makeFrame( 50))
+    rear.getFrames()
+    devices = { 'front': front, 'rear "2"': rear}
+    text = formatMetrics( devices)
+    types, samples = parseMetrics( text)
+    f, r = ( ( 'sensor', 'front'),), ( ( 'sensor', 'rear \\"2\\"'),)
+    assert samples[ ( 'tfmplus_frames_total', f)] == 6
+    assert samples[ ( 'tfmplus_frames_total', r)] == 1
+    assert samples[ ( 'tfmplus_weak_frames_total', f)] == 1
+    assert samples[ ( 'tfmplus_strong_frames_total', f)] == 1
+    assert samples[ ( 'tfmplus_flood_frames_total', f)] == 1
+    assert samples[ ( 'tfmplus_bytes_discarded_total', f)] == 2
+    for name, kind in types.items():
+        assert kind in ( 'counter', 'gauge', 'histogram')
+        if( kind == 'counter'):
+            assert name.endswith( '_total')
+        for labels in ( f, r):
+            if( kind != 'histogram'):
+                assert ( name, labels) in samples
+                continue
+            #  Buckets count up to '+Inf', which is the count.
+            buckets = sorted( ( float( dict( key[ 1])[ 'le']), value)
+                              for key, value in samples.items()
+                              if key[ 0] == name + '_bucket' and key[ 1][ 0] == labels[ 0])
+            assert buckets and buckets[ -1][ 0] == math.inf
+            assert all( a[ 1] <= b[ 1] for a, b in zip( buckets, buckets[ 1:]))
+            assert buckets[ -1][ 1] == samples[ ( name + '_count', labels)]
+            assert ( name + '_sum', labels) in samples
+    assert samples[ ( 'tfmplus_frame_gap_seconds_count', f)] == 1
+    assert len( types) == 16
+    with MetricsServer( devices, port = 0) as server:
+        url = 'http://127.0.0.1:%d' % server.port
+        with urllib.request.urlopen( url + '/metrics', timeout = 5) as reply:
+            assert reply.headers[ 'Content-Type'].startswith( 'text/plain; version=0.0.4')
+            assert reply.read().decode() == text
+        try:
+            urllib.request.urlopen( url + '/other', timeout = 5)
+            assert False
+        except urllib.error.HTTPError as e:
+            assert e.code == 404
+
+#  With TFMP_NO_METRICS set when 'tfmplus' is loaded, frames are
+#  decoded and no counter is touched.
+def test_no_metrics():
+    code = 'import sys; sys.path.insert( 0, sys.argv[ 1]); import tfmplus\n' \
+           'from array import array\n' \
+           'sensor = tfmplus.TFMPlus()\n' \
+           'dists, fluxes, temps = array( "h"), array( "h"), array( "h")\n' \
+           'for i in range( 2):\n' \
+           '    sensor.rxBuffer.extend( bytes.fromhex( sys.argv[ 2]))\n' \
+           '    sensor.syncFrames( dists, fluxes, temps)\n' \
+           'm = sensor.metrics()\n' \
+           'print( tfmplus.TFMP_METRICS, len( dists), m[ "frames"], m[ "weak"], m[ "frame_gap"][ "count"])'
+    folder = os.path.join( os.path.dirname( __file__), '..')
+    data = ( makeFrame( 100) + makeFrame( -1, 20) + makeFrame( 120)).hex()
+    results = []
+    for value in ( None, '1'):
+        env = dict( os.environ)
+        env.pop( 'TFMP_NO_METRICS', None)
+        if( value is not None):
+            env[ 'TFMP_NO_METRICS'] = value
+        result = subprocess.run( [ sys.executable, '-c', code, folder, data], env = env,
+                                 capture_output = True, text = True, timeout = 30)
+        assert result.returncode == 0, result.stderr
+        results.append( result.stdout.split())
+    assert results == [ [ 'True', '6', '6', '2', '3'], [ 'False', '6', '0', '0', '0']]
+
+# - - - - - - - - - - - -  Record and replay  - - - - - - - - -
+#  A recording replays to the same frames as were decoded live.
+def test_record_replay():
+    with tempfile.TemporaryDirectory() as folder, Emulator( frameRate = 500, baud = 115200) as emu:
+        path = os.path.join( folder, 'run.tfmp')
+        sensor = tfmP.TFMPlus()
+        assert sensor.begin( emu.port, 115200)
+        sensor.getFrames()
+        sensor.record( path)
+        live = array( 'h')
+        stop = time.monotonic() + 0.5
+        while( time.monotonic() < stop):
+            dists, fluxes, temps = sensor.getFrames()
+            live.extend( dists)
+            time.sleep( 0.01)
+        sensor.stopRecord()
+        sensor.pStream.close()
+        replay = tfmP.TFMPlus()
+        replay.pStream = ReplayStream( path, speed = None)
+        played = array( 'h')
+        while( True):
+            dists, fluxes, temps = replay.getFrames()
+            if( not dists):
+                break
+            played.extend( dists)
+        replay.pStream.close()
+    assert len( live) > 200
+    #  A partial frame read before recording started is not in
+    #  the file, so the replay may lack the first frame.
+    assert played == live[ len( live) - len( played):]
+    assert len( live) - len( played) <= 2
+
+#  Each read is one record, and a recording is read back whole
+#  or from any time, with its index or without it.
+def test_record_index():
+    reads = [ bytes( ( i + k) & 0xFF for k in range( i % 40 + 1)) for i in range( 3000)]
+    with tempfile.TemporaryDirectory() as folder:
+        paths = [ os.path.join( folder, name) for name in ( 'closed.tfmp', 'open.tfmp')]
+        recorders = [ Recorder( path, 115200, 100) for path in paths]
+        for recorder in recorders:
+            for i, data in enumerate( reads):
+                recorder.write( data, 100.0 + i * 0.01)
+        recorders[ 0].close()
+        recorders[ 1].flush()
+        recorders[ 1].file.write( b'\x00' * 7)     #  a record cut short
+        recorders[ 1].file.close()
+        blocks = len( recorders[ 0].stamps)
+        size = sum( len( data) + RECORD_SIZE for data in reads)
+        assert os.path.getsize( paths[ 0]) == HEADER_SIZE + size + blocks * 16
+        for path in paths:
+            replay = ReplayStream( path, speed = None)
+            assert replay.count == len( reads)
+            assert replay.in_waiting > 0
+            assert replay.read( size) == b''.join( reads)
+            for i in ( 0, 1234, 2999):
+                replay.seek( 100.0 + i * 0.01 - 0.001)
+                assert replay.read( len( reads[ i])) == reads[ i]
+            replay.seek( 200.0)
+            assert replay.read( 10) == b''
+            replay.close()
+
+# - - - - - - - - - - - -  Frame store  - - - - - - - - - - - -
+def checkStore( store, frames, start, end):
+    values = [ d for s, d, f in frames if start <= s < end and tfmP.frameStatus( d, f) == 0]
+    summary = store.summary( start, end)
+    if( not values):
+        assert summary is None
+        return
+    assert ( summary.min, summary.max, summary.count) == ( min( values), max( values), len( values))
+    assert math.isclose( summary.mean, sum( values) / len( values))
+
+#  Summaries from the index match a scan of every frame.
+def test_store_summary():
+    rand = random.Random( 2)
+    with tempfile.TemporaryDirectory() as folder:
+        for path in ( None, os.path.join( folder, 'run.tfms')):
+            store = FrameStore( path, chunk = 1000)
+            frames = []
+            stamp = 100.0
+            for k in range( 600):
+                n = rand.randint( 1, 20)
+                dists = array( 'h', [ rand.randint( 1, 1200) if rand.random() > 0.02 else -1 for i in range( n)])
+                fluxes = array( 'h', [ rand.randint( 0, 500) for i in range( n)])
+                stamp += n * 0.002 + ( 3.0 if rand.random() < 0.01 else 0.0)
+                store.write( stamp, dists, fluxes, array( 'h', [ 2000] * n), 0, 0.002)
+                first = stamp - ( n - 1) * 0.002
+                frames += [ ( first + i * 0.002, dists[ i], fluxes[ i]) for i in range( n)]
+            assert len( store) == len( frames)
+            low, high = frames[ 0][ 0], frames[ -1][ 0]
+            for i in range( 100):
+                a = rand.uniform( low - 1, high + 1)
+                checkStore( store, frames, a, rand.uniform( a, high + 2))
+            checkStore( store, frames, -math.inf, math.inf)
+            store.close()
+            if( path is not None):
+                store = FrameStore.load( path)
+                assert len( store) == len( frames)
+                checkStore( store, frames, low + 1, high - 1)
+                store.close()
+
+#  A file store can still be queried once it is closed.
+def test_store_closed():
+    with tempfile.TemporaryDirectory() as folder:
+        store = FrameStore( os.path.join( folder, 'run.tfms'), chunk = 1000)
+        dists = array( 'h', [ 100 + i % 50 for i in range( 3000)])
+        store.write( 1000.0, dists, array( 'h', [ 500] * 3000), array( 'h', [ 2000] * 3000), 0, 0.001)
+        store.close()
+        summary = store.summary()
+        assert ( summary.min, summary.max, summary.count) == ( 100, 149, 3000)
+        stamps, found, fluxes, temps = store.frames( 997.9995, 998.9995)
+        assert list( found) == list( dists[ 999:1999])
+        assert store.series( width = 1)[ 1][ 0] == 100
+
+# - - - - - - - - - - - -  Bridge  - - - - - - - - - - - - - - -
+#  Push 'count' frames into 'ring', as a reader thread would.
+def fillRing( ring, count):
+    for i in range( count):
+        n = ring.seq
+        ring.push( time.monotonic(), n % 1000, 100, 35, 0)
+    ring.notify()
+
+#  Read 'client' until it has 'count' frames, or 'timeout'.
+def readFrames( client, count, timeout = 2.0):
+    frames = []
+    deadline = time.monotonic() + timeout
+    while( len( frames) < count and time.monotonic() < deadline):
+        frames += client.read( 0.05)
+    return frames
+
+#  Each client gets every frame of its step, in order, and
+#  commands need the bridge's token.
+def test_bridge():
+    sensor = tfmP.TFMPlus()
+    sensor.ring = tfmP.FrameRing()
+    with Bridge( sensor, port = 0, token = 'secret') as bridge:
+        clients = [ BridgeClient( '127.0.0.1', bridge.port, step = 1),
+                    BridgeClient( '127.0.0.1', bridge.port, step = 7)]
+        time.sleep( 0.05)
+        fillRing( sensor.ring, 700)
+        for client in clients:
+            frames = readFrames( client, 700 // client.step)
+            assert [ f[ 0] for f in frames] == list( range( 0, 700, client.step))
+            assert all( f[ 2] == f[ 0] % 1000 for f in frames)
+            assert client.lost == 0
+        assert not clients[ 0].sendCommand( tfmP.SET_FRAME_RATE, tfmP.FRAME_100)
+        assert clients[ 0].status == TFMP_REFUSED
+        for client in clients:
+            client.close()
+    assert bridge.dropped == 0
+
+#  A UDP subscription needs the token, to subscribe and to end.
+def test_bridge_udp():
+    sensor = tfmP.TFMPlus()
+    sensor.ring = tfmP.FrameRing()
+    for token in ( None, b'secret'):
+        with Bridge( sensor, port = 0, token = token) as bridge:
+            clients = [ BridgeClient( '127.0.0.1', bridge.port, 2, udp = True),
+                        BridgeClient( '127.0.0.1', bridge.port, 2, b'wrong', udp = True),
+                        BridgeClient( '127.0.0.1', bridge.port, 2, b'secret', udp = True)]
+            time.sleep( 0.05)
+            start = sensor.ring.seq
+            fillRing( sensor.ring, 100)
+            for client in clients:
+                frames = readFrames( client, 50, 0.3)
+                if( token is not None and client.token == token):
+                    assert [ f[ 0] for f in frames] == list( range( start, start + 100, 2))
+                else:
+                    assert not frames
+            assert len( bridge.udp) == ( token is not None)
+            for client in clients:
+                client.close()
+            time.sleep( 0.05)
+            assert not bridge.udp
+
+#  An authorised client's command reaches the device.
+def test_bridge_command():
+    with Emulator( frameRate = 100, baud = 115200) as emu:
+        sensor = tfmP.TFMPlus()
+        assert sensor.begin( emu.port, 115200, stream = True)
+        with Bridge( sensor, port = 0, token = b'secret') as bridge:
+            client = BridgeClient( '127.0.0.1', bridge.port, step = 10, token = b'secret')
+            assert readFrames( client, 5)
+            for cmnd, param in ( ( 0, 0), ( 0xFFFFFFFF, 0), ( tfmP.SET_FRAME_RATE, 0xFFFFFFFF)):
+                assert not client.sendCommand( cmnd, param)
+                assert client.status == TFMP_REFUSED
+            #  Rates not in 'baudRates' or 'frameRates' never reach
+            #  the device.
+            commands = emu.commands
+            for cmnd, param in ( ( tfmP.SET_FRAME_RATE, 7), ( tfmP.SET_FRAME_RATE, 0x10000),
+                                 ( tfmP.SET_BAUD_RATE, 12345), ( tfmP.SET_BAUD_RATE, tfmP.FRAME_100)):
+                assert not client.sendCommand( cmnd, param)
+                assert client.status == TFMP_REFUSED
+            assert emu.commands == commands
+            assert ( emu.frameRate, emu.baud) == ( 100, 115200)
+            assert client.sendCommand( tfmP.SET_FRAME_RATE, tfmP.FRAME_250)
+            assert client.status == tfmP.TFMP_READY
+            assert emu.frameRate == 250
+            client.close()
+        sensor.stopStream()
+        sensor.pStream.close()
+
+if __name__ == "__main__":
+    for name, check in list( globals().items()):
+        if( name.startswith( 'test_')):
+            start = time.monotonic()
+            check()
+            print( f"{name:32s} ok  {time.monotonic() - start:6.2f}s")
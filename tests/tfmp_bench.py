@@ -0,0 +1,983 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+# File Name: tfmp_bench.py
+# Inception: 17 OCT 2026
+#
+# Description: A Python script to measure the 'tfmplus' module
+# without a TFMini-Plus device.  Results are printed and can be
+# saved to a JSON file, so that one version of the module can
+# be compared with another.
+#
+#   overhead - Per-call cost of 'getData()' measured four ways:
+#                legacy  - the original module-global version,
+#                          with 'global' variables and a one
+#                          byte read loop
+#                module  - 'tfmplus.getData()'
+#                object  - 'sensor.getData()' on a 'TFMPlus'
+#                bound   - a bound method saved to a local name
+#   decode   - Frames per second decoded from memory by
+#              'decodeFrames()' and by 'getFrames()'.  Python
+#              has no allocation counter, so memory is shown as
+#              the net change in allocated blocks per frame and
+#              the peak of temporary memory while decoding.
+#   formats  - Frames per second decoded from memory by a
+#              'FrameDecoder' in each output format, in reads of
+#              1000 frames, with distances given in cm and in mm,
+#              and the time to find the format of the first read.
+#   resync   - Decode rate of a stream with bad checksums,
+#              dropped bytes and junk between frames, the frames
+#              recovered, and the cost of each fault.
+#   sync     - Through a pty: the CPU time 'getData()' uses while
+#              it waits on a silent port, next to that of polling
+#              the port in a loop, and the time from junk bytes
+#              followed by one good frame being written until
+#              'getData()' returns that frame, with the sync
+#              counters it leaves.
+#   link     - For every supported baud rate and frame rate,
+#              an emulator in another process sends frames to a
+#              streaming 'TFMPlus' object through a pty.  Shows
+#              the frames delivered per second, the p50 and p99
+#              time from frame sent to frame available to the
+#              consumer, and host CPU seconds per 10,000 frames.
+#   trigger  - With the emulator's frame rate at zero, the time
+#              from 'measure_now()' sending a trigger to its frame
+#              arriving, and the rate of a 'measure_many()' burst.
+#              Compared with streaming mode at 100Hz and 1000Hz,
+#              timed from a request at a random moment to the
+#              arrival of the next frame.
+#   timing   - With frames that carry the time they were sent,
+#              the error of each frame's time from 'FrameClock'
+#              next to that of the time of the read, and the
+#              frames it counts as dropped next to those really
+#              lost, with 1% of frames corrupted by the emulator.
+#              The port is read as frames arrive ('wait') or
+#              after random sleeps ('poll').  The emulator sends
+#              frames on a 1ms tick, so at 1000Hz its own output
+#              is up to a period late, which a real device's is
+#              not, and 'poll' then counts too many drops.
+#   reconnect - Time for 'begin()' to find the first frame, next
+#              to the fixed 200ms wait it had before, and with a
+#              'Supervisor' on a link to an emulator's port: the
+#              time from the link being removed to the outage
+#              being seen, and from it coming back to the first
+#              frame, as the emulator is closed and a new one
+#              started again and again.
+#   filter   - Cost per sample of each 'tfmp_filter' stage, one
+#              sample at a time and as a batch, next to a median
+#              that sorts a list of the window for every sample.
+#   record   - A recording of reads of 10 frames: cost per read
+#              to record, file bytes per frame, frames per second
+#              replayed and decoded as fast as possible, and the
+#              time of a 'seek()'.
+#   shared   - Cost per frame of publishing frames into shared
+#              memory and of reading them back with a 'Subscriber',
+#              next to sending the same frames, pickled, through a
+#              'multiprocessing' pipe.
+#   group    - 'SensorGroup' CPU time per 1000 frames as the
+#              number of devices grows, each fed 1000 frames per
+#              second.  Only the thread running 'poll()' counts.
+#   i2c      - With 8 emulated devices on a 'FakeI2CBus', the
+#              host cost of one 'I2CGroup' cycle, one transaction
+#              for all of them, next to a transaction for each
+#              device.  The fake bus makes no system call and
+#              takes no time on the wire, so the cost is mostly
+#              decoding, and what batching saves on a real bus is
+#              the ioctl for each device.  Then a second of
+#              polling at the read rate set by the 2.5 times rule,
+#              and at twice the frame rate, with the stale reads
+#              each gives.
+#   store    - A 'FrameStore' fed an hour of frames at 1000Hz in
+#              reads of 10: cost per frame to store, memory per
+#              frame next to three lists of the same values, and
+#              the time to find the minimum distance of the last
+#              5 minutes and the whole hour, next to a scan of
+#              the lists.  Then the same with the store spilled
+#              to a file.
+#   bridge   - Frames pushed into a ring buffer at 10kHz, as by
+#              a device's reader thread, and served by a 'Bridge'
+#              over loopback to TCP and UDP clients, some taking
+#              every frame and one every 10th.  Shows the frames
+#              each client receives per second and loses, the age
+#              of the oldest frame of each read, the frames sent
+#              per second in all and the bridge thread's CPU.
+#              The clients run as threads of the same process.
+#
+# Run from the repository folder:
+#   python tests/tfmp_bench.py [--quick] [--seconds S]
+#                              [--json FILE] [--compare FILE]
+# '--quick' runs 'link' for only a few rates.  '--compare'
+# prints each result of this run next to that of an older one.
+# To measure the cost of the decoder metrics, run once as usual
+# and once with TFMP_NO_METRICS=1 set, and compare the two.
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import os
+import gc
+import pty
+import sys
+import json
+import bisect
+import time
+import random
+import signal
+import timeit
+import argparse
+import tempfile
+import platform
+import threading
+import multiprocessing
+import subprocess
+import tracemalloc
+from array import array
+
+sys.path.insert( 0, os.path.join( os.path.dirname( __file__), '..'))
+import tfmplus as tfmP   # Import the `tfmplus` module
+from tfmp_group import SensorGroup
+from tfmp_emulator import Emulator
+from tfmp_filter import Pipeline, Median, EMA, Kalman
+from tfmp_shared import Publisher, Subscriber
+from tfmp_supervisor import Supervisor
+from tfmp_emulator import FakeI2CBus
+from tfmp_i2c import I2CGroup, I2C_M_RD
+from tfmp_store import FrameStore
+from tfmp_record import Recorder, ReplayStream
+from tfmp_bridge import Bridge, BridgeClient
+
+CALLS = 20000   # number of calls timed for each case
+
+BAUDS = ( 9600, 14400, 19200, 56000, 115200, 460800, 921600)
+RATES = ( 1, 2, 5, 10, 20, 25, 50, 100, 125, 200, 250, 500, 1000)
+QUICK_BAUDS = ( 115200, 921600)
+QUICK_RATES = ( 100, 1000)
+
+#  Build one valid data frame: Dist, Flux and Temp code
+def makeFrame( dist, flux, temp):
+    data = bytearray( b'\x59\x59')
+    data += dist.to_bytes( 2, 'little', signed = True)
+    data += flux.to_bytes( 2, 'little', signed = True)
+    data += ( ( temp + 256) << 3).to_bytes( 2, 'little')
+    data.append( sum( data) & 0xFF)
+    return bytes( data)
+
+#  In-memory serial port.  When empty, it is refilled with
+#  'data' so that every read finds more frames.
+class FakeStream:
+    def __init__( self, data):
+        self.data = data
+        self.buffer = bytearray()
+    def inWaiting( self):
+        if( not self.buffer):
+            self.buffer += self.data
+        return len( self.buffer)
+    def read( self, size = 1):
+        result = bytes( self.buffer[ :size])
+        del self.buffer[ :size]
+        return result
+
+#  Return the value at fraction 'p' of sorted 'values'.
+def percentile( values, p):
+    if( not values):
+        return None
+    return values[ min( len( values) - 1, int( p * len( values)))]
+
+# - - - - The original module-global 'getData()'  - - - -
+pStream = None
+status, dist, flux, temp = 0, 0, 0, 0
+
+def legacyGetData():
+    global status, dist, flux, temp
+    serialTimeout = time.time() + 1000
+    while( pStream.inWaiting() > tfmP.TFMP_FRAME_SIZE):
+        pStream.read()
+    frame = bytearray( tfmP.TFMP_FRAME_SIZE)
+    while( frame[ 0] != 0x59) or ( frame[ 1] != 0x59):
+        if pStream.inWaiting():
+            frame.append( pStream.read()[0])
+            frame = frame[ 1:]
+        if time.time() >  serialTimeout:
+            status = tfmP.TFMP_HEADER
+            return False
+    chkSum = 0
+    for i in range( tfmP.TFMP_FRAME_SIZE -1):
+        chkSum += frame[ i]
+    if( ( chkSum & 0xFF) != frame[ tfmP.TFMP_FRAME_SIZE -1]):
+        status = tfmP.TFMP_CHECKSUM
+        return False
+    dist = (frame[3] * 256) + frame[2]
+    flux = (frame[5] * 256) + frame[4]
+    temp = (frame[7] * 256) + frame[6]
+    temp = ( temp >> 3) - 256
+    status = tfmP.TFMP_READY
+    return True
+
+#  Time 'CALLS' calls and return microseconds per call.
+def perCall( function):
+    return min( timeit.repeat( function, number = CALLS, repeat = 3)) / CALLS * 1e6
+
+# - - - - - - - - - - - -  overhead  - - - - - - - - - - - - -
+def benchOverhead():
+    global pStream
+    frame = makeFrame( 123, 456, 35)
+    print( f"getData() per-call cost, {CALLS} calls, one frame waiting")
+    results = {}
+
+    pStream = FakeStream( frame)
+    results[ 'legacy_us'] = perCall( legacyGetData)
+
+    tfmP.device.pStream = FakeStream( frame)
+    results[ 'module_us'] = perCall( lambda: tfmP.getData())
+
+    sensor = tfmP.TFMPlus()
+    sensor.pStream = FakeStream( frame)
+    results[ 'object_us'] = perCall( lambda: sensor.getData())
+
+    results[ 'bound_us'] = perCall( sensor.getData)
+    for name, value in results.items():
+        print( f"  {name[ :-3]:7s} {value:7.2f} us")
+    return results
+
+# - - - - - - - - - - - -  decode  - - - - - - - - - - - - - -
+def benchDecode( frames = 100000):
+    print( f"Decode rate from memory, {frames} frames")
+    data = makeFrame( 123, 456, 35) * frames
+    dists, fluxes, temps = array( 'h'), array( 'h'), array( 'h')
+    start = time.perf_counter()
+    tfmP.decodeFrames( data, dists, fluxes, temps)
+    decodeRate = frames / ( time.perf_counter() - start)
+
+    #  'getFrames()' in reads of 1000 frames
+    chunk = 1000
+    sensor = tfmP.TFMPlus()
+    sensor.pStream = FakeStream( makeFrame( 123, 456, 35) * chunk)
+    getFrames = sensor.getFrames
+    getFrames()
+    start = time.perf_counter()
+    for i in range( frames // chunk):
+        getFrames()
+    elapsed = time.perf_counter() - start
+    #  Memory is measured apart, as tracemalloc slows everything.
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    for i in range( frames // chunk):
+        getFrames()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    gc.collect()
+    results = { 'decodeFrames_fps': decodeRate,
+                'getFrames_fps': frames / elapsed,
+                'net_blocks_per_frame': ( sys.getallocatedblocks() - blocks) / frames,
+                'peak_kib': peak / 1024 }
+    print( f"  decodeFrames: {decodeRate:12,.0f} frames/s")
+    print( f"  getFrames:    {results[ 'getFrames_fps']:12,.0f} frames/s")
+    print( f"  net blocks:   {results[ 'net_blocks_per_frame']:12.4f} per frame")
+    print( f"  peak memory:  {results[ 'peak_kib']:12.1f} KiB")
+    return results
+
+# - - - - - - - - - - - -  formats  - - - - - - - - - - - - -
+def benchFormats( frames = 100000, chunk = 1000):
+    print( f"Decode rate of each output format, {frames} frames")
+    binary = makeFrame( 345, 456, 35) * chunk
+    reads = { 'cm': ( tfmP.STANDARD_FORMAT_CM, binary),
+              'mm': ( tfmP.STANDARD_FORMAT_MM, binary),
+              'pixhawk': ( tfmP.PIXHAWK_FORMAT, b'3.45\r\n' * chunk) }
+    results = {}
+    for name, ( format, data) in reads.items():
+        for millimeters in ( False, True):
+            decoder = tfmP.FrameDecoder( format, millimeters)
+            dists, fluxes, temps = array( 'h'), array( 'h'), array( 'h')
+            start = time.perf_counter()
+            for i in range( frames // chunk):
+                decoder.frames( data, dists, fluxes, temps)
+                del dists[ :], fluxes[ :], temps[ :]
+            unit = 'mm' if millimeters else 'cm'
+            results[ f"{name}_{unit}_fps"] = frames / ( time.perf_counter() - start)
+        start = time.perf_counter()
+        for i in range( 100):
+            tfmP.FrameDecoder().frames( data, dists, fluxes, temps)
+            del dists[ :], fluxes[ :], temps[ :]
+        results[ f"{name}_detect_us"] = ( time.perf_counter() - start) / 100 * 1e6
+        print( f"  {name:8s} {results[ f'{name}_cm_fps']:12,.0f} frames/s in cm "
+               f"{results[ f'{name}_mm_fps']:12,.0f} frames/s in mm, "
+               f"first read {results[ f'{name}_detect_us']:7.1f} us")
+    return results
+
+# - - - - - - - - - - - -  resync  - - - - - - - - - - - - - -
+def benchResync( frames = 100000, rate = 0.02):
+    print( f"Decode rate with {rate:.0%} of frames corrupted in each of three ways")
+    emu = Emulator( seed = 1, distance = lambda t: 500)
+    clean = b''.join( emu.makeFrame( 0) for i in range( frames))
+    emu.checksumRate = emu.dropRate = emu.junkRate = rate
+    dirty = b''.join( emu.makeFrame( 0) for i in range( frames))
+    emu.close()
+    times = []
+    for data in ( clean, dirty):
+        dists, fluxes, temps = array( 'h'), array( 'h'), array( 'h')
+        start = time.perf_counter()
+        used, errors, good, misses = tfmP.decodeFrames( data, dists, fluxes, temps)
+        times.append( time.perf_counter() - start)
+    #  Cost of a fault is the time taken beyond that of clean
+    #  data of the same length.
+    faults = 3 * rate * frames
+    extra = times[ 1] - times[ 0] * len( dirty) / len( clean)
+    results = { 'clean_fps': frames / times[ 0],
+                'corrupt_fps': frames / times[ 1],
+                'recovered': len( dists) / frames,
+                'checksum_errors': errors,
+                'us_per_fault': extra / faults * 1e6 }
+    print( f"  clean:     {results[ 'clean_fps']:12,.0f} frames/s")
+    print( f"  corrupted: {results[ 'corrupt_fps']:12,.0f} frames/s, "
+           f"{results[ 'recovered']:.1%} of frames recovered, {errors} checksum errors")
+    print( f"  cost:      {results[ 'us_per_fault']:12.2f} us per fault")
+    return results
+
+# - - - - - - - - - - - -  sync  - - - - - - - - - - - - - - -
+def benchSync( junkSizes = ( 10, 100, 1000), trials = 20):
+    print( "getData() waiting on a silent port, and recovery from junk")
+    master, slave = pty.openpty()
+    sensor = tfmP.TFMPlus()
+    sensor.begin( os.ttyname( slave), 115200)
+    results = {}
+
+    #  CPU seconds used per second of waiting
+    start, startCpu = time.monotonic(), time.thread_time()
+    sensor.getData()
+    results[ 'idle_cpu'] = ( time.thread_time() - startCpu) / ( time.monotonic() - start)
+    dists, fluxes, temps = array( 'h'), array( 'h'), array( 'h')
+    stop = time.monotonic() + tfmP.TFMP_DATA_TIMEOUT
+    start, startCpu = time.monotonic(), time.thread_time()
+    while( time.monotonic() < stop):
+        sensor.readFrames( dists, fluxes, temps)
+    results[ 'polling_cpu'] = ( time.thread_time() - startCpu) / ( time.monotonic() - start)
+    print( f"  waiting: {results[ 'idle_cpu']:8.2%} CPU, polling: {results[ 'polling_cpu']:8.2%} CPU")
+
+    #  Junk without a header byte, so every byte is discarded
+    frame = makeFrame( 123, 456, 35)
+    for size in junkSizes:
+        junk = bytes( ( 7 * i + 1) % 0x59 for i in range( size))
+        times = []
+        discarded = sensor.bytesDiscarded
+        misses = sensor.headerMisses
+        written = []
+        def write():
+            written.append( time.monotonic())
+            os.write( master, junk + frame)
+        for i in range( trials):
+            #  'getData()' is already waiting when the data is written.
+            timer = threading.Timer( 0.01, write)
+            timer.start()
+            ok = sensor.getData()
+            times.append( time.monotonic() - written[ -1])
+            timer.join()
+            if( not ok):
+                print( f"  {size} junk bytes: no frame, status {sensor.status}")
+        times.sort()
+        results[ f"junk_{size}"] = { 'p50_ms': percentile( times, 0.5) * 1e3,
+                                     'bytes_discarded': ( sensor.bytesDiscarded - discarded) / trials,
+                                     'header_misses': ( sensor.headerMisses - misses) / trials }
+        result = results[ f"junk_{size}"]
+        print( f"  {size:5d} junk bytes: first frame in {result[ 'p50_ms']:6.3f} ms, "
+               f"{result[ 'bytes_discarded']:.0f} bytes discarded, "
+               f"{result[ 'header_misses']:.0f} resyncs")
+    sensor.pStream.close()
+    os.close( master)
+    os.close( slave)
+    return results
+
+# - - - - - - - - - - - -  link  - - - - - - - - - - - - - - -
+#  Start an emulator in another process, so that its CPU time
+#  is not counted.  Returns the process and its port name.
+def startEmulator( rate, baud, *options):
+    script = os.path.join( os.path.dirname( __file__), '..', 'tfmp_emulator.py')
+    process = subprocess.Popen( [ sys.executable, script, str( rate), str( baud), '--stamp', *options],
+                                stdout = subprocess.PIPE, text = True)
+    port = process.stdout.readline().split()[ 3]
+    return process, port
+
+def benchLinkOnce( rate, baud, seconds):
+    process, port = startEmulator( rate, baud)
+    sensor = tfmP.TFMPlus()
+    sensor.begin( port, baud)
+    sensor.pStream.reset_input_buffer()   #  only frames sent from now
+    sensor.startStream()
+    mask = 0x3FFFFFFF
+    latencies = []
+    seq = 0
+    cpu = time.process_time()
+    stop = time.monotonic() + seconds
+    while( time.monotonic() < stop):
+        if( sensor.wait_next( 0.1, seq) is None):
+            continue
+        frames = sensor.since( seq)
+        available = int( time.monotonic() * 1e6) & mask
+        for frame in frames:
+            sent = ( frame[ 2] << 15) | frame[ 3]
+            latencies.append( ( ( available - sent) & mask) / 1000)
+        seq = frames[ -1][ 0] + 1
+    cpu = time.process_time() - cpu
+    sensor.stopStream()
+    sensor.pStream.close()
+    process.send_signal( signal.SIGINT)
+    process.wait()
+    latencies.sort()
+    count = len( latencies)
+    return { 'delivered_fps': count / seconds,
+             'p50_ms': percentile( latencies, 0.50),
+             'p99_ms': percentile( latencies, 0.99),
+             'cpu_s_per_10k': cpu / count * 10000 if count else None }
+
+def benchLink( bauds, rates, seconds):
+    print( "Emulator to streaming TFMPlus through a pty")
+    print( "    baud   rate  frames/s   p50 ms   p99 ms  CPU s/10k")
+    results = {}
+    for baud in bauds:
+        for rate in rates:
+            result = benchLinkOnce( rate, baud, seconds)
+            results[ f"{baud}/{rate}"] = result
+            p50, p99, cpu = result[ 'p50_ms'], result[ 'p99_ms'], result[ 'cpu_s_per_10k']
+            print( f"  {baud:6d} {rate:6d} {result[ 'delivered_fps']:9.1f} "
+                   + ( f"{p50:8.2f} {p99:8.2f} {cpu:10.3f}" if cpu else "       -        -          -"))
+    return results
+
+# - - - - - - - - - - - -  trigger  - - - - - - - - - - - - -
+def latencyResult( histogram):
+    return { 'mean_ms': histogram.mean() * 1e3,
+             'p50_ms': histogram.percentile( 0.50) * 1e3,
+             'p99_ms': histogram.percentile( 0.99) * 1e3 }
+
+def benchTrigger( count = 200, baud = 921600):
+    print( f"Time to a new measurement at {baud} baud, "
+           "p50 and p99 are bucket limits")
+    process, port = startEmulator( 0, baud)
+    sensor = tfmP.TFMPlus()
+    sensor.begin( port, baud)
+    sensor.triggerMode()
+    results = {}
+    for i in range( count):
+        sensor.measure_now()
+    results[ 'measure_now'] = latencyResult( sensor.triggerLatency)
+    start = time.monotonic()
+    frames = sensor.measure_many( count)
+    results[ 'measure_many_fps'] = len( frames) / ( time.monotonic() - start)
+    for rate in ( 100, 1000):
+        sensor.sendCommand( tfmP.SET_FRAME_RATE, rate)
+        sensor.startStream()
+        histogram = tfmP.Histogram()
+        for i in range( count):
+            time.sleep( random.random() / rate)
+            start = time.monotonic()
+            frame = sensor.wait_next( 1.0)
+            if( frame is not None):
+                histogram.add( frame[ 1] - start)
+        sensor.stopStream()
+        results[ f"stream_{rate}Hz"] = latencyResult( histogram)
+    sensor.pStream.close()
+    process.send_signal( signal.SIGINT)
+    process.wait()
+    for name in ( 'measure_now', 'stream_100Hz', 'stream_1000Hz'):
+        result = results[ name]
+        print( f"  {name:14s} mean {result[ 'mean_ms']:7.3f} ms  "
+               f"p50 < {result[ 'p50_ms']:6.3f} ms  p99 < {result[ 'p99_ms']:6.3f} ms")
+    print( f"  measure_many   {results[ 'measure_many_fps']:7.0f} frames/s")
+    return results
+
+# - - - - - - - - - - - -  timing  - - - - - - - - - - - - -
+#  Signed difference of two times in microseconds, modulo 2**30
+def stampError( host, sent, mask = 0x3FFFFFFF):
+    return ( ( int( host * 1e6) - sent + 0x20000000) & mask) - 0x20000000
+
+#  With 'poll' the port is read after a random sleep of up to
+#  two frame periods, as by a busy host, instead of as soon as
+#  data arrives.
+def benchTimingOnce( rate, baud, dropRate, seconds, poll):
+    process, port = startEmulator( rate, baud, f"--drop={dropRate}")
+    sensor = tfmP.TFMPlus()
+    sensor.begin( port, baud)
+    #  Only frames sent from now
+    sensor.pStream.reset_input_buffer()
+    sensor.rxBuffer.clear()
+    sensor.clock.setRate( rate)
+    dists, fluxes, temps = array( 'h'), array( 'h'), array( 'h')
+    readErrors, clockErrors = [], []
+    first = last = None
+    frames = 0
+    stop = time.monotonic() + seconds
+    while( time.monotonic() < stop):
+        if( poll):
+            time.sleep( random.random() * 2 / rate)
+            sensor.readFrames( dists, fluxes, temps)
+        else:
+            sensor.readFrames( dists, fluxes, temps, stop)
+        read = time.monotonic()
+        stamps = sensor.clock.stamps( len( dists))
+        for d, f, stamp in zip( dists, fluxes, stamps):
+            last = ( d << 15) | f
+            readErrors.append( stampError( read, last))
+            clockErrors.append( stampError( stamp, last))
+        if( dists and first is None):
+            first = ( dists[ 0] << 15) | fluxes[ 0]
+        frames += len( dists)
+        del dists[ :], fluxes[ :], temps[ :]
+    sensor.pStream.close()
+    process.send_signal( signal.SIGINT)
+    process.wait()
+    stats = sensor.clock.stats()
+    #  Frames that should have been sent between the first and
+    #  last received, but were not received, were lost.
+    span = ( last - first) & 0x3FFFFFFF
+    result = { 'lost': round( span * 1e-6 * rate) + 1 - frames,
+               'dropped': stats[ 'dropped'], 'drift_ppm': stats[ 'drift_ppm'] }
+    for name, errors in ( ( 'read', readErrors), ( 'clock', clockErrors)):
+        mean = sum( errors) / len( errors)
+        result[ f"{name}_mean_us"] = mean
+        result[ f"{name}_rms_us"] = ( sum( ( e - mean) ** 2 for e in errors) / len( errors)) ** 0.5
+    return result
+
+def benchTiming( seconds = 2.0, dropRate = 0.01):
+    print( f"Frame time error from frames sent, {dropRate:.0%} of frames corrupted")
+    print( "    baud   rate  read   read mean/rms us  clock mean/rms us   lost  dropped  drift ppm")
+    results = {}
+    for baud, rate in ( ( 115200, 100), ( 921600, 1000)):
+        for poll in ( False, True):
+            mode = 'poll' if poll else 'wait'
+            result = results[ f"{baud}/{rate}/{mode}"] = benchTimingOnce( rate, baud, dropRate, seconds, poll)
+            print( f"  {baud:6d} {rate:6d}  {mode} {result[ 'read_mean_us']:9.0f}/{result[ 'read_rms_us']:<7.0f} "
+                   f"{result[ 'clock_mean_us']:9.0f}/{result[ 'clock_rms_us']:<7.0f} "
+                   f"{result[ 'lost']:6d} {result[ 'dropped']:8d} {result[ 'drift_ppm']:10.1f}")
+    return results
+
+# - - - - - - - - - - - -  reconnect  - - - - - - - - - - - -
+def benchReconnect( trials = 10, gap = 0.2):
+    print( "Time to a ready link")
+    results = {}
+    for rate in ( 100, 1000):
+        with Emulator( rate, 921600) as emu:
+            times = []
+            for i in range( trials):
+                sensor = tfmP.TFMPlus()
+                start = time.monotonic()
+                sensor.begin( emu.port, 921600)
+                times.append( ( time.monotonic() - start) * 1e3)
+                sensor.pStream.close()
+        result = results[ f"begin_{rate}Hz"] = { 'mean_ms': sum( times) / trials, 'max_ms': max( times) }
+        print( f"  begin() at {rate:4d}Hz    mean {result[ 'mean_ms']:7.2f} ms  "
+               f"max {result[ 'max_ms']:7.2f} ms  (was 200 ms)")
+    folder = tempfile.mkdtemp()
+    link = os.path.join( folder, 'lidar')
+    emu = Emulator( 100, 115200)
+    emu.start()
+    os.symlink( emu.port, link)
+    sensor = tfmP.TFMPlus()
+    supervisor = Supervisor( sensor, link, 115200, tfmP.FRAME_100)
+    supervisor.start()
+    supervisor.ready( 2.0)
+    seen, ready = [], []
+    for i in range( trials):
+        time.sleep( gap)
+        start = time.monotonic()
+        os.unlink( link)
+        emu.close()
+        while( supervisor.connected.is_set()):
+            time.sleep( 0.0001)
+        seen.append( ( time.monotonic() - start) * 1e3)
+        time.sleep( gap)
+        seq = sensor.ring.seq
+        emu = Emulator( 100, 115200)
+        emu.start()
+        start = time.monotonic()
+        os.symlink( emu.port, link)
+        frame = sensor.wait_next( 2.0, seq)
+        if( frame is not None):
+            ready.append( ( frame[ 1] - start) * 1e3)
+    supervisor.stop()
+    emu.close()
+    os.unlink( link)
+    os.rmdir( folder)
+    outages = sensor.reconnectTime
+    result = results[ 'supervisor'] = {
+        'seen_ms': percentile( sorted( seen), 0.5), 'ready_ms': percentile( sorted( ready), 0.5),
+        'ready_max_ms': max( ready), 'outage_ms': outages.mean() * 1e3,
+        'reconnects': sensor.reconnects }
+    print( f"  Supervisor, {sensor.reconnects} of {trials} outages: seen in {result[ 'seen_ms']:.2f} ms, "
+           f"first frame {result[ 'ready_ms']:.2f} ms (max {result[ 'ready_max_ms']:.2f}) after the port "
+           f"came back, outage {result[ 'outage_ms']:.0f} ms with {gap * 1e3:.0f} ms unplugged")
+    return results
+
+# - - - - - - - - - - - -  filter  - - - - - - - - - - - - -
+#  The usual median: a list of the window sorted for each sample
+def sortedMedian( values, window):
+    recent = []
+    out = []
+    for x in values:
+        recent.append( x)
+        if( len( recent) > window):
+            del recent[ 0]
+        ordered = sorted( recent)
+        n = len( ordered)
+        out.append( ordered[ n // 2] if n % 2 else ( ordered[ n // 2 - 1] + ordered[ n // 2]) / 2)
+    return out
+
+def benchFilter( samples = 100000):
+    print( f"Filter cost per sample, {samples} samples")
+    rng = random.Random( 1)
+    dists = array( 'h', ( 500 + rng.randint( -20, 20) for i in range( samples)))
+    fluxes = array( 'h', ( rng.choice( ( 1000, 1000, 1000, -1)) for i in range( samples)))
+    results = {}
+    def timed( name, function):
+        start = time.perf_counter()
+        function()
+        results[ name] = ( time.perf_counter() - start) / samples * 1e6
+        print( f"  {name:18s} {results[ name]:7.3f} us")
+    for window in ( 5, 25, 101):
+        timed( f"sorted_{window}", lambda: sortedMedian( dists, window))
+        update = Median( window).update
+        timed( f"median_{window}", lambda: [ update( x) for x in dists])
+        timed( f"median_{window}_run", lambda: Median( window).run( dists))
+    for stage in ( EMA( 0.2), Kalman( 1.0, 4.0)):
+        name = type( stage).__name__.lower()
+        update = stage.update
+        timed( f"{name}_update", lambda: [ update( x) for x in dists])
+        timed( f"{name}_run", lambda: stage.run( dists))
+    pipeline = Pipeline( Median( 5), Kalman( 1.0, 4.0))
+    update = pipeline.update
+    timed( "pipeline_update", lambda: [ update( d, f) for d, f in zip( dists, fluxes)])
+    pipeline = Pipeline( Median( 5), Kalman( 1.0, 4.0))
+    #  In reads of 1000 frames, as from 'getFrames()'
+    timed( "pipeline_run", lambda: [ pipeline.run( dists[ i: i + 1000], fluxes[ i: i + 1000])
+                                     for i in range( 0, samples, 1000)])
+    return results
+
+# - - - - - - - - - - - -  record  - - - - - - - - - - - - -
+def benchRecord( reads = 100000, chunk = 10):
+    print( f"Recording, {reads} reads of {chunk} frames")
+    data = b''.join( makeFrame( 100 + i, 500, 35) for i in range( chunk))
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join( folder, 'bench.tfmp')
+        with Recorder( path, 921600, 1000) as recorder:
+            start = time.perf_counter()
+            for i in range( reads):
+                recorder.write( data, 1000.0 + i * 0.01)
+            results[ 'write_us'] = ( time.perf_counter() - start) / reads * 1e6
+        results[ 'bytes_per_frame'] = os.path.getsize( path) / ( reads * chunk)
+        sensor = tfmP.TFMPlus()
+        sensor.pStream = ReplayStream( path, speed = None)
+        frames = 0
+        start = time.perf_counter()
+        while( True):
+            dists, fluxes, temps = sensor.getFrames()
+            if( not dists):
+                break
+            frames += len( dists)
+        results[ 'replay_fps'] = frames / ( time.perf_counter() - start)
+        replay = sensor.pStream
+        start = time.perf_counter()
+        for i in range( 1000):
+            replay.seek( 1000.0 + i * reads * 0.00001)
+        results[ 'seek_us'] = ( time.perf_counter() - start) / 1000 * 1e6
+        replay.close()
+    print( f"  record {results[ 'write_us']:6.2f} us per read, {results[ 'bytes_per_frame']:5.2f} "
+           f"bytes per frame, replay {results[ 'replay_fps']:10,.0f} frames/s, "
+           f"seek {results[ 'seek_us']:6.1f} us")
+    return results
+
+# - - - - - - - - - - - -  shared  - - - - - - - - - - - - -
+def benchShared( frames = 100000, chunk = 100):
+    print( f"Shared memory ring, {frames} frames in reads of {chunk}")
+    dists = array( 'h', range( chunk))
+    results = {}
+    with Publisher( size = frames) as publisher, Subscriber( publisher.name) as subscriber:
+        start = time.perf_counter()
+        for i in range( frames // chunk):
+            publisher.write( 1.0, dists, dists, dists)
+        results[ 'write_us'] = ( time.perf_counter() - start) / frames * 1e6
+        start = time.perf_counter()
+        count = len( subscriber.read())
+        results[ 'read_us'] = ( time.perf_counter() - start) / count * 1e6
+    #  The same frames as tuples through a pipe, as the
+    #  planner, logger and monitor relays do now.
+    receive, send = multiprocessing.Pipe( False)
+    block = [ ( i, 1.0, i, i, i, 0) for i in range( chunk)]
+    start = time.perf_counter()
+    for i in range( frames // chunk):
+        send.send( block)
+        receive.recv()
+    results[ 'pipe_us'] = ( time.perf_counter() - start) / frames * 1e6
+    receive.close()
+    send.close()
+    for name, value in results.items():
+        print( f"  {name[ :-3]:6s} {value:7.3f} us per frame")
+    return results
+
+# - - - - - - - - - - - -  group  - - - - - - - - - - - - - -
+#  Feed 'rate' frames per second to every pty master
+#  in 'masters' until 'running' is cleared.
+def feedPorts( masters, rate, running, tick = 0.002):
+    block = makeFrame( 123, 456, 35) * max( 1, int( rate * tick))
+    next = time.monotonic()
+    while( running.is_set()):
+        for fd in masters:
+            os.write( fd, block)
+        next += tick
+        time.sleep( max( 0, next - time.monotonic()))
+
+def benchGroup( counts = ( 1, 2, 4, 8, 16, 32), seconds = 1.0):
+    print( "SensorGroup CPU time per 1000 frames, 1000Hz per device")
+    results = {}
+    for count in counts:
+        masters, group = [], SensorGroup()
+        for i in range( count):
+            master, slave = pty.openpty()
+            masters.append( master)
+            group.add( i, os.ttyname( slave))
+            os.close( slave)
+        running = threading.Event()
+        running.set()
+        writer = threading.Thread( target = feedPorts, args = ( masters, 1000, running))
+        writer.start()
+        frames = 0
+        startCpu = time.thread_time()
+        stop = time.monotonic() + seconds
+        while( time.monotonic() < stop):
+            frames += len( group.poll( 0.1))
+        cpu = time.thread_time() - startCpu
+        running.clear()
+        writer.join()
+        group.close()
+        for fd in masters:
+            os.close( fd)
+        results[ str( count)] = cpu / max( frames, 1) * 1e6
+        print( f"  {count:3d} devices: {frames:6d} frames, "
+               f"{results[ str( count)]:7.1f} ms CPU per 1000 frames")
+    return results
+
+def benchI2C( devices = 8, frameRate = 100, seconds = 1.0):
+    bus = FakeI2CBus()
+    fakes = [ bus.addDevice( 0x10 + i, frameRate) for i in range( devices)]
+    group = I2CGroup( bus, frameRate)
+    results = {}
+    for i in range( devices):
+        group.add( i, 0x10 + i)
+    sensors = list( group.sensors.values())
+
+    def oneByOne():
+        for s in sensors:
+            bus.transfer( ( ( s.address, 0, s.command), ( s.address, I2C_M_RD, s.buffer)))
+            s.takeFrame( s.buffer)
+
+    print( f"I2C cycle of {devices} devices, host cost and transactions")
+    for name, function in ( ( 'batched', group.cycle), ( 'separate', oneByOne)):
+        function()
+        before = bus.transactions
+        function()
+        count = bus.transactions - before
+        results[ name] = { 'us': perCall( function), 'transactions': count }
+        print( f"  {name:10s} {results[ name][ 'us']:8.1f} us, "
+               f"{results[ name][ 'transactions']} transactions a cycle")
+    print( f"I2C polling for {seconds:g}s, devices at {frameRate}Hz")
+    for name, readRate in ( ( 'scheduled', frameRate / 2.5), ( 'too fast', frameRate * 2)):
+        #  The first cycle is a period after the last one timed.
+        group.readRate, group.period = readRate, 1 / readRate
+        group.next = time.monotonic() + group.period
+        for fake in fakes:
+            fake.staleReads = fake.reads = 0
+        stop = time.monotonic() + seconds
+        records = 0
+        while( time.monotonic() < stop):
+            records += len( group.poll())
+        reads = sum( [ fake.reads for fake in fakes])
+        stale = sum( [ fake.staleReads for fake in fakes])
+        results[ name.replace( ' ', '_')] = { 'read_rate': readRate, 'records': records,
+                                              'stale': stale / max( reads, 1) }
+        print( f"  {name:10s} {readRate:6.0f}Hz: {records:6d} records, "
+               f"{stale / max( reads, 1):6.1%} stale reads")
+    group.close()
+    return results
+
+# - - - - - - - - - - - -  store  - - - - - - - - - - - - - -
+#  Fill 'store' with 'seconds' of frames at 'rate' in reads of
+#  'chunk' frames, or lists if 'store' is None.  Returns the
+#  lists.
+def fillStore( store, seconds, rate, chunk):
+    period = 1 / rate
+    dists = array( 'h', [ 100 + i for i in range( chunk)])
+    fluxes = array( 'h', [ 500] * chunk)
+    temps = array( 'h', [ 2000] * chunk)
+    lists = ( [], [], [], [])
+    for i in range( seconds * rate // chunk):
+        stamp = 1000.0 + ( i + 1) * chunk * period
+        if( store is not None):
+            store.write( stamp, dists, fluxes, temps, 0, period)
+        else:
+            lists[ 0].extend( [ stamp - k * period for k in range( chunk - 1, -1, -1)])
+            lists[ 1].extend( dists.tolist())
+            lists[ 2].extend( fluxes.tolist())
+            lists[ 3].extend( temps.tolist())
+    return lists
+
+def benchStore( seconds = 3600, rate = 1000, chunk = 10, memorySeconds = 300):
+    frames = seconds * rate
+    print( f"FrameStore, {frames} frames at {rate}Hz in reads of {chunk}")
+    end = 1000.0 + seconds
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for name, path in ( ( 'memory', None), ( 'file', os.path.join( folder, 'bench.tfms'))):
+            #  Memory is measured on a shorter run, since tracing
+            #  slows everything down.
+            gc.collect()
+            tracemalloc.start()
+            store = FrameStore( path and path + '.short')
+            fillStore( store, memorySeconds, rate, chunk)
+            size = tracemalloc.get_traced_memory()[ 0] / ( memorySeconds * rate)
+            tracemalloc.stop()
+            store.close()
+            store = FrameStore( path)
+            start = time.perf_counter()
+            fillStore( store, seconds, rate, chunk)
+            write = ( time.perf_counter() - start) / frames * 1e6
+            queries = {}
+            for span in ( 300, seconds):
+                start = time.perf_counter()
+                for n in range( 100):
+                    store.summary( end - span + n * 0.01, end)
+                queries[ span] = ( time.perf_counter() - start) / 100 * 1e6
+            results[ name] = { 'write_us': write, 'bytes_per_frame': size,
+                               'last_5min_us': queries[ 300], 'whole_us': queries[ seconds] }
+            print( f"  {name:6s} {write:5.2f} us per frame stored, {size:5.1f} bytes per frame "
+                   f"held, min of 5 min {queries[ 300]:6.0f} us, of {seconds}s {queries[ seconds]:6.0f} us")
+            store.close()
+    #  The same values kept as Python ints in lists, and the
+    #  minimum found by a scan from the first frame of the range.
+    gc.collect()
+    tracemalloc.start()
+    lists = fillStore( None, memorySeconds, rate, chunk)
+    size = tracemalloc.get_traced_memory()[ 0] / ( memorySeconds * rate)
+    tracemalloc.stop()
+    del lists
+    stamps, dists, fluxes, temps = fillStore( None, seconds, rate, chunk)
+    scans = {}
+    for span in ( 300, seconds):
+        start = time.perf_counter()
+        min( dists[ bisect.bisect_left( stamps, end - span):])
+        scans[ span] = ( time.perf_counter() - start) * 1e6
+    results[ 'lists'] = { 'bytes_per_frame': size,
+                          'last_5min_us': scans[ 300], 'whole_us': scans[ seconds] }
+    print( f"  lists  {size:27.1f} bytes per frame held, min of 5 min "
+           f"{scans[ 300]:6.0f} us, of {seconds}s {scans[ seconds]:6.0f} us")
+    return results
+
+# - - - - - - - - - - - -  bridge  - - - - - - - - - - - - - -
+#  Push 'rate' frames per second into 'ring' until 'running' is
+#  cleared, as the reader thread of a device would.
+def feedRing( ring, rate, running, tick = 0.001):
+    start = time.monotonic()
+    sent = 0
+    while( running.is_set()):
+        due = int( ( time.monotonic() - start) * rate)
+        while( sent < due):
+            ring.push( time.monotonic(), sent % 1200, 500, 2000, 0)
+            sent += 1
+        ring.notify()
+        time.sleep( tick)
+
+#  Read 'client' until 'running' is cleared.  Each read adds its
+#  frame count and the age of its oldest frame to 'counts'.
+def readBridge( client, running, counts):
+    while( running.is_set()):
+        frames = client.read( 0.05)
+        if( frames):
+            counts.append( ( len( frames), time.monotonic() - frames[ 0][ 1]))
+
+def benchBridge( rate = 10000, seconds = 3.0,
+                 clients = ( ( 'tcp', 1), ( 'tcp', 1), ( 'tcp', 10), ( 'udp', 1), ( 'udp', 1))):
+    print( f"Bridge over loopback, frames pushed at {rate}Hz")
+    sensor = tfmP.TFMPlus()
+    sensor.ring = tfmP.FrameRing()
+    running = threading.Event()
+    running.set()
+    feeder = threading.Thread( target = feedRing, args = ( sensor.ring, rate, running))
+    feeder.start()
+    bridge = Bridge( sensor, port = 0, token = b'bench')
+    subscribers = [ BridgeClient( '127.0.0.1', bridge.port, step, b'bench', udp = ( kind == 'udp'))
+                    for kind, step in clients]
+    counts = [ [] for s in subscribers]
+    readers = [ threading.Thread( target = readBridge, args = ( s, running, c))
+                for s, c in zip( subscribers, counts)]
+    for reader in readers:
+        reader.start()
+    time.sleep( 0.2)               #  every subscription is seen
+    clock = time.pthread_getcpuclockid( bridge.thread.ident)
+    for c in counts:
+        c.clear()
+    sent, startCpu, start = bridge.sent, time.clock_gettime( clock), time.monotonic()
+    time.sleep( seconds)
+    cpu = time.clock_gettime( clock) - startCpu
+    elapsed = time.monotonic() - start
+    sent = bridge.sent - sent
+    running.clear()
+    for thread in readers + [ feeder]:
+        thread.join()
+    results = { 'aggregate_fps': sent / elapsed, 'bridge_cpu': cpu / elapsed,
+                'dropped': bridge.dropped, 'overruns': bridge.overruns }
+    for i, ( ( kind, step), client, c) in enumerate( zip( clients, subscribers, counts)):
+        ages = sorted( [ age for n, age in c])
+        result = results[ f"{i}_{kind}_step{step}"] = {
+            'fps': sum( [ n for n, age in c]) / elapsed, 'lost': client.lost,
+            'p50_ms': percentile( ages, 0.5) * 1e3, 'p99_ms': percentile( ages, 0.99) * 1e3 }
+        print( f"  {kind} step {step:3d}: {result[ 'fps']:8,.0f} frames/s, {client.lost} lost, "
+               f"oldest frame of a read p50 {result[ 'p50_ms']:5.1f} ms p99 {result[ 'p99_ms']:5.1f} ms")
+        client.close()
+    bridge.close()
+    print( f"  sent {results[ 'aggregate_fps']:,.0f} frames/s in all, bridge thread "
+           f"{results[ 'bridge_cpu']:.1%} CPU, {bridge.dropped} dropped, {bridge.overruns} overruns")
+    return results
+
+# - - - - - - - - - - - -  compare  - - - - - - - - - - - - -
+#  Print every number in 'new' next to the same one in 'old'.
+def compare( new, old, path = ''):
+    for key, value in new.items():
+        name = f"{path}{key}"
+        if( isinstance( value, dict)):
+            compare( value, old.get( key, {}), name + '.')
+        elif( isinstance( value, ( int, float)) and isinstance( old.get( key), ( int, float))):
+            before = old[ key]
+            change = f"{( value - before) / before:+8.1%}" if before else ''
+            print( f"  {name:40s} {before:12.4g} {value:12.4g} {change}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description = 'tfmplus benchmarks')
+    parser.add_argument( '--quick', action = 'store_true', help = 'fewer link rates')
+    parser.add_argument( '--seconds', type = float, default = 1.0, help = 'seconds per link rate')
+    parser.add_argument( '--json', help = 'save results to this file')
+    parser.add_argument( '--compare', help = 'compare with results in this file')
+    args = parser.parse_args()
+
+    results = { 'meta': { 'time': time.strftime( '%Y-%m-%dT%H:%M:%S'),
+                          'python': platform.python_version(),
+                          'machine': platform.machine(),
+                          'module': tfmP.__file__,
+                          'metrics': tfmP.TFMP_METRICS } }
+    results[ 'overhead'] = benchOverhead()
+    results[ 'decode'] = benchDecode()
+    results[ 'formats'] = benchFormats()
+    results[ 'resync'] = benchResync()
+    results[ 'sync'] = benchSync()
+    results[ 'link'] = benchLink( QUICK_BAUDS if args.quick else BAUDS,
+                                  QUICK_RATES if args.quick else RATES, args.seconds)
+    results[ 'trigger'] = benchTrigger()
+    results[ 'timing'] = benchTiming()
+    results[ 'reconnect'] = benchReconnect()
+    results[ 'filter'] = benchFilter()
+    results[ 'record'] = benchRecord()
+    results[ 'shared'] = benchShared()
+    results[ 'group'] = benchGroup()
+    results[ 'i2c'] = benchI2C()
+    results[ 'store'] = benchStore()
+    results[ 'bridge'] = benchBridge()
+
+    if( args.json):
+        with open( args.json, 'w') as file:
+            json.dump( results, file, indent = 2)
+    if( args.compare):
+        with open( args.compare) as file:
+            print( f"Compared with {args.compare}:          before        after")
+            compare( results, json.load( file))
@@ -44,6 +44,14 @@ from tfmplus import *    # and command and paramter defintions
 serialPort = "/dev/serial0"  # Raspberry Pi normal serial port
 serialRate = 115200          # TFMini-Plus default baud rate
 
+# - - - To run without a device, 'python tfmp_test.py --emulator'
+#  connects to a software TFMini-Plus, see 'tfmp_emulator.py'.
+if( '--emulator' in sys.argv):
+    from tfmp_emulator import Emulator
+    emulator = Emulator()
+    emulator.start()
+    serialPort = emulator.port
+
 # - - - Set and Test serial communication - - - -
 print( "Serial port: ", end= '')
 if( tfmP.begin( serialPort, serialRate)):
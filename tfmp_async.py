@@ -0,0 +1,304 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package:   tfmp_async
+ # Described: asyncio interface for the TFMini-Plus Lidar
+ #
+ # 'AsyncTFMPlus' is an asyncio protocol.  The serial port is
+ # read by the event loop through a read pipe transport, so no
+ # call ever blocks the loop or spins on 'inWaiting()'.
+ #
+ # 'await begin( port, rate)' opens the port and waits for data.
+ # 'await getData()' waits for a frame and sets 'dist', 'flux',
+ #  'temp' and 'status' just as 'tfmplus.getData()' does.
+ # 'await sendCommand( cmnd, param)' sends a command and waits
+ #  for its reply, with a time limit set by the command, while
+ #  data frames keep arriving.
+ # Frames are decoded in any output format, see 'FrameDecoder'.
+ # 'async for frame in sensor.frames()' yields every frame as a
+ #  tuple of ( stamp, dist, flux, temp, status), where 'stamp'
+ #  is the frame's host time from 'clock', see 'FrameClock'.
+ #
+ # Frames wait in a queue of at most 'maxFrames'.  When a slow
+ # consumer lets the queue fill, the transport stops reading
+ # the port until the queue is half empty again.  While a
+ # command waits for its reply the port is always read and the
+ # oldest frames are dropped instead, counted in 'overruns'.
+ # 'getData()' wants the newest frame, so if reading is paused
+ # it drops the queue and the bytes held in the port, also
+ # counted in 'overruns', and waits for a new frame.
+ #
+ # If the port is lost, a command waiting for its reply fails
+ # at once with SERIAL status.
+ #
+ # Commands, parameters and status codes are those of 'tfmplus'.
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import time
+import asyncio
+import collections
+from array import array
+import serial
+
+from tfmplus import frameStatus, encodeCommand, replyStatus, replyTimeout, FrameClock, FrameDecoder
+from tfmplus import TFMP_FRAME_SIZE, TFMP_REPLY_SIZE, TFMP_HEADER_BYTES
+from tfmplus import TFMP_READY, TFMP_SERIAL, TFMP_HEADER, TFMP_CHECKSUM
+from tfmplus import TFMP_DATA_TIMEOUT, TFMP_READY_TIMEOUT
+from tfmplus import SET_FRAME_RATE, SET_BAUD_RATE, frameDecoders
+
+TFMP_QUEUE_SIZE = 1024   # frames held for a slow consumer
+
+class AsyncTFMPlus( asyncio.Protocol):
+    ''' TFMini-Plus Lidar device for asyncio programs'''
+
+    def __init__( self, maxFrames = TFMP_QUEUE_SIZE):
+        self.pStream = None             # serial port
+        self.transport = None           # read pipe transport
+        self.status = 0                 # error status code
+        self.dist = 0                   # distance to target
+        self.flux = 0                   # signal quality or intensity
+        self.temp = 0                   # internal chip temperature
+        self.version = bytearray( 3)    # firmware version number
+        self.reply = bytearray( TFMP_REPLY_SIZE)   # last command reply
+        self.rxBuffer = bytearray()     # partial frame between reads
+        self.decoder = FrameDecoder()   # output format, found from the data
+        self.cmndBuffer = bytearray()   # bytes searched for a reply
+        self.dists, self.fluxes, self.temps = array( 'h'), array( 'h'), array( 'h')
+        self.queue = collections.deque()      # frames not yet consumed
+        self.maxFrames = maxFrames
+        self.paused = False             # transport reading paused
+        self.overruns = 0               # frames dropped unread
+        self.checksumErrors = 0         # frames that failed the checksum test
+        self.headerMisses = 0           # times frame sync was lost
+        self.bytesDiscarded = 0         # bytes not part of any good frame
+        self.hunting = False            # last read ended out of sync
+        self.clock = FrameClock()       # frame times, period and drops
+        self.arrived = None             # future set when frames arrive
+        self.pending = None             # ( reply header, reply future)
+        self.cmndLock = None            # one command at a time
+
+    #  Return TRUE/FALSE whether receiving serial data from the
+    #  device within 200ms, and set status to match.
+    async def begin( self, port, rate):
+        ''' Set serial port and test for data'''
+        loop = asyncio.get_running_loop()
+        self.cmndLock = asyncio.Lock()
+        self.pStream = serial.Serial( port, rate, timeout = 0)
+        self.clock.setBaud( rate)
+        await loop.connect_read_pipe( lambda: self, self.pStream)
+        if( await self.waitFrames( TFMP_READY_TIMEOUT)):
+            self.status = TFMP_READY
+            return True
+        self.status = TFMP_SERIAL
+        return False
+
+    #  Close the transport, which also closes the serial port.
+    def close( self):
+        ''' Close the serial port'''
+        if( self.transport is not None):
+            self.transport.close()
+
+    #  - - - - - - - - -  asyncio.Protocol  - - - - - - - - - - - -
+    def connection_made( self, transport):
+        self.transport = transport
+
+    def connection_lost( self, exc):
+        self.transport = None
+        #  No reply can arrive, so fail the command waiting for one.
+        if( self.pending is not None):
+            future = self.pending[ 1]
+            self.pending = None
+            if( not future.done()):
+                future.set_result( None)
+        self.wake()
+
+    def data_received( self, data):
+        stamp = time.monotonic()
+        #  Search for a command reply in its own buffer, so a
+        #  reply that is split between reads is still found.
+        if( self.pending is not None):
+            self.findReply( data)
+        rxBuffer = self.rxBuffer
+        rxBuffer.extend( data)
+        dists, fluxes, temps = self.dists, self.fluxes, self.temps
+        #  Sync is counted as in 'TFMPlus.syncFrames()'.
+        carried = self.hunting and len( rxBuffer) > 1 and rxBuffer[ :2] != TFMP_HEADER_BYTES
+        used, errors, good, misses, discarded = self.decoder.frames( rxBuffer, dists, fluxes, temps)
+        del rxBuffer[ :used]
+        decoder = self.decoder
+        self.hunting = ( decoder.decode is not None and decoder.binary
+                         and good != used - TFMP_FRAME_SIZE and rxBuffer[ :2] != TFMP_HEADER_BYTES)
+        if( errors or misses or discarded):
+            self.checksumErrors += errors
+            self.headerMisses += max( misses - carried, 0)
+            self.bytesDiscarded += discarded
+        if( errors):
+            self.status = TFMP_CHECKSUM
+        if( not dists):
+            return
+        #  Frames of the read are one period apart, see 'FrameClock'.
+        last = self.clock.update( stamp, len( dists), len( rxBuffer))
+        period = self.clock.period
+        first = last - ( len( dists) - 1) * period
+        append = self.queue.append
+        for i in range( len( dists)):
+            append( ( first + i * period, dists[ i], fluxes[ i], temps[ i],
+                      frameStatus( dists[ i], fluxes[ i])))
+        del dists[ :], fluxes[ :], temps[ :]
+        self.checkQueue()
+        self.wake()
+
+    #  Stop reading the port while the consumer catches up.  While
+    #  a command waits for its reply the port must still be read,
+    #  so the oldest frames are dropped instead and counted.
+    def checkQueue( self):
+        queue = self.queue
+        if( len( queue) < self.maxFrames or self.paused):
+            return
+        if( self.pending is not None):
+            while( len( queue) > self.maxFrames):
+                queue.popleft()
+                self.overruns += 1
+        elif( self.transport is not None):
+            self.transport.pause_reading()
+            self.paused = True
+
+    #  Look for the reply of the pending command in 'data'.
+    def findReply( self, data):
+        header, future = self.pending
+        buffer = self.cmndBuffer
+        buffer.extend( data)
+        replyLen = header[ 1]
+        pos = buffer.find( header)
+        while( 0 <= pos <= len( buffer) - replyLen):
+            candidate = buffer[ pos: pos + replyLen]
+            if( ( sum( candidate[ :-1]) & 0xFF) == candidate[ -1]):
+                self.pending = None
+                buffer.clear()
+                if( not future.done()):
+                    future.set_result( candidate)
+                return
+            pos = buffer.find( header, pos + 1)
+        #  Keep only what could be the start of a reply.
+        if( pos < 0):
+            del buffer[ :-( len( header) - 1)]
+        else:
+            del buffer[ :pos]
+
+    #  Wake every task waiting in 'waitFrames()'.
+    def wake( self):
+        if( self.arrived is not None and not self.arrived.done()):
+            self.arrived.set_result( None)
+
+    #  Wait up to 'timeout' seconds for at least one frame
+    #  in the queue.  Returns True if there is one.
+    async def waitFrames( self, timeout = None):
+        ''' Wait for frames to arrive'''
+        if( not self.queue):
+            if( self.arrived is None or self.arrived.done()):
+                self.arrived = asyncio.get_running_loop().create_future()
+            try:
+                await asyncio.wait_for( asyncio.shield( self.arrived), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return bool( self.queue)
+
+    #  Take the oldest frame from the queue.
+    def popFrame( self):
+        frame = self.queue.popleft()
+        if( len( self.queue) <= self.maxFrames // 2):
+            self.resume()
+        return frame
+
+    #  Start reading the port again.
+    def resume( self):
+        if( self.paused):
+            self.paused = False
+            if( self.transport is not None):
+                self.transport.resume_reading()
+
+    #  Drop every frame queued, and every byte waiting in the port,
+    #  and start reading again.  Counted in 'overruns'.
+    def flush( self):
+        self.overruns += len( self.queue)
+        self.queue.clear()
+        self.rxBuffer.clear()
+        self.hunting = True     #  the next read may start mid-frame
+        if( self.transport is not None):
+            self.pStream.reset_input_buffer()
+        self.resume()
+
+    #  - - - - - - - - -  Frame data  - - - - - - - - - - - - - - -
+    #  Set 'dist', 'flux', 'temp' and 'status' from a frame.
+    def setFrame( self, frame):
+        stamp, self.dist, self.flux, self.temp, self.status = frame
+        return frame
+
+    #  Return TRUE/FALSE whether data received without error
+    #  and set status to provide more information.  Frames
+    #  queued before the last one are dropped.  If reading was
+    #  paused, every frame queued and waiting is stale, so all
+    #  are dropped and a new frame is waited for.
+    async def getData( self):
+        ''' Get the most recent frame'''
+        if( self.paused):
+            self.flush()
+        if( not await self.waitFrames( TFMP_DATA_TIMEOUT)):
+            self.status = TFMP_HEADER
+            return False
+        while( len( self.queue) > 1):
+            self.popFrame()
+        self.setFrame( self.popFrame())
+        return self.status == TFMP_READY
+
+    #  Yield every frame, oldest first, as a tuple of
+    #  ( stamp, dist, flux, temp, status).  Ends when the
+    #  port is closed.
+    async def frames( self):
+        ''' Iterate over every frame received'''
+        while( self.transport is not None or self.queue):
+            if( await self.waitFrames()):
+                yield self.setFrame( self.popFrame())
+
+    #  - - - - - - - - -  Send a command  - - - - - - - - - - - - -
+    #  Send 'cmnd' with 'param' and wait for the reply.  Returns
+    #  TRUE/FALSE and sets status.  The wait is limited to
+    #  'timeout' seconds, or the command's own limit if None.
+    async def sendCommand( self, cmnd, param, timeout = None):
+        ''' Send serial command and get reply data'''
+        cmndData, replyLen = encodeCommand( cmnd, param)
+        if( timeout is None):
+            timeout = replyTimeout( cmnd)
+        async with self.cmndLock:
+            if( self.transport is None):
+                self.status = TFMP_SERIAL
+                return False
+            future = None
+            if( replyLen):
+                future = asyncio.get_running_loop().create_future()
+                self.cmndBuffer.clear()
+                self.pending = ( bytes( ( 0x5A, replyLen, cmndData[ 2])), future)
+                self.resume()
+            self.pStream.write( cmndData)
+            if( future is None):
+                return True
+            try:
+                reply = await asyncio.wait_for( future, timeout)
+            except asyncio.TimeoutError:
+                self.status = TFMP_HEADER
+                return False
+            finally:
+                self.pending = None
+                self.checkQueue()
+        if( reply is None):      #  the port was lost
+            self.status = TFMP_SERIAL
+            return False
+        self.reply[:] = bytes( TFMP_REPLY_SIZE)
+        self.reply[ :replyLen] = reply
+        self.status = replyStatus( cmnd, reply, self.version)
+        if( self.status == TFMP_READY):
+            if( cmnd == SET_FRAME_RATE):
+                self.clock.setRate( param)
+            elif( cmnd == SET_BAUD_RATE):
+                self.clock.setBaud( param)
+            elif( cmnd in frameDecoders):
+                self.decoder.setFormat( cmnd)
+        return self.status == TFMP_READY
@@ -0,0 +1,521 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package:   tfmp_bridge
+ # Described: Stream TFMini-Plus frames to other hosts
+ #
+ # A 'Bridge' serves the frames of a 'TFMPlus' object in
+ # streaming mode to any number of subscribers over TCP and UDP,
+ # from a thread of its own.  Every 'interval' seconds it takes
+ # the new frames from the ring buffer and sends them to each
+ # subscriber as one message, so the serial reader thread never
+ # waits on the network.
+ #
+ # Each subscriber chooses a 'step': it is sent only the frames
+ # whose sequence number is a multiple of 'step'.  A TCP
+ # subscriber that does not keep up is sent nothing more once
+ # 'backlog' bytes wait for it, and the frames it missed are
+ # counted in 'dropped'.  A UDP subscriber is sent datagrams of
+ # at most 'TFMP_BRIDGE_DATAGRAM' bytes, and must subscribe again
+ # within 'TFMP_BRIDGE_LEASE' seconds to keep them coming.
+ #
+ # A UDP subscription must give the bridge's 'token'.  The source
+ # address of a datagram is not checked, so without this anyone
+ # could have frames sent to another host.  A bridge without a
+ # token serves TCP subscribers only.
+ #
+ # A TCP client that gave the bridge's 'token' may also send
+ # commands, which are passed to 'sendCommand()' one at a time
+ # by a thread of their own.  Without a token, the bridge
+ # refuses every command.  So does any client for a command
+ # not in 'commandList', or for a baud rate or frame rate not
+ # in 'baudRates' or 'frameRates'.
+ #
+ # Messages, little-endian, each after a header of the body
+ # length (4 bytes) and the message type (1 byte):
+ #   SUBSCRIBE  step (2 bytes), then the token, if any
+ #   FRAMES     sequence number of the first frame (8 bytes),
+ #              count (4 bytes) and step (2 bytes), then the
+ #              columns: stamps as 8 byte floats, then dists,
+ #              fluxes and temps as 2 byte integers, then each
+ #              status as 1 byte, 15 bytes a frame
+ #   COMMAND    request number, cmnd and param (4 bytes each)
+ #   REPLY      request number (4 bytes) and status (1 byte),
+ #              then the reply bytes
+ # Stamps are host monotonic times of the bridge's host.
+ #
+ # Example:
+ #   sensor.begin( '/dev/ttyUSB0', 115200, stream = True)
+ #   bridge = Bridge( sensor, host = '0.0.0.0', token = b'secret')
+ # and on another host:
+ #   client = BridgeClient( 'robot.local', step = 10)
+ #   for seq, stamp, dist, flux, temp, status in client.frames():
+ #       print( dist)
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import hmac
+import time
+import queue
+import socket
+import struct
+import selectors
+import threading
+import collections
+from array import array
+
+from tfmplus import TFMP_READY, TFMP_HEADER, TFMP_REPLY_SIZE, commandList, baudRates, frameRates
+from tfmplus import SET_BAUD_RATE, SET_FRAME_RATE
+
+TFMP_BRIDGE_PORT     = 9465      # next to that of 'tfmp_metrics'
+TFMP_BRIDGE_TICK     = 0.005     # seconds between messages of frames
+TFMP_BRIDGE_BACKLOG  = 262144    # bytes waiting for a TCP subscriber before frames are dropped
+TFMP_BRIDGE_DATAGRAM = 1400      # largest UDP datagram, within an Ethernet frame
+TFMP_BRIDGE_LEASE    = 10.0      # seconds a UDP subscription lasts
+TFMP_BRIDGE_REQUEST  = 1024      # longest message from a client
+TFMP_BRIDGE_WAIT     = 2.0       # seconds a client waits for a command reply
+TFMP_REFUSED         = 0xFF      # command status: not authorised, not a command or not a parameter
+
+#  The parameters allowed for commands that take one of a list
+paramLists = { SET_BAUD_RATE: baudRates, SET_FRAME_RATE: frameRates}
+
+#  Message types
+MSG_SUBSCRIBE = 1
+MSG_FRAMES    = 2
+MSG_COMMAND   = 3
+MSG_REPLY     = 4
+
+headerData  = struct.Struct( '<IB')      # body length, message type
+stepData    = struct.Struct( '<H')       # SUBSCRIBE
+framesData  = struct.Struct( '<QIH')     # FRAMES first seq, count and step
+commandData = struct.Struct( '<III')     # COMMAND
+replyData   = struct.Struct( '<IB')      # REPLY
+FRAME_BYTES = 15                         # bytes of one frame in the columns
+FRAMES_MAX  = ( TFMP_BRIDGE_DATAGRAM - headerData.size - framesData.size) // FRAME_BYTES
+
+#  Return 'body' as a message of type 'kind'.
+def message( kind, body):
+    return headerData.pack( len( body), kind) + body
+
+#  Return the whole messages at the start of 'buffer' as a list
+#  of ( type, body) and remove them.  Raises ValueError if a
+#  message is longer than 'limit'.
+def messages( buffer, limit = None):
+    found = []
+    pos = 0
+    while( len( buffer) - pos >= headerData.size):
+        length, kind = headerData.unpack_from( buffer, pos)
+        if( limit is not None and length > limit):
+            raise ValueError( f"message of {length} bytes")
+        end = pos + headerData.size + length
+        if( end > len( buffer)):
+            break
+        found.append( ( kind, bytes( buffer[ pos + headerData.size: end])))
+        pos = end
+    del buffer[ :pos]
+    return found
+
+#  Return the slots of 'column' that hold frames 'first',
+#  'first + step' and so on up to 'count' frames, in a ring of
+#  'size' slots.
+def ringSlice( column, size, first, count, step):
+    i = first % size
+    end = i + ( count - 1) * step + 1
+    if( end <= size):
+        return column[ i: end: step]
+    part = column[ i: size: step]
+    i += len( part) * step - size
+    return part + column[ i: i + ( count - len( part) - 1) * step + 1: step]
+
+#  Return a FRAMES message of 'count' frames from 'ring', from
+#  sequence number 'first' on, 'step' apart.
+def framesMessage( ring, first, count, step):
+    size = ring.size
+    body = bytearray( framesData.pack( first, count, step))
+    for column in ( ring.stamps, ring.dists, ring.fluxes, ring.temps, ring.statuses):
+        body += ringSlice( column, size, first, count, step)
+    return message( MSG_FRAMES, body)
+
+#  Return the frames of a FRAMES message body as a list of
+#  ( seq, stamp, dist, flux, temp, status) tuples.
+def decodeFrames( body):
+    first, count, step = framesData.unpack_from( body)
+    pos = framesData.size
+    columns = []
+    for code, width in ( ( 'd', 8), ( 'h', 2), ( 'h', 2), ( 'h', 2), ( 'B', 1)):
+        column = array( code)
+        column.frombytes( body[ pos: pos + count * width])
+        columns.append( column)
+        pos += count * width
+    return list( zip( range( first, first + count * step, step), *columns))
+
+class Subscriber:
+    ''' One TCP client of a bridge'''
+    __slots__ = ( 'sock', 'address', 'step', 'authorised', 'inbox', 'outbox', 'sent', 'dropped')
+
+    def __init__( self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.step = 0                  # 0 until subscribed
+        self.authorised = False        # may send commands
+        self.inbox = bytearray()       # part of a message received
+        self.outbox = bytearray()      # bytes not yet sent
+        self.sent = 0                  # frames sent
+        self.dropped = 0               # frames dropped while it was slow
+
+class Bridge:
+    ''' Network server of the frames of one device'''
+
+    #  Serve the frames of 'sensor', starting its streaming mode
+    #  if it has not been started.  'port' 0 picks a free port,
+    #  found afterwards in 'port'.  TCP and UDP use the same port.
+    def __init__( self, sensor, port = TFMP_BRIDGE_PORT, host = '127.0.0.1', token = None,
+                  interval = TFMP_BRIDGE_TICK, backlog = TFMP_BRIDGE_BACKLOG):
+        if( sensor.ring is None):
+            sensor.startStream()
+        self.sensor = sensor
+        self.token = token.encode() if isinstance( token, str) else token
+        self.interval = interval
+        self.backlog = backlog
+        self.listener = socket.create_server( ( host, port))
+        self.port = self.listener.getsockname()[ 1]
+        self.datagrams = socket.socket( socket.AF_INET, socket.SOCK_DGRAM)
+        self.datagrams.bind( ( host, self.port))
+        self.selector = selectors.DefaultSelector()
+        for sock in ( self.listener, self.datagrams):
+            sock.setblocking( False)
+            self.selector.register( sock, selectors.EVENT_READ, None)
+        self.clients = {}              # TCP subscribers by socket
+        self.udp = {}                  # ( step, expiry) of UDP subscribers by address
+        self.next = sensor.ring.seq    # sequence number of the next frame to send
+        self.sent = 0                  # frames sent, to all subscribers
+        self.dropped = 0               # frames not sent to slow subscribers
+        self.overruns = 0              # frames overwritten before the bridge read them
+        self.commands = queue.Queue()  # ( client, request, cmnd, param) to send
+        self.replies = collections.deque()    # ( client, REPLY message) to queue
+        self.running = True
+        self.thread = threading.Thread( target = self.run, name = 'tfmplus-bridge', daemon = True)
+        self.commander = threading.Thread( target = self.runCommands,
+                                           name = 'tfmplus-bridge-commands', daemon = True)
+        self.thread.start()
+        self.commander.start()
+
+    def __enter__( self):
+        return self
+
+    def __exit__( self, *exc):
+        self.close()
+
+    #  Stop serving and close every connection.  The device
+    #  keeps streaming.
+    def close( self):
+        ''' Stop the bridge'''
+        if( not self.running):
+            return
+        self.running = False
+        self.commands.put( None)
+        self.thread.join()
+        self.commander.join()
+        for sock in list( self.clients):
+            self.drop( sock)
+        self.selector.close()
+        self.listener.close()
+        self.datagrams.close()
+
+    #  - - - - - - - - -  Bridge thread  - - - - - - - - - - - - -
+    def run( self):
+        select = self.selector.select
+        while( self.running):
+            deadline = time.monotonic() + self.interval
+            for key, events in select( self.interval):
+                if( key.fileobj is self.listener):
+                    self.accept()
+                elif( key.fileobj is self.datagrams):
+                    self.receiveDatagrams()
+                else:
+                    self.receive( key.fileobj)
+            #  Requests do not make frames go out more often.
+            wait = deadline - time.monotonic()
+            if( wait > 0):
+                time.sleep( wait)
+            while( self.replies):
+                client, reply = self.replies.popleft()
+                if( client.sock in self.clients):
+                    client.outbox += reply
+            self.sendFrames()
+            for sock, client in list( self.clients.items()):
+                if( client.outbox):
+                    self.flush( client)
+
+    def accept( self):
+        try:
+            sock, address = self.listener.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking( False)
+        sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.clients[ sock] = Subscriber( sock, address)
+        self.selector.register( sock, selectors.EVENT_READ, None)
+
+    def drop( self, sock):
+        self.clients.pop( sock, None)
+        try:
+            self.selector.unregister( sock)
+        except ( KeyError, ValueError):
+            pass
+        sock.close()
+
+    #  Read and act on the messages of a TCP client.
+    def receive( self, sock):
+        client = self.clients[ sock]
+        try:
+            data = sock.recv( 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if( not data):
+            self.drop( sock)
+            return
+        client.inbox += data
+        try:
+            requests = messages( client.inbox, TFMP_BRIDGE_REQUEST)
+        except ValueError:
+            self.drop( sock)
+            return
+        for kind, body in requests:
+            if( kind == MSG_SUBSCRIBE and len( body) >= stepData.size):
+                client.step = stepData.unpack_from( body)[ 0]
+                token = body[ stepData.size:]
+                client.authorised = ( self.token is not None
+                                      and hmac.compare_digest( token, self.token))
+            elif( kind == MSG_COMMAND and len( body) == commandData.size):
+                request, cmnd, param = commandData.unpack( body)
+                if( client.authorised):
+                    self.commands.put( ( client, request, cmnd, param))
+                else:
+                    client.outbox += message( MSG_REPLY, replyData.pack( request, TFMP_REFUSED))
+
+    #  A UDP subscription lasts 'TFMP_BRIDGE_LEASE' seconds.  Step
+    #  0 ends it.  Either is ignored without the token.
+    def receiveDatagrams( self):
+        while( True):
+            try:
+                data, address = self.datagrams.recvfrom( TFMP_BRIDGE_REQUEST)
+            except ( BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue         #  an error from an earlier send
+            try:
+                requests = messages( bytearray( data), TFMP_BRIDGE_REQUEST)
+            except ValueError:
+                continue
+            for kind, body in requests:
+                if( kind == MSG_SUBSCRIBE and len( body) >= stepData.size
+                    and self.token is not None
+                    and hmac.compare_digest( body[ stepData.size:], self.token)):
+                    step = stepData.unpack_from( body)[ 0]
+                    if( step):
+                        self.udp[ address] = ( step, time.monotonic() + TFMP_BRIDGE_LEASE)
+                    else:
+                        self.udp.pop( address, None)
+
+    #  Send the frames that arrived since the last time to every
+    #  subscriber.  A message is built once for each step.
+    def sendFrames( self):
+        ring = self.sensor.ring
+        last = ring.seq
+        first = max( self.next, last - ring.size + 1, 0)
+        self.overruns += first - self.next
+        self.next = last
+        if( first >= last):
+            return
+        built = {}
+        for client in self.clients.values():
+            step = client.step
+            if( not step):
+                continue
+            start = first + ( -first % step)
+            count = len( range( start, last, step))
+            if( not count):
+                continue
+            if( len( client.outbox) > self.backlog):
+                client.dropped += count
+                self.dropped += count
+                continue
+            if( step not in built):
+                built[ step] = framesMessage( ring, start, count, step)
+            client.outbox += built[ step]
+            client.sent += count
+            self.sent += count
+        now = time.monotonic()
+        for address, ( step, expiry) in list( self.udp.items()):
+            if( now > expiry):
+                del self.udp[ address]
+                continue
+            start = first + ( -first % step)
+            count = len( range( start, last, step))
+            while( count > 0):
+                part = min( count, FRAMES_MAX)
+                try:
+                    self.datagrams.sendto( framesMessage( ring, start, part, step), address)
+                    self.sent += part
+                except ( BlockingIOError, OSError):
+                    self.dropped += part
+                start += part * step
+                count -= part
+
+    def flush( self, client):
+        try:
+            sent = client.sock.send( client.outbox)
+        except BlockingIOError:
+            return
+        except OSError:
+            self.drop( client.sock)
+            return
+        del client.outbox[ :sent]
+
+    #  - - - - - - - - -  Command thread  - - - - - - - - - - - - -
+    #  Send each command in turn.  The reply is queued for the
+    #  bridge thread to send.
+    def runCommands( self):
+        sensor = self.sensor
+        while( True):
+            item = self.commands.get()
+            if( item is None):
+                return
+            client, request, cmnd, param = item
+            status, reply = TFMP_REFUSED, b''     #  not a command
+            if( cmnd in commandList and param in paramLists.get( cmnd, ( param,))):
+                try:
+                    sensor.sendCommand( cmnd, param)
+                    status, reply = sensor.status, bytes( sensor.reply)
+                except ( ValueError, OverflowError):
+                    pass                          #  not a parameter
+            self.replies.append( ( client, message( MSG_REPLY, replyData.pack( request, status) + reply)))
+
+class BridgeClient:
+    ''' Subscriber to a bridge on another host'''
+
+    #  Connect to the bridge at 'host' and 'port' and subscribe
+    #  to every 'step'th frame, over UDP if 'udp'.  UDP needs the
+    #  bridge's 'token', and so do commands, sent over TCP.
+    def __init__( self, host, port = TFMP_BRIDGE_PORT, step = 1, token = None, udp = False):
+        self.address = ( host, port)
+        self.step = step
+        self.token = ( token.encode() if isinstance( token, str) else token) or b''
+        self.udp = udp
+        self.buffer = bytearray()      # part of a message received
+        self.queue = collections.deque()      # frames received, not yet read
+        self.replies = {}              # ( status, reply) by request number
+        self.request = 0               # number of the last command
+        self.status = 0                # status of the last command
+        self.reply = bytearray( TFMP_REPLY_SIZE)   # reply of the last command
+        self.next = None               # sequence number of the next frame expected
+        self.lost = 0                  # frames missing from those received
+        self.renewed = 0.0             # time of the last UDP subscription
+        if( udp):
+            self.sock = socket.socket( socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect( self.address)
+            self.subscribe()
+        else:
+            self.sock = socket.create_connection( self.address)
+            self.sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.subscribe()
+
+    def subscribe( self):
+        self.sock.send( message( MSG_SUBSCRIBE, stepData.pack( self.step) + self.token))
+        self.renewed = time.monotonic()
+
+    def __enter__( self):
+        return self
+
+    def __exit__( self, *exc):
+        self.close()
+
+    def close( self):
+        ''' Unsubscribe and close the connection'''
+        if( self.sock is None):
+            return
+        if( self.udp):
+            try:
+                self.sock.send( message( MSG_SUBSCRIBE, stepData.pack( 0) + self.token))
+            except OSError:
+                pass
+        self.sock.close()
+        self.sock = None
+
+    #  Wait up to 'timeout' seconds for data, or for ever if
+    #  None, and take in the messages received.  Returns False
+    #  if nothing arrived.
+    def receive( self, timeout = None):
+        if( self.udp and time.monotonic() - self.renewed > TFMP_BRIDGE_LEASE / 3):
+            self.subscribe()
+        self.sock.settimeout( timeout)
+        try:
+            data = self.sock.recv( 262144)
+        except ( socket.timeout, BlockingIOError):
+            return False
+        except ConnectionRefusedError:
+            return False         #  UDP, bridge not yet there
+        if( not data):
+            raise ConnectionError( "bridge closed the connection")
+        if( self.udp):
+            requests = messages( bytearray( data))
+        else:
+            self.buffer += data
+            requests = messages( self.buffer)
+        for kind, body in requests:
+            if( kind == MSG_FRAMES):
+                frames = decodeFrames( body)
+                if( frames):
+                    if( self.next is not None and frames[ 0][ 0] > self.next):
+                        self.lost += ( frames[ 0][ 0] - self.next) // self.step
+                    self.next = frames[ -1][ 0] + self.step
+                    self.queue.extend( frames)
+            elif( kind == MSG_REPLY):
+                request, status = replyData.unpack_from( body)
+                self.replies[ request] = ( status, body[ replyData.size:])
+        return True
+
+    #  Return a list of every frame received since the last call,
+    #  as ( seq, stamp, dist, flux, temp, status) tuples.  Waits
+    #  up to 'timeout' seconds for one if none has arrived.
+    def read( self, timeout = 0.0):
+        ''' Frames received since the last read'''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while( not self.queue):
+            left = None if deadline is None else max( deadline - time.monotonic(), 0)
+            if( not self.receive( left) and left is not None
+                and time.monotonic() >= deadline):
+                break
+        while( self.receive( 0)):
+            pass
+        frames = list( self.queue)
+        self.queue.clear()
+        return frames
+
+    #  Yield every frame, oldest first, for ever.
+    def frames( self):
+        ''' Iterate over every frame received'''
+        while( True):
+            yield from self.read( None)
+
+    #  Send one command through the bridge and wait up to
+    #  'timeout' seconds for the reply.  Returns TRUE/FALSE and
+    #  sets 'status' and 'reply' as 'TFMPlus.sendCommand()' does.
+    #  Frames that arrive meanwhile are kept for 'read()'.
+    def sendCommand( self, cmnd, param, timeout = TFMP_BRIDGE_WAIT):
+        ''' Send a command to the device through the bridge'''
+        if( self.udp):
+            raise ValueError( "commands are only sent over TCP")
+        self.request = request = ( self.request + 1) & 0xFFFFFFFF
+        self.sock.sendall( message( MSG_COMMAND, commandData.pack( request, cmnd, param)))
+        deadline = time.monotonic() + timeout
+        while( request not in self.replies):
+            left = deadline - time.monotonic()
+            if( left <= 0):
+                self.status = TFMP_HEADER
+                return False
+            self.receive( left)
+        self.status, reply = self.replies.pop( request)
+        self.reply[:] = bytes( TFMP_REPLY_SIZE)
+        self.reply[ :len( reply)] = reply[ :TFMP_REPLY_SIZE]
+        return self.status == TFMP_READY
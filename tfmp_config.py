@@ -0,0 +1,194 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package:   tfmp_config
+ # Described: Find the fastest drop-free TFMini-Plus link
+ #
+ # 'findBaud()' opens a port at each supported baud rate in turn
+ # until it finds valid data frames, or a reply to a command if
+ # the device is in triggered mode.  So a device left at an
+ # unknown baud rate can always be found again.
+ #
+ # 'autoConfigure()' then steps the device up:
+ #   1. the fastest baud rate the host port accepts, set with
+ #      'SET_BAUD_RATE' and kept only if no more than
+ #      'TFMP_DROP_LIMIT' of the frames are lost at the new rate;
+ #   2. each standard frame rate the link can carry, that is,
+ #      at most baud / ( 9 bytes x 10 bits) frames per second,
+ #      set with 'SET_FRAME_RATE'.  At each rate the frames
+ #      decoded by the host are counted for 'seconds' and the
+ #      rate is kept only if no more than 'TFMP_DROP_LIMIT' of
+ #      them were lost;
+ #   3. 'SAVE_SETTINGS', only once the result is known good.
+ # If any step fails, the device is put back to the baud rate
+ # and frame rate it had at the start.  A device in triggered
+ # mode, frame rate 0, sends no frames to count, so it is left
+ # as it is and ( baud, 0) is returned.
+ #
+ # Example:
+ #   sensor = tfmplus.TFMPlus()
+ #   baud, frameRate = autoConfigure( sensor, '/dev/ttyUSB0')
+ # returns the baud rate and frame rate that were kept, with the
+ # port open at that baud rate, or ( 0, 0) if no device was found
+ # or it could not be put back after a failed step.
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import time
+from array import array
+import serial
+
+from tfmplus import baudRates, frameRates, TFMP_FRAME_SIZE, FRAME_0
+from tfmplus import SET_BAUD_RATE, SET_FRAME_RATE, SAVE_SETTINGS, GET_FIRMWARE_VERSION
+
+TFMP_PROBE_TIME = 0.25     # seconds to listen at each baud rate
+TFMP_MEASURE_TIME = 0.5    # seconds to count frames at each frame rate
+TFMP_DROP_LIMIT = 0.01     # largest fraction of frames that may be lost
+
+#  Return the highest frame rate that 'baud' can carry.
+def linkCapacity( baud):
+    ''' Frames per second a baud rate can carry'''
+    return baud / ( TFMP_FRAME_SIZE * 10)
+
+#  Count frames decoded for 'seconds'.  The thread sleeps in the
+#  serial port read between frames.  Returns the number of frames
+#  and the number that failed the checksum test.
+def countFrames( sensor, seconds):
+    ''' Count frames received'''
+    dists, fluxes, temps = array( 'h'), array( 'h'), array( 'h')
+    frames = errors = 0
+    deadline = time.monotonic() + seconds
+    while( time.monotonic() < deadline):
+        errors += sensor.readFrames( dists, fluxes, temps, deadline)
+        frames += len( dists)
+        del dists[ :], fluxes[ :], temps[ :]
+    return frames, errors
+
+#  Throw away everything received so far.
+def flush( sensor):
+    sensor.pStream.reset_input_buffer()
+    sensor.rxBuffer.clear()
+
+#  Return True if the device answers at the port's present baud
+#  rate, with data frames or with a command reply.
+def probe( sensor, seconds = TFMP_PROBE_TIME):
+    ''' Test for a device at the present baud rate'''
+    flush( sensor)
+    frames, errors = countFrames( sensor, seconds)
+    if( frames):
+        return True
+    return sensor.sendCommand( GET_FIRMWARE_VERSION, 0)
+
+#  Open 'port' at each of 'bauds', most likely first, and return
+#  the baud rate at which the device answers, or 0 if none.  The
+#  port is left open in 'sensor.pStream' at that rate.
+def findBaud( sensor, port, bauds = ( 115200,) + baudRates[ ::-1]):
+    ''' Find the baud rate of a device'''
+    if( sensor.pStream is None):
+        sensor.pStream = serial.Serial( port, bauds[ 0])
+    for baud in dict.fromkeys( bauds):
+        try:
+            sensor.pStream.baudrate = baud
+        except ( ValueError, serial.SerialException):
+            continue      #  not supported by the host port
+        if( probe( sensor)):
+            return baud
+    return 0
+
+#  Return the fraction of the frames expected at 'frameRate' that
+#  were lost or failed the checksum test in 'seconds'.
+def measureDrops( sensor, frameRate, seconds = TFMP_MEASURE_TIME):
+    ''' Fraction of frames lost'''
+    flush( sensor)
+    countFrames( sensor, 2 / frameRate)       #  wait for the new rate
+    frames, errors = countFrames( sensor, seconds)
+    expected = frameRate * seconds
+    #  One frame either way is the edge of the window.
+    return max( 0.0, expected - frames - 1 + errors) / expected
+
+#  Set the device and the host port to 'baud'.  Returns True if
+#  the device answers at the new rate.
+def setBaud( sensor, baud):
+    ''' Change the baud rate of device and host'''
+    old = sensor.pStream.baudrate
+    try:
+        sensor.pStream.baudrate = baud
+    except ( ValueError, serial.SerialException):
+        return False      #  not supported by the host port
+    sensor.pStream.baudrate = old
+    #  The device replies at the old rate, then changes.
+    if( not sensor.sendCommand( SET_BAUD_RATE, baud)):
+        return False
+    sensor.pStream.baudrate = baud
+    return probe( sensor)
+
+#  Put the device back to 'baud' and 'frameRate' after a failed
+#  step.  The device may be at the old or the new baud rate.
+def rollBack( sensor, baud, frameRate, tried):
+    ''' Return the device to known settings'''
+    pStream = sensor.pStream
+    for rate in ( pStream.baudrate, tried, baud):
+        try:
+            pStream.baudrate = rate
+        except ( ValueError, serial.SerialException):
+            continue
+        sensor.sendCommand( SET_FRAME_RATE, frameRate)
+        if( rate != baud):
+            sensor.sendCommand( SET_BAUD_RATE, baud)
+            pStream.baudrate = baud
+        if( probe( sensor)):
+            return True
+    return False
+
+#  Find the device on 'port' and step it up to the fastest baud
+#  rate and frame rate that the host decodes without loss, up to
+#  'maxBaud' and 'maxRate'.  The result is saved in the device
+#  if 'save'.  Returns ( baud, frameRate), or ( 0, 0) if the
+#  device is not found or cannot be put back after a failed step.
+def autoConfigure( sensor, port, maxBaud = 921600, maxRate = 1000,
+                   seconds = TFMP_MEASURE_TIME, save = True):
+    ''' Set the fastest drop-free baud rate and frame rate'''
+    baud = findBaud( sensor, port)
+    if( not baud):
+        return 0, 0
+    #  The device cannot be asked its frame rate, so take the
+    #  nearest standard rate to what arrives.  A device found
+    #  by its command reply alone is in triggered mode, and
+    #  changing its frame rate would end that, so it is left.
+    flush( sensor)
+    frames, errors = countFrames( sensor, seconds)
+    if( not frames):
+        return baud, FRAME_0
+    startRate = min( frameRates[ 1:], key = lambda rate: abs( rate - frames / seconds))
+    startBaud = baud
+
+    #  1. The fastest baud rate the host port takes and decodes
+    #     the present frame rate at without loss
+    for target in sorted( ( b for b in baudRates if baud < b <= maxBaud), reverse = True):
+        if( setBaud( sensor, target)
+            and measureDrops( sensor, startRate, seconds) <= TFMP_DROP_LIMIT):
+            baud = target
+            break
+        if( not rollBack( sensor, startBaud, startRate, target)):
+            return 0, 0
+
+    #  2. Step up through the frame rates the link can carry
+    frameRate = startRate
+    for target in frameRates:
+        if( target <= startRate or target > maxRate or target > linkCapacity( baud)):
+            continue
+        if( sensor.sendCommand( SET_FRAME_RATE, target)
+            and measureDrops( sensor, target, seconds) <= TFMP_DROP_LIMIT):
+            frameRate = target
+            continue
+        #  Back to the last good rate, which was measured.
+        if( not sensor.sendCommand( SET_FRAME_RATE, frameRate)):
+            if( not rollBack( sensor, startBaud, startRate, baud)):
+                return 0, 0
+            return startBaud, startRate
+        break
+
+    #  3. Keep the result
+    if( save and ( baud, frameRate) != ( startBaud, startRate)):
+        if( not sensor.sendCommand( SAVE_SETTINGS, 0)):
+            if( not rollBack( sensor, startBaud, startRate, baud)):
+                return 0, 0
+            return startBaud, startRate
+    return baud, frameRate
@@ -0,0 +1,521 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package:   tfmp_emulator
+ # Described: Software TFMini-Plus on a pseudo-terminal
+ #
+ # 'Emulator()' opens a pseudo-terminal pair and behaves like a
+ # TFMini-Plus connected to its 'port'.  Any program, or the
+ # 'tfmplus' module itself, can open 'port' as a serial port.
+ #
+ # Data frames are sent at the emulated frame rate, from 1Hz to
+ # 10KHz.  Throughput is limited to what the emulated baud rate
+ # can carry, 10 bits per byte, and frames that do not fit are
+ # dropped, as they are by the device.  If the host's port is
+ # set to a different baud rate than the emulator, the host
+ # receives noise.
+ #
+ # Every command in the 'sendCommand()' table is answered after
+ # a delay like that of the device: about 1ms for parameter
+ # changes and several hundred ms for FLASH writes.
+ #
+ # The frame rate, baud rate, output format and output setting
+ # given or set are kept in 'saved' by SAVE_SETTINGS, as in the
+ # device's FLASH.  SOFT_RESET restarts the device with them,
+ # and HARD_RESET saves the factory settings and restarts with
+ # those.  Both answer before the restart, at the old baud rate.
+ #
+ # Faults can be injected at any time:
+ #   'checksumRate' - fraction of frames with a bad checksum
+ #   'dropRate'     - fraction of frames missing one byte
+ #   'junkRate'     - fraction of frames preceded by junk bytes
+ #                    that include false header bytes
+ #   'weakRate'     - fraction of frames with dist = -1
+ #   'floodRate'    - fraction of frames with dist = -4
+ #   'stall( seconds)' stops all output for a time.
+ #
+ # If 'stampFrames' is True, each frame carries the time it was
+ # sent instead of a distance, for latency measurements: the low
+ # 30 bits of the monotonic time in microseconds, the high 15
+ # bits in 'dist' and the low 15 bits in 'flux'.
+ #
+ # Example:
+ #   with Emulator( frameRate = 1000, baud = 921600) as emu:
+ #       tfmplus.begin( emu.port, 921600)
+ #
+ # 'FakeI2CBus()' stands in for an 'I2CBus' of 'tfmp_i2c', with
+ # any number of emulated devices in I2C mode on it, each added
+ # with 'addDevice( address, frameRate)'.  Each device measures
+ # at its frame rate and answers a read with its latest frame.
+ # A read that finds no new measurement since the last one is
+ # counted in 'staleReads'.  A message to an address with no
+ # device fails the whole transaction, as on a real bus.
+ #
+ # Run this file to leave an emulator running on a pty:
+ #   python tfmp_emulator.py [frameRate] [baud] [--stamp] [--drop=RATE]
+ # where '--drop' sets 'dropRate'.
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import os
+import sys
+import pty
+import errno
+import tty
+import math
+import time
+import heapq
+import random
+import fcntl
+import termios
+import selectors
+import threading
+from array import array
+
+import tfmplus
+from tfmplus import TFMP_FRAME_SIZE
+
+TFMP_EMULATOR_TICK = 0.001   # seconds between output bursts
+
+#  Reply delays, in seconds, after the whole command is received
+LATENCY_PARAMETER = 0.001    # commands that modify parameters
+LATENCY_CHIP      = 0.005    # commands that talk to other chips
+LATENCY_FLASH     = 0.3      # commands that erase FLASH
+
+#  Termios speed codes of the supported baud rates.  Rates with
+#  no standard code are set by pyserial as a custom rate.
+customBaud = getattr( termios, 'BOTHER', 0o010000)
+baudCodes = { 9600: termios.B9600, 14400: customBaud, 19200: termios.B19200,
+              56000: customBaud, 115200: termios.B115200,
+              460800: termios.B460800, 921600: termios.B921600 }
+
+#  A custom rate has no code of its own, so 14400 and 56000 look
+#  the same to 'tcgetattr()'.  Linux keeps the speed itself in a
+#  'struct termios2', read with TCGETS2: 'c_ospeed' is its 11th
+#  32 bit word.  Elsewhere only the codes can be compared.
+TCGETS2 = 0x802C542A if sys.platform.startswith( 'linux') else None
+
+#  Return the baud rate the host set on the port of 'fd', or
+#  None if it cannot be read.
+def portSpeed( fd):
+    ''' Host baud rate of a pty'''
+    if( TCGETS2 is None):
+        return None
+    termios2 = array( 'I', bytes( 64))
+    try:
+        fcntl.ioctl( fd, TCGETS2, termios2)
+    except OSError:
+        return None
+    return termios2[ 10]
+
+#  Settings of a device as it leaves the factory.
+factorySettings = { 'frameRate': 100, 'baud': 115200,
+                    'format': tfmplus.STANDARD_FORMAT_CM, 'output': True }
+
+#  A 'distance( t)' function is given the host monotonic time in
+#  seconds and returns a distance in centimeters.  The default
+#  is a target slowly moving between 1m and 5m.
+def sweep( t):
+    ''' Default target distance in centimeters'''
+    return int( 300 + 200 * math.sin( t * 0.5))
+
+class Emulator:
+    ''' Software TFMini-Plus on a pseudo-terminal'''
+
+    def __init__( self, frameRate = 100, baud = 115200, distance = sweep,
+                  version = ( 2, 0, 7), seed = None):
+        self.frameRate = frameRate   # emulated data frame rate in Hz
+        self.baud = baud             # emulated serial baud rate
+        self.distance = distance     # target distance function
+        self.version = version       # firmware version reported
+        self.format = tfmplus.STANDARD_FORMAT_CM
+        self.output = True           # data output enabled
+        self.serialMode = True       # False in I2C mode
+        self.i2cAddress = tfmplus.TFMP_DEFAULT_ADDRESS
+        self.flux = 1000             # signal strength reported
+        self.tempCode = ( 40 + 256) << 3   # 40 degrees Celsius
+        self.stampFrames = False     # frames carry their send time
+        self.saved = self.settings() # settings kept in FLASH
+        #  Faults
+        self.checksumRate = 0.0
+        self.dropRate = 0.0
+        self.junkRate = 0.0
+        self.weakRate = 0.0
+        self.floodRate = 0.0
+        self.stallUntil = 0.0
+        self.random = random.Random( seed)
+        #  Counters
+        self.framesSent = 0
+        self.framesDropped = 0       # did not fit in the baud rate
+        self.bytesLost = 0           # host did not read fast enough
+        self.commands = 0
+        #  The pty pair.  The slave stays open here so the master
+        #  survives the host opening and closing the port.
+        self.master, self.slave = pty.openpty()
+        tty.setraw( self.slave)
+        os.set_blocking( self.master, False)
+        self.port = os.ttyname( self.slave)
+        self.cmndBuffer = bytearray()
+        self.replies = []            # heap of ( due time, count, bytes)
+        self.running = False
+        self.thread = None
+
+    def __enter__( self):
+        self.start()
+        return self
+
+    def __exit__( self, *exc):
+        self.close()
+
+    #  Start the emulator thread.
+    def start( self):
+        ''' Start sending frames'''
+        self.running = True
+        self.thread = threading.Thread( target = self.run,
+                                        name = 'tfmp-emulator', daemon = True)
+        self.thread.start()
+
+    #  Stop the emulator thread and close the pty pair.
+    def close( self):
+        ''' Stop and close the pty'''
+        self.running = False
+        if( self.thread is not None):
+            self.thread.join()
+            self.thread = None
+        for fd in ( self.master, self.slave):
+            try:
+                os.close( fd)
+            except OSError:
+                pass
+
+    #  Stop all output for 'seconds'.
+    def stall( self, seconds):
+        ''' Inject an output stall'''
+        self.stallUntil = time.monotonic() + seconds
+
+    #  Return the settings SAVE_SETTINGS keeps.
+    def settings( self):
+        ''' Current device settings'''
+        return { 'frameRate': self.frameRate, 'baud': self.baud,
+                 'format': self.format, 'output': self.output }
+
+    #  Restart the device with 'settings', silent for 'seconds'.
+    def restart( self, settings, seconds):
+        ''' Restart with saved settings'''
+        for name, value in settings.items():
+            setattr( self, name, value)
+        self.stall( seconds)
+
+    #  - - - - - - - - -  Data frames  - - - - - - - - - - - - - -
+    #  Return the bytes of one data frame, faults included,
+    #  in the current output format.
+    def makeFrame( self, t):
+        ''' Build one data frame'''
+        rand = self.random.random
+        if( self.stampFrames):
+            stamp = int( t * 1e6) & 0x3FFFFFFF
+            dist, flux = stamp >> 15, stamp & 0x7FFF
+        else:
+            dist, flux = self.distance( t), self.flux
+        if( self.weakRate and rand() < self.weakRate):
+            dist = -1
+        elif( self.floodRate and rand() < self.floodRate):
+            dist = -4
+        if( self.format == tfmplus.PIXHAWK_FORMAT):
+            return b'%.2f\r\n' % ( dist / 100)
+        if( self.format == tfmplus.STANDARD_FORMAT_MM and dist > 0):
+            dist *= 10
+        data = bytearray( b'\x59\x59')
+        data += tfmplus.frameData.pack( dist, flux, self.tempCode)
+        data.append( sum( data) & 0xFF)
+        if( self.checksumRate and rand() < self.checksumRate):
+            data[ 8] ^= 0x5A
+        if( self.dropRate and rand() < self.dropRate):
+            del data[ self.random.randrange( len( data))]
+        if( self.junkRate and rand() < self.junkRate):
+            data[ 0:0] = bytes( ( 0x59, self.random.randrange( 256), 0x59))
+        return data
+
+    #  Output at most 'room' bytes of the frames due by 'now'.
+    def sendFrames( self, count, room, now):
+        data = bytearray()
+        #  Frames more than 20 ticks late are dropped.
+        most = max( 1, int( self.frameRate * TFMP_EMULATOR_TICK * 20))
+        if( count > most):
+            self.framesDropped += count - most
+            count = most
+        for i in range( count):
+            frame = self.makeFrame( now)
+            if( len( data) + len( frame) > room):
+                self.framesDropped += count - i
+                break
+            data += frame
+            self.framesSent += 1
+        self.write( data)
+        return len( data)
+
+    #  Write to the host.  Bytes the host has no room for are lost,
+    #  as on a real UART, and bytes sent at the wrong baud rate
+    #  arrive as noise.
+    def write( self, data):
+        if( not data):
+            return
+        speed = portSpeed( self.master)
+        if( speed != self.baud if speed is not None else
+                baudCodes.get( self.baud) != termios.tcgetattr( self.master)[ 4]):
+            data = self.random.randbytes( len( data))
+        try:
+            written = os.write( self.master, data)
+        except BlockingIOError:
+            written = 0
+        self.bytesLost += len( data) - written
+
+    #  - - - - - - - - -  Commands  - - - - - - - - - - - - - - - -
+    #  Find every complete command in the bytes from the host.
+    def readCommands( self, now):
+        try:
+            self.cmndBuffer += os.read( self.master, 256)
+        except ( BlockingIOError, OSError):
+            return
+        buffer = self.cmndBuffer
+        while True:
+            pos = buffer.find( b'\x5A')
+            if( pos < 0):
+                buffer.clear()
+                return
+            del buffer[ :pos]
+            if( len( buffer) < 2 or len( buffer) < buffer[ 1]):
+                return
+            length = buffer[ 1]
+            cmnd = bytes( buffer[ :length])
+            if( length < 4 or ( sum( cmnd[ :-1]) & 0xFF) != cmnd[ -1]):
+                del buffer[ :1]     #  not a command, resync
+                continue
+            del buffer[ :length]
+            self.commands += 1
+            self.command( cmnd, now)
+
+    #  Queue 'data' to be sent 'delay' seconds after 'now'.
+    def reply( self, data, now, delay = LATENCY_PARAMETER):
+        data = bytearray( data)
+        data.append( sum( data) & 0xFF)
+        heapq.heappush( self.replies, ( now + delay, self.commands, bytes( data)))
+
+    #  Send 'data' at once, before a restart changes the settings.
+    def answer( self, data):
+        data = bytearray( data)
+        data.append( sum( data) & 0xFF)
+        self.write( data)
+
+    #  Carry out one command and queue its reply.
+    def command( self, cmnd, now):
+        ''' Answer one command'''
+        cmndId = cmnd[ 2]
+        echo = cmnd[ :-1]
+        if( cmndId == 0x01):      # GET_FIRMWARE_VERSION
+            major, minor, patch = self.version
+            self.reply( ( 0x5A, 0x07, 0x01, patch, minor, major), now)
+        elif( cmndId == 0x02):    # SOFT_RESET, restart with the saved settings
+            self.answer( ( 0x5A, 0x05, 0x02, 0x00))
+            self.restart( self.saved, LATENCY_CHIP)
+        elif( cmndId == 0x10):    # HARD_RESET, save the factory settings and restart
+            self.answer( ( 0x5A, 0x05, 0x10, 0x00))
+            self.saved = dict( factorySettings)
+            self.i2cAddress = tfmplus.TFMP_DEFAULT_ADDRESS
+            self.restart( self.saved, LATENCY_FLASH)
+        elif( cmndId == 0x11):    # SAVE_SETTINGS
+            self.saved = self.settings()
+            self.reply( ( 0x5A, 0x05, 0x11, 0x00), now, LATENCY_FLASH)
+        elif( cmndId == 0x03):    # SET_FRAME_RATE
+            self.frameRate = int.from_bytes( cmnd[ 3:5], 'little')
+            self.reply( echo, now)
+        elif( cmndId == 0x04):    # TRIGGER_DETECTION
+            self.heapFrame( now + LATENCY_PARAMETER)
+        elif( cmndId == 0x05):    # output format
+            self.format = ( cmnd[ 3] << 24) | 0x050505
+            self.reply( echo, now)
+        elif( cmndId == 0x06):    # SET_BAUD_RATE, echoed at the old rate
+            self.write( cmnd)
+            self.baud = int.from_bytes( cmnd[ 3:6], 'little')
+        elif( cmndId == 0x07):    # ENABLE_OUTPUT, DISABLE_OUTPUT
+            self.output = bool( cmnd[ 3])
+            self.reply( echo, now)
+        elif( cmndId == 0x0A):    # SET_SERIAL_MODE, SET_I2C_MODE
+            self.serialMode = ( cmnd[ 3] == 0)
+        elif( cmndId == 0x0B):    # SET_I2C_ADDRESS
+            self.i2cAddress = cmnd[ 3]
+            self.reply( echo, now, LATENCY_CHIP)
+        elif( cmndId == 0x00):    # I2C_FORMAT_CM, I2C_FORMAT_MM
+            self.heapFrame( now + LATENCY_PARAMETER)
+
+    #  Queue one data frame, as for a trigger command.
+    def heapFrame( self, due):
+        heapq.heappush( self.replies, ( due, self.commands, bytes( self.makeFrame( due))))
+
+    #  - - - - - - - - -  Emulator thread  - - - - - - - - - - - -
+    def run( self):
+        selector = selectors.DefaultSelector()
+        selector.register( self.master, selectors.EVENT_READ)
+        last = time.monotonic()
+        owed = 0.0     # frames due but not yet sent
+        room = 0.0     # bytes the baud rate allows to be sent now
+        while( self.running):
+            selector.select( TFMP_EMULATOR_TICK)
+            now = time.monotonic()
+            elapsed, last = now - last, now
+            self.readCommands( now)
+            #  The link carries baud / 10 bytes per second.  Unused
+            #  time is saved up for at most 10ms, like a UART FIFO.
+            byteRate = self.baud / 10
+            room = min( room + byteRate * elapsed, byteRate * 0.01 + TFMP_FRAME_SIZE)
+            #  Command replies and triggered frames
+            replies = self.replies
+            while( replies and replies[ 0][ 0] <= now):
+                data = heapq.heappop( replies)[ 2]
+                self.write( data)
+                room -= len( data)
+            #  Streaming data frames
+            if( now < self.stallUntil or not self.serialMode
+                    or not self.output or not self.frameRate):
+                owed = 0.0
+                continue
+            owed += self.frameRate * elapsed
+            count = int( owed)
+            if( count):
+                owed -= count
+                room -= self.sendFrames( count, max( room, 0), now)
+        selector.close()
+
+#  - - - - - - - - -  I2C bus  - - - - - - - - - - - - - - - -
+I2C_M_RD = 0x0001     # message flag of a read
+
+class FakeI2CDevice:
+    ''' Software TFMini-Plus in I2C mode'''
+
+    def __init__( self, address, frameRate = 100, distance = sweep):
+        self.address = address
+        self.frameRate = frameRate   # measurements per second
+        self.distance = distance     # target distance function
+        self.version = ( 2, 0, 7)
+        self.flux = 1000
+        self.tempCode = ( 40 + 256) << 3
+        self.serialMode = False
+        self.output = bytes( TFMP_FRAME_SIZE)    # answer to the next read
+        self.measurement = -1        # number of the last measurement read
+        self.reads = 0
+        self.staleReads = 0          # reads with no new measurement
+        self.commands = 0
+
+    #  Return the data frame of the latest measurement, in cm, or
+    #  in mm if 'mm'.  The device only measures at its frame rate.
+    def makeFrame( self, mm, now):
+        rate = self.frameRate
+        number = int( now * rate) if rate else self.measurement + 1
+        if( number == self.measurement):
+            self.staleReads += 1
+        self.measurement = number
+        dist = self.distance( number / rate if rate else now)
+        if( mm and dist > 0):
+            dist *= 10
+        data = bytearray( b'\x59\x59')
+        data += tfmplus.frameData.pack( dist, self.flux, self.tempCode)
+        data.append( sum( data) & 0xFF)
+        return bytes( data)
+
+    #  Carry out one command written by the host.  The answer is
+    #  kept for the next read.
+    def write( self, cmnd, bus):
+        self.commands += 1
+        if( len( cmnd) < 4 or cmnd[ 0] != 0x5A or ( sum( cmnd[ :-1]) & 0xFF) != cmnd[ -1]):
+            return
+        cmndId = cmnd[ 2]
+        echo = bytearray( cmnd)
+        reply = None
+        if( cmndId == 0x00 or cmndId == 0x04):    # I2C_FORMAT_CM, I2C_FORMAT_MM, TRIGGER_DETECTION
+            self.output = self.makeFrame( cmndId == 0x00 and cmnd[ 3] == 0x06, time.monotonic())
+            return
+        if( cmndId == 0x01):                      # GET_FIRMWARE_VERSION
+            major, minor, patch = self.version
+            reply = bytearray( ( 0x5A, 0x07, 0x01, patch, minor, major, 0))
+        elif( cmndId in ( 0x02, 0x10, 0x11)):     # resets and SAVE_SETTINGS
+            reply = bytearray( ( 0x5A, 0x05, cmndId, 0x00, 0))
+        elif( cmndId == 0x03):                    # SET_FRAME_RATE
+            self.frameRate = int.from_bytes( cmnd[ 3:5], 'little')
+            reply = echo
+        elif( cmndId == 0x0A):                    # SET_SERIAL_MODE
+            self.serialMode = ( cmnd[ 3] == 0)
+            if( self.serialMode):
+                bus.devices.pop( self.address, None)
+            return
+        elif( cmndId == 0x0B):                    # SET_I2C_ADDRESS, from now on
+            bus.devices.pop( self.address, None)
+            self.address = cmnd[ 3]
+            bus.devices[ self.address] = self
+            reply = echo
+        else:                                     # formats, output and others
+            reply = echo
+        reply[ -1] = sum( reply[ :-1]) & 0xFF
+        self.output = bytes( reply)
+
+    #  Fill 'buffer' with the answer to the last command.
+    def read( self, buffer):
+        self.reads += 1
+        output = self.output[ :len( buffer)]
+        buffer[ :len( output)] = output
+        buffer[ len( output):] = bytes( len( buffer) - len( output))
+
+class FakeI2CBus:
+    ''' In-process stand-in for an I2C bus'''
+
+    def __init__( self):
+        self.devices = {}        # FakeI2CDevice objects by address
+        self.transactions = 0
+        self.messages = 0
+
+    #  Put a device at 'address' and return it.
+    def addDevice( self, address = tfmplus.TFMP_DEFAULT_ADDRESS, frameRate = 100, distance = sweep):
+        ''' Add an emulated device to the bus'''
+        device = self.devices[ address] = FakeI2CDevice( address, frameRate, distance)
+        return device
+
+    #  Run 'messages', a list of ( address, flags, buffer), as
+    #  one transaction.  Returns the number of messages.  Read
+    #  buffers are filled in place.
+    def transfer( self, messages):
+        ''' Run one combined transaction'''
+        self.transactions += 1
+        for address, flags, buffer in messages:
+            device = self.devices.get( address)
+            if( device is None):
+                raise OSError( errno.ENXIO, f"no device at address {address:#04x}")
+            self.messages += 1
+            if( flags & I2C_M_RD):
+                device.read( buffer)
+            else:
+                device.write( bytes( buffer), self)
+        return len( messages)
+
+    #  Return a function that runs 'messages' as one transaction.
+    def batch( self, messages):
+        ''' Prepare a transaction to run many times'''
+        messages = list( messages)
+        return lambda: self.transfer( messages)
+
+    def close( self):
+        pass
+
+if __name__ == "__main__":
+    import sys
+    flags = [ arg for arg in sys.argv[ 1:] if arg.startswith( '--')]
+    args = [ arg for arg in sys.argv[ 1:] if not arg.startswith( '--')]
+    frameRate = int( args[ 0]) if len( args) > 0 else 100
+    baud = int( args[ 1]) if len( args) > 1 else 115200
+    with Emulator( frameRate, baud) as emu:
+        emu.stampFrames = '--stamp' in flags
+        for flag in flags:
+            if( flag.startswith( '--drop=')):
+                emu.dropRate = float( flag[ 7:])
+        print( f"TFMini-Plus emulator on {emu.port} at {frameRate}Hz, {baud} baud", flush = True)
+        print( "Press Ctrl-C to stop", flush = True)
+        try:
+            while True:
+                time.sleep( 1)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,274 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package:   tfmp_filter
+ # Described: Smoothing filters for TFMini-Plus distance data
+ #
+ # A 'Pipeline' passes each distance through a chain of filter
+ # stages.  Every stage keeps its state between samples, so the
+ # cost of a sample does not grow with the length of the data:
+ #   Median( window)  - sliding median, O(log window) in two heaps
+ #   EMA( alpha)      - exponential moving average, O(1)
+ #   Kalman( q, r)    - one dimensional Kalman filter, O(1)
+ #
+ # The pipeline is flux-aware: frames whose 'status' would be
+ # WEAK, STRONG or FLOOD carry no valid distance, so they are
+ # dropped before the first stage and counted in 'dropped'.
+ #
+ # One frame at a time:
+ #   smooth = Pipeline( Median( 5), Kalman( 1.0, 4.0))
+ #   if( sensor.getData()):
+ #       value = smooth.update( sensor.dist, sensor.flux)
+ # or every frame of a read at once, which avoids a method call
+ # per sample in each stage:
+ #   dists, fluxes, temps = sensor.getFrames()
+ #   values = smooth.run( dists, fluxes)
+ # 'update()' returns None for a dropped frame.  'run()' returns
+ # an array of one value for each frame that was not dropped.
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import collections
+from heapq import heappush, heappop, heapify
+from array import array
+
+from tfmplus import frameStatus, TFMP_READY
+
+class Median:
+    ''' Sliding window median'''
+
+    #  The window is held in two heaps: 'low', the smaller half,
+    #  as a max heap of negated samples, and 'high', the larger
+    #  half.  Each sample is kept with its sample number 'n', so
+    #  every entry is distinct and both heaps order equal samples
+    #  the same way.  A sample that leaves the window is not
+    #  searched for.  It is only counted out of its half, and
+    #  popped once it reaches the top of its heap.  Stale entries
+    #  buried in a heap are swept out once the heaps hold twice
+    #  the window, so each sample costs O(log window) on average.
+    def __init__( self, window = 5):
+        self.window = window
+        self.reset()
+
+    def reset( self):
+        self.values = collections.deque()   # samples in the window, oldest first
+        self.low = []        # ( -x, -n) of the smaller half
+        self.high = []       # ( x, n) of the larger half
+        self.lowSize = 0     # samples of 'low' still in the window
+        self.highSize = 0    # samples of 'high' still in the window
+        self.count = 0       # samples seen, the next 'n'
+
+    #  Add sample 'x' and return the median of the window.
+    def update( self, x):
+        ''' Filter one sample'''
+        low, high, values = self.low, self.high, self.values
+        n = self.count
+        self.count = n + 1
+        values.append( x)
+        if( low and x < -low[ 0][ 0]):
+            heappush( low, ( -x, -n))
+            self.lowSize += 1
+        else:
+            heappush( high, ( x, n))
+            self.highSize += 1
+        if( n >= self.window):
+            #  Sample 'n - window' leaves.  Every entry at or
+            #  before it is stale, and is popped from the tops.
+            y, j = values.popleft(), n - self.window
+            if( low and ( -y, -j) >= low[ 0]):
+                self.lowSize -= 1
+            else:
+                self.highSize -= 1
+            while( low and -low[ 0][ 1] <= j):
+                heappop( low)
+            while( high and high[ 0][ 1] <= j):
+                heappop( high)
+        #  Keep 'low' equal to 'high' or one larger.
+        if( self.lowSize > self.highSize + 1):
+            v, i = heappop( low)
+            heappush( high, ( -v, -i))
+            self.lowSize -= 1
+            self.highSize += 1
+            while( low and -low[ 0][ 1] <= n - self.window):
+                heappop( low)
+        elif( self.highSize > self.lowSize):
+            v, i = heappop( high)
+            heappush( low, ( -v, -i))
+            self.highSize -= 1
+            self.lowSize += 1
+            while( high and high[ 0][ 1] <= n - self.window):
+                heappop( high)
+        if( len( low) + len( high) > 2 * self.window):
+            self.sweep( n - self.window)
+        if( self.lowSize > self.highSize):
+            return -low[ 0][ 0]
+        return ( high[ 0][ 0] - low[ 0][ 0]) / 2
+
+    #  Remove every entry of sample 'j' or before from the heaps.
+    def sweep( self, j):
+        low, high = self.low, self.high
+        low[:] = [ e for e in low if -e[ 1] > j]
+        high[:] = [ e for e in high if e[ 1] > j]
+        heapify( low)
+        heapify( high)
+
+    #  Each median depends on the order of every sample in its
+    #  window, so without NumPy there is no bulk form.  This is
+    #  'update()' with the state in local variables, which saves
+    #  the method call and attribute lookups of each sample.
+    def run( self, values):
+        ''' Filter an array of samples'''
+        low, high, window = self.low, self.high, self.values
+        push, pop = window.append, window.popleft
+        lowSize, highSize, n = self.lowSize, self.highSize, self.count
+        size = self.window
+        out = []
+        append = out.append
+        for x in values:
+            push( x)
+            if( low and x < -low[ 0][ 0]):
+                heappush( low, ( -x, -n))
+                lowSize += 1
+            else:
+                heappush( high, ( x, n))
+                highSize += 1
+            j = n - size       #  stale at or before 'j'
+            if( j >= 0):
+                y = pop()
+                if( low and ( -y, -j) >= low[ 0]):
+                    lowSize -= 1
+                else:
+                    highSize -= 1
+                while( low and -low[ 0][ 1] <= j):
+                    heappop( low)
+                while( high and high[ 0][ 1] <= j):
+                    heappop( high)
+            if( lowSize > highSize + 1):
+                v, i = heappop( low)
+                heappush( high, ( -v, -i))
+                lowSize -= 1
+                highSize += 1
+                while( low and -low[ 0][ 1] <= j):
+                    heappop( low)
+            elif( highSize > lowSize):
+                v, i = heappop( high)
+                heappush( low, ( -v, -i))
+                highSize -= 1
+                lowSize += 1
+                while( high and high[ 0][ 1] <= j):
+                    heappop( high)
+            if( len( low) + len( high) > 2 * size):
+                self.sweep( j)
+            append( -low[ 0][ 0] if lowSize > highSize else ( high[ 0][ 0] - low[ 0][ 0]) / 2)
+            n += 1
+        self.lowSize, self.highSize, self.count = lowSize, highSize, n
+        return array( 'd', out)
+
+class EMA:
+    ''' Exponential moving average'''
+
+    #  Each sample is given weight 'alpha', between 0 and 1.
+    def __init__( self, alpha = 0.2):
+        self.alpha = alpha
+        self.reset()
+
+    def reset( self):
+        self.value = None    # set by the first sample
+
+    def update( self, x):
+        ''' Filter one sample'''
+        if( self.value is None):
+            self.value = float( x)
+        else:
+            self.value += self.alpha * ( x - self.value)
+        return self.value
+
+    def run( self, values):
+        ''' Filter an array of samples'''
+        if( not values):
+            return array( 'd')
+        alpha = self.alpha
+        y = values[ 0] if self.value is None else self.value
+        out = []
+        append = out.append
+        for x in values:
+            y += alpha * ( x - y)
+            append( y)
+        self.value = y
+        return array( 'd', out)
+
+class Kalman:
+    ''' One dimensional Kalman filter'''
+
+    #  'q' is the variance added to the distance between samples
+    #  and 'r' the variance of a measurement, both in units of
+    #  the distance squared.  A small 'q' against 'r' smooths more.
+    def __init__( self, q = 1.0, r = 4.0):
+        self.q = q
+        self.r = r
+        self.reset()
+
+    def reset( self):
+        self.value = None    # estimated distance, set by the first sample
+        self.p = self.r      # variance of the estimate
+
+    def update( self, x):
+        ''' Filter one sample'''
+        if( self.value is None):
+            self.value = float( x)
+        p = self.p + self.q
+        k = p / ( p + self.r)
+        self.value += k * ( x - self.value)
+        self.p = p * ( 1 - k)
+        return self.value
+
+    def run( self, values):
+        ''' Filter an array of samples'''
+        if( not values):
+            return array( 'd')
+        q, r = self.q, self.r
+        y = values[ 0] if self.value is None else self.value
+        p = self.p
+        out = []
+        append = out.append
+        for x in values:
+            p += q
+            k = p / ( p + r)
+            y += k * ( x - y)
+            p *= 1 - k
+            append( y)
+        self.value, self.p = float( y), p
+        return array( 'd', out)
+
+class Pipeline:
+    ''' Chain of filter stages for valid distances'''
+
+    def __init__( self, *stages):
+        self.stages = stages
+        self.dropped = 0     # frames dropped as WEAK, STRONG or FLOOD
+
+    def reset( self):
+        for stage in self.stages:
+            stage.reset()
+
+    #  Filter the distance of one frame.  Returns the output of
+    #  the last stage, or None if the frame was dropped.
+    def update( self, dist, flux):
+        ''' Filter one frame'''
+        if( frameStatus( dist, flux) != TFMP_READY):
+            self.dropped += 1
+            return None
+        value = dist
+        for stage in self.stages:
+            value = stage.update( value)
+        return value
+
+    #  Filter the arrays of one read, such as those returned by
+    #  'getFrames()'.  Returns an array of outputs for the frames
+    #  that were not dropped.
+    def run( self, dists, fluxes):
+        ''' Filter many frames'''
+        #  The tests of 'frameStatus()', without a call per frame
+        values = array( 'd', [ d for d, f in zip( dists, fluxes)
+                               if d != -1 and f != -1 and d != -4])
+        self.dropped += len( dists) - len( values)
+        for stage in self.stages:
+            values = stage.run( values)
+        return values
@@ -0,0 +1,149 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package:   tfmp_group
+ # Described: Read many TFMini-Plus devices from one thread
+ #
+ # A 'SensorGroup' holds any number of 'TFMPlus' objects, each
+ # on its own serial port.  'poll()' waits on the file handles
+ # of every port at once using 'selectors' (epoll on Linux)
+ # and decodes whatever bytes have arrived for each device.
+ # Nothing waits on a quiet device and nothing spins.
+ #
+ # Records are tuples of:
+ #   ( sensor_id, stamp, dist, flux, temp)
+ # where 'stamp' is the host monotonic time of the read that
+ # delivered the frame.  Every port is read and stamped in
+ # turn, so the records from 'poll()' are already in time order.
+ # Each device's 'clock' still times its own frames, see
+ # 'FrameClock'.  Every read goes through 'takeData()' of its
+ # device, so recording and command replies work as they do for
+ # a device read alone.
+ #
+ # A port that hangs up or fails is no longer waited on.  Its
+ # device's status is set to 'TFMP_SERIAL' and the time is kept
+ # in 'lost' by 'sensor_id'.  'records()' ends once every port
+ # is lost.
+ #
+ # Example:
+ #   group = SensorGroup()
+ #   group.add( 'front', '/dev/ttyUSB0')
+ #   group.add( 'rear', '/dev/ttyUSB1')
+ #   for sensor_id, stamp, dist, flux, temp in group.records():
+ #       print( sensor_id, dist)
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import os
+import time
+import selectors
+from array import array
+import serial
+
+from tfmplus import TFMPlus, frameStatus
+from tfmplus import TFMP_CHECKSUM, TFMP_SERIAL
+
+TFMP_READ_CHUNK = 4096   # largest single read from one port
+
+class SensorGroup:
+    ''' Many TFMini-Plus devices read from one thread'''
+
+    def __init__( self):
+        self.selector = selectors.DefaultSelector()
+        self.sensors = {}   # TFMPlus objects by 'sensor_id'
+        self.lost = {}      # time each lost port failed, by 'sensor_id'
+
+    #  Open 'port' at 'rate' baud and add it as 'sensor_id'.
+    #  Returns the new 'TFMPlus' object, which can still be
+    #  used to send commands.
+    def add( self, sensor_id, port, rate = 115200):
+        ''' Open a serial port and add it to the group'''
+        sensor = TFMPlus()
+        sensor.pStream = serial.Serial( port, rate, timeout = 0)
+        sensor.clock.setBaud( rate)
+        self.addDevice( sensor_id, sensor)
+        return sensor
+
+    #  Add a 'TFMPlus' object whose port is already open.
+    def addDevice( self, sensor_id, sensor):
+        ''' Add an open device to the group'''
+        if( sensor_id in self.sensors):
+            raise ValueError( f"sensor_id {sensor_id!r} is already in the group")
+        fd = sensor.pStream.fileno()
+        os.set_blocking( fd, False)
+        self.selector.register( fd, selectors.EVENT_READ, ( sensor_id, sensor))
+        self.sensors[ sensor_id] = sensor
+
+    #  Remove a device from the group.  Its port stays open.
+    def remove( self, sensor_id):
+        ''' Remove a device from the group'''
+        sensor = self.sensors.pop( sensor_id)
+        if( self.lost.pop( sensor_id, None) is None):
+            self.selector.unregister( sensor.pStream.fileno())
+        return sensor
+
+    #  Stop waiting on the port of a device that hung up or
+    #  failed, and note when.
+    def lose( self, key):
+        ''' Drop a failed port from the wait'''
+        sensor_id, sensor = key.data
+        self.selector.unregister( key.fd)
+        sensor.status = TFMP_SERIAL
+        self.lost[ sensor_id] = time.monotonic()
+
+    #  Wait up to 'timeout' seconds for data from any device, then
+    #  decode everything that arrived.  Returns a list of records,
+    #  oldest first, which is empty if the wait timed out or no
+    #  port is left to wait on.
+    def poll( self, timeout = None):
+        ''' Read and decode every ready port'''
+        records = []
+        if( timeout is None and not self.selector.get_map()):
+            return records
+        append = records.append
+        dists, fluxes, temps = array( 'h'), array( 'h'), array( 'h')
+        for key, events in self.selector.select( timeout):
+            sensor_id, sensor = key.data
+            try:
+                data = os.read( key.fd, TFMP_READ_CHUNK)
+            except BlockingIOError:
+                continue
+            except OSError:
+                data = b''
+            if( not data):
+                self.lose( key)       #  hung up, such as EIO from a pty
+                continue
+            stamp = time.monotonic()
+            sensor.takeData( data, stamp)
+            errors = sensor.syncFrames( dists, fluxes, temps)
+            if( dists):
+                for i in range( len( dists)):
+                    append( ( sensor_id, stamp, dists[ i], fluxes[ i], temps[ i]))
+                sensor.dist = d = dists[ -1]
+                sensor.flux = f = fluxes[ -1]
+                sensor.temp = temps[ -1]
+                sensor.status = frameStatus( d, f)
+                del dists[ :], fluxes[ :], temps[ :]
+            elif( errors):
+                sensor.status = TFMP_CHECKSUM
+        return records
+
+    #  Yield records until every port is lost, or until no data
+    #  arrives from any device for 'timeout' seconds.
+    def records( self, timeout = None):
+        ''' Merged, time ordered stream of records'''
+        while( self.selector.get_map()):
+            batch = self.poll( timeout)
+            if( not batch and timeout is not None):
+                return
+            yield from batch
+
+    #  Close every port and empty the group.
+    def close( self):
+        ''' Close all ports'''
+        for sensor_id in list( self.sensors):
+            self.remove( sensor_id).pStream.close()
+        self.selector.close()
+
+    def __enter__( self):
+        return self
+
+    def __exit__( self, *exc):
+        self.close()
@@ -0,0 +1,459 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package:   tfmp_i2c
+ # Described: TFMini-Plus devices on a Linux I2C bus
+ #
+ # A TFMini-Plus set to I2C mode with 'SET_I2C_MODE' is a slave
+ # at address 0x10, or any address from 0x08 to 0x77 set with
+ # 'SET_I2C_ADDRESS', so many devices can share one bus.  The
+ # host writes a command frame and reads the answer: a data
+ # frame for 'I2C_FORMAT_CM' or 'I2C_FORMAT_MM', or the reply.
+ #
+ # 'I2CBus( 1)' opens '/dev/i2c-1' and runs transactions with the
+ # 'I2C_RDWR' ioctl, which sends any number of messages with a
+ # repeated START between them and one STOP at the end.
+ #
+ # 'TFMPlusI2C' is a 'TFMPlus' object on a bus, with the same
+ # 'getData()', 'getFrames()', 'sendCommand()', variables, metrics
+ # and print functions.  Streaming and triggered modes belong to
+ # the serial port and are not used in I2C mode.
+ #
+ # An 'I2CGroup' polls every device on a bus in one transaction
+ # per cycle: the format command to every address, then a read
+ # of every address.  The device answers a read with its latest
+ # measurement, so Benewake asks for a frame rate at least 2.5
+ # times the read rate, or the same measurement may be read
+ # twice.  Cycles run on a fixed schedule at 'readRate', which is
+ # 'frameRate / 2.5', at most 100Hz, unless given, and may never
+ # be faster than 'frameRate / 2.5'.  A
+ # device that does not answer fails the whole transaction, so
+ # it is then left out and tried on its own every
+ # 'TFMP_I2C_RETRY' seconds until it answers again.
+ #
+ # Records are the same tuples as those of a 'SensorGroup':
+ #   ( sensor_id, stamp, dist, flux, temp)
+ # where 'stamp' is the host monotonic time of the transaction.
+ #
+ # Example:
+ #   with I2CGroup( 1, frameRate = 100) as group:
+ #       group.add( 'front', 0x10)
+ #       group.add( 'rear', 0x11)
+ #       for sensor_id, stamp, dist, flux, temp in group.records():
+ #           print( sensor_id, dist)
+ # Any object with the 'transfer()' and 'batch()' functions of
+ # 'I2CBus' can be given as the bus, such as the 'FakeI2CBus' of
+ # 'tfmp_emulator'.
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import os
+import time
+import fcntl
+import ctypes
+from array import array
+
+from tfmplus import TFMPlus, CommandResult, encodeCommand, replyStatus, replyTimeout
+from tfmplus import frameStatus, settingCommands
+from tfmplus import TFMP_FRAME_SIZE, TFMP_REPLY_SIZE, TFMP_DEFAULT_ADDRESS, TFMP_FLASH_TIMEOUT
+from tfmplus import TFMP_READY, TFMP_HEADER, TFMP_CHECKSUM, TFMP_I2CREAD, TFMP_I2CWRITE, TFMP_I2CLENGTH
+from tfmplus import TFMP_I2CNACK, TFMP_WEAK, TFMP_STRONG, TFMP_FLOOD
+from tfmplus import I2C_FORMAT_CM, I2C_FORMAT_MM, SET_I2C_ADDRESS, SET_SERIAL_MODE, SET_FRAME_RATE
+from tfmplus import TRIGGER_DETECTION, STANDARD_FORMAT_CM, STANDARD_FORMAT_MM
+
+I2C_RDWR  = 0x0707        # ioctl of a combined transaction, from 'linux/i2c-dev.h'
+I2C_M_RD  = 0x0001        # message flag of a read
+TFMP_I2C_MESSAGES = 42    # most messages in one transaction, I2C_RDWR_IOCTL_MAX_MSGS
+TFMP_I2C_SPEED    = 100000   # bus clock, for the time of a frame on the bus
+TFMP_I2C_MARGIN   = 2.5   # frame rate over read rate, from Benewake
+TFMP_I2C_MAX_RATE = 100   # highest read rate Benewake advises
+TFMP_I2C_DELAY    = 0.001    # seconds from a command to its reply
+TFMP_I2C_FLASH_DELAY = 0.5   # seconds from a FLASH command to its reply
+TFMP_I2C_RETRY    = 1.0   # seconds between tries of a device that failed
+
+#  Format of the data frame read by each I2C format command
+i2cFormats = { I2C_FORMAT_CM: STANDARD_FORMAT_CM, I2C_FORMAT_MM: STANDARD_FORMAT_MM }
+
+#  'struct i2c_msg' and 'struct i2c_rdwr_ioctl_data'
+class I2CMessage( ctypes.Structure):
+    _fields_ = [ ( 'addr', ctypes.c_uint16), ( 'flags', ctypes.c_uint16),
+                 ( 'len', ctypes.c_uint16), ( 'buf', ctypes.POINTER( ctypes.c_uint8))]
+
+class I2CTransfer( ctypes.Structure):
+    _fields_ = [ ( 'msgs', ctypes.POINTER( I2CMessage)), ( 'nmsgs', ctypes.c_uint32)]
+
+class I2CBus:
+    ''' Linux i2c-dev bus'''
+
+    #  Open bus number 'bus', or the device path 'bus'.
+    def __init__( self, bus = 1):
+        self.path = bus if isinstance( bus, str) else f"/dev/i2c-{bus}"
+        self.fd = os.open( self.path, os.O_RDWR)
+
+    #  Return a function that runs 'messages', a list of
+    #  ( address, flags, buffer), as one transaction.  Each buffer
+    #  is a 'bytearray' that is written from, or read into in
+    #  place if 'flags' has 'I2C_M_RD'.  The ioctl structures are
+    #  built once, so running it again costs only the ioctl.
+    def batch( self, messages):
+        ''' Prepare a transaction to run many times'''
+        messages = list( messages)
+        if( len( messages) > TFMP_I2C_MESSAGES):
+            raise ValueError( f"more than {TFMP_I2C_MESSAGES} messages in one transaction")
+        msgs = ( I2CMessage * len( messages))()
+        buffers = []
+        for msg, ( address, flags, buffer) in zip( msgs, messages):
+            data = ( ctypes.c_uint8 * len( buffer)).from_buffer( buffer)
+            buffers.append( data)
+            msg.addr, msg.flags, msg.len = address, flags, len( buffer)
+            msg.buf = ctypes.cast( data, ctypes.POINTER( ctypes.c_uint8))
+        transfer = I2CTransfer( msgs, len( messages))
+
+        #  The buffers and messages are kept as long as 'run'.
+        def run( fd = self.fd, transfer = transfer, count = len( messages), keep = ( msgs, buffers)):
+            done = fcntl.ioctl( fd, I2C_RDWR, transfer, True)
+            if( done != count):
+                raise OSError( f"{done} of {count} I2C messages sent")
+            return done
+        return run
+
+    #  Run 'messages' once.  Returns the number of messages.
+    def transfer( self, messages):
+        ''' Run one combined transaction'''
+        return self.batch( messages)()
+
+    def close( self):
+        ''' Close the bus'''
+        if( self.fd >= 0):
+            os.close( self.fd)
+            self.fd = -1
+
+class TFMPlusI2C( TFMPlus):
+    ''' Benewake TFMini-Plus Lidar device on an I2C bus'''
+    __slots__ = ( 'bus', 'address', 'format', 'command', 'buffer', 'cycle')
+
+    #  'bus' is an 'I2CBus' or a bus number, and may be given
+    #  later to 'begin()'.
+    def __init__( self, bus = None, address = TFMP_DEFAULT_ADDRESS, format = I2C_FORMAT_CM):
+        super().__init__()
+        self.bus = I2CBus( bus) if isinstance( bus, ( int, str)) else bus
+        self.address = address                      # slave address
+        self.buffer = bytearray( TFMP_FRAME_SIZE)    # data frame read
+        self.cycle = None                            # prebuilt frame read
+        self.clock.setRate( 0)                       # frames are read on demand
+        self.clock.setBaud( TFMP_I2C_SPEED)
+        self.setFormat( format)
+
+    #  Read frames with 'format', 'I2C_FORMAT_CM' or 'I2C_FORMAT_MM',
+    #  from now on.
+    def setFormat( self, format):
+        ''' Set the I2C data frame format'''
+        self.format = format
+        self.command = bytearray( encodeCommand( format, 0)[ 0])
+        self.decoder.setFormat( i2cFormats[ format])
+        self.cycle = None
+
+    #  Return TRUE/FALSE whether a data frame is read from the
+    #  device at 'address' on 'bus', and set status to match.
+    def begin( self, bus = 1, address = TFMP_DEFAULT_ADDRESS):
+        ''' Set I2C bus and address and test for data'''
+        if( isinstance( bus, ( int, str))):
+            bus = I2CBus( bus)
+        self.bus = bus
+        self.address = address
+        self.cycle = None
+        return self.getData()
+
+    #  Decode the data frame in 'data', set 'dist', 'flux', 'temp'
+    #  and 'status' and count it as 'readFrames()' does.  Returns
+    #  True if the frame passed the checksum test.
+    def takeFrame( self, data):
+        ''' Decode one data frame read'''
+        rxBuffer = self.rxBuffer
+        rxBuffer[:] = data
+        dists, fluxes, temps = self.dists, self.fluxes, self.temps
+        errors = self.syncFrames( dists, fluxes, temps)
+        rxBuffer.clear()       #  the next read is a whole frame
+        if( not dists):
+            self.status = TFMP_CHECKSUM if errors else TFMP_HEADER
+            return False
+        self.dist = dists[ -1]
+        self.flux = fluxes[ -1]
+        self.temp = temps[ -1]
+        del dists[ :], fluxes[ :], temps[ :]
+        self.status = frameStatus( self.dist, self.flux)
+        return True
+
+    #  Return TRUE/FALSE whether data received without error
+    #  and set status to provide more information.  The format
+    #  command and the read are one transaction, and if it is
+    #  not acknowledged status is I2CNACK, counted in
+    #  'statusCounts'.
+    def getData( self):
+        ''' Get I2C frame data from device'''
+        if( self.cycle is None):
+            self.cycle = self.bus.batch( ( ( self.address, 0, self.command),
+                                           ( self.address, I2C_M_RD, self.buffer)))
+        try:
+            self.cycle()
+        except OSError:
+            self.status = TFMP_I2CNACK
+            self.statusCounts[ TFMP_I2CNACK] += 1
+            return False
+        return self.takeFrame( self.buffer) and self.status == TFMP_READY
+
+    #  Return three arrays, 'dists', 'fluxes' and 'temps', holding
+    #  the frame read, or empty if none was read.  A frame with
+    #  a WEAK, STRONG or FLOOD status was read, and is returned.
+    def getFrames( self):
+        ''' Get one frame of data'''
+        dists, fluxes, temps = array( 'h'), array( 'h'), array( 'h')
+        if( self.getData() or self.status in ( TFMP_WEAK, TFMP_STRONG, TFMP_FLOOD)):
+            dists.append( self.dist)
+            fluxes.append( self.flux)
+            temps.append( self.temp)
+        return dists, fluxes, temps
+
+    #  Send one command and get its reply.  Returns TRUE/FALSE
+    #  and sets an explanatory 'status' code.  The reply is read
+    #  after the device has had time to act on the command, and
+    #  that of 'SET_I2C_ADDRESS' from the new address.
+    def sendCommand( self, cmnd, param):
+        ''' Send I2C command and get reply data'''
+        if( cmnd in i2cFormats):
+            self.setFormat( cmnd)
+            return self.getData()
+        cmndData, replyLen = encodeCommand( cmnd, param)
+        if( cmnd == TRIGGER_DETECTION):
+            replyLen = TFMP_FRAME_SIZE     #  the answer is a data frame
+        start = time.monotonic()
+        try:
+            self.bus.transfer( ( ( self.address, 0, bytearray( cmndData)),))
+        except OSError:
+            self.status = TFMP_I2CWRITE
+            return False
+        address = cmndData[ 3] if cmnd == SET_I2C_ADDRESS else self.address
+        if( cmnd == SET_SERIAL_MODE or not replyLen):
+            self.status = TFMP_READY       #  no reply, or the device has left the bus
+            return True
+        time.sleep( TFMP_I2C_FLASH_DELAY if replyTimeout( cmnd) == TFMP_FLASH_TIMEOUT
+                    else TFMP_I2C_DELAY)
+        reply = bytearray( replyLen)
+        try:
+            self.bus.transfer( ( ( address, I2C_M_RD, reply),))
+        except OSError:
+            self.status = TFMP_I2CREAD
+            return False
+        if( cmnd == TRIGGER_DETECTION):
+            return self.takeFrame( reply) and self.status == TFMP_READY
+        self.commandLatency.add( time.monotonic() - start)
+        #  Keep the reply for 'printReply()'
+        self.reply[:] = bytes( TFMP_REPLY_SIZE)
+        self.reply[ :replyLen] = reply
+        if( reply[ 0] != 0x5A or reply[ 2] != cmndData[ 2]):
+            self.status = TFMP_HEADER
+        elif( reply[ 1] != replyLen):
+            self.status = TFMP_I2CLENGTH
+        elif( ( sum( reply[ :-1]) & 0xFF) != reply[ -1]):
+            self.status = TFMP_CHECKSUM
+        else:
+            self.status = replyStatus( cmnd, reply, self.version)
+        if( self.status == TFMP_READY):
+            if( cmnd in settingCommands):
+                self.settings[ settingCommands[ cmnd]] = ( cmnd, param)
+            if( cmnd == SET_I2C_ADDRESS):
+                self.address = address
+                self.cycle = None
+        return self.status == TFMP_READY
+
+    #  Send every ( cmnd, param) pair in 'commands' in turn.
+    #  Returns a list of 'CommandResult', one for each command.
+    def sendCommands( self, commands):
+        ''' Send a batch of commands and get their replies'''
+        results = []
+        for cmnd, param in commands:
+            start = time.monotonic()
+            self.sendCommand( cmnd, param)
+            results.append( CommandResult( cmnd, param, self.status,
+                                           bytes( self.reply) if self.status == TFMP_READY else None,
+                                           time.monotonic() - start))
+        return results
+
+class I2CGroup:
+    ''' Many TFMini-Plus devices polled on one I2C bus'''
+
+    #  'bus' is an 'I2CBus', a bus number or a fake bus.  The
+    #  devices are taken to measure at 'frameRate', and are read
+    #  at 'readRate', see 'setReadRate()'.
+    def __init__( self, bus = 1, frameRate = 100, readRate = None, format = I2C_FORMAT_CM):
+        self.owned = isinstance( bus, ( int, str))    # the bus is closed with the group
+        self.bus = I2CBus( bus) if self.owned else bus
+        self.format = format
+        self.sensors = {}       # TFMPlusI2C objects by 'sensor_id'
+        self.missing = {}       # time of the next try, by 'sensor_id'
+        self.layout = None      # ( sensor_id, address, command) of each device batched
+        self.runs = []          # prebuilt transactions of one cycle
+        self.next = None        # time of the next cycle
+        self.cycles = 0         # cycles run
+        self.lateCycles = 0     # cycles that started a period or more late
+        self.failures = 0       # cycles in which a device did not answer
+        self.frameRate = frameRate
+        self.setReadRate( readRate)
+
+    #  Read every device 'readRate' times a second, or as fast
+    #  as 'frameRate' allows, up to 100Hz, if None.  Raises
+    #  ValueError if the frame rate is less than 2.5 times the
+    #  read rate.
+    def setReadRate( self, readRate = None):
+        ''' Set the number of cycles a second'''
+        limit = self.frameRate / TFMP_I2C_MARGIN
+        if( readRate is None):
+            readRate = min( limit, TFMP_I2C_MAX_RATE)
+        if( not 0 < readRate <= limit):
+            raise ValueError( f"read rate {readRate}Hz needs a frame rate of at least "
+                              f"{TFMP_I2C_MARGIN * readRate:g}Hz, not {self.frameRate}Hz")
+        self.readRate = readRate
+        self.period = 1 / readRate
+        self.next = None
+
+    #  Set every device to 'frameRate' with 'SET_FRAME_RATE', and
+    #  the read rate to match, see 'setReadRate()'.  Returns True
+    #  if every device answered.
+    def setFrameRate( self, frameRate, readRate = None):
+        ''' Set the frame rate of every device'''
+        answered = all( [ sensor.sendCommand( SET_FRAME_RATE, frameRate)
+                          for sensor in self.sensors.values()])
+        self.frameRate = frameRate
+        self.setReadRate( readRate)
+        return answered
+
+    #  Add the device at 'address' as 'sensor_id'.  Returns the
+    #  new 'TFMPlusI2C' object, which can still be used to send
+    #  commands.
+    def add( self, sensor_id, address = TFMP_DEFAULT_ADDRESS):
+        ''' Add a device on the bus to the group'''
+        sensor = TFMPlusI2C( self.bus, address, self.format)
+        self.addDevice( sensor_id, sensor)
+        return sensor
+
+    #  Add a 'TFMPlusI2C' object on the group's bus.
+    def addDevice( self, sensor_id, sensor):
+        ''' Add a device to the group'''
+        if( sensor_id in self.sensors):
+            raise ValueError( f"sensor_id {sensor_id!r} is already in the group")
+        if( sensor.address in [ s.address for s in self.sensors.values()]):
+            raise ValueError( f"address {sensor.address:#04x} is already in the group")
+        self.sensors[ sensor_id] = sensor
+
+    #  Remove a device from the group.
+    def remove( self, sensor_id):
+        ''' Remove a device from the group'''
+        self.missing.pop( sensor_id, None)
+        return self.sensors.pop( sensor_id)
+
+    #  - - - - - - - - -  Polling  - - - - - - - - - - - - - - - -
+    #  Build the transactions of a cycle for the devices that are
+    #  not missing, as few as the message limit allows.  They are
+    #  built again when a device is added, removed, missing or
+    #  back, or its address or format changes.
+    def build( self, layout):
+        self.layout = layout
+        self.runs = []
+        size = TFMP_I2C_MESSAGES // 2
+        for i in range( 0, len( layout), size):
+            sensors = [ self.sensors[ sensor_id] for sensor_id, address, command in layout[ i: i + size]]
+            #  Every device is sent its command before any is read,
+            #  so each has the longest time to answer.
+            messages = [ ( s.address, 0, s.command) for s in sensors]
+            messages += [ ( s.address, I2C_M_RD, s.buffer) for s in sensors]
+            self.runs.append( self.bus.batch( messages))
+
+    #  Run one transaction with one device.  Returns False if it
+    #  did not answer.
+    def readOne( self, sensor_id, sensor, now):
+        try:
+            self.bus.transfer( ( ( sensor.address, 0, sensor.command),
+                                 ( sensor.address, I2C_M_RD, sensor.buffer)))
+        except OSError:
+            sensor.status = TFMP_I2CNACK
+            sensor.statusCounts[ TFMP_I2CNACK] += 1
+            self.missing[ sensor_id] = now + TFMP_I2C_RETRY
+            return False
+        self.missing.pop( sensor_id, None)
+        return True
+
+    #  Read every device once.  Returns a list of records.
+    def cycle( self):
+        ''' Run one polling cycle now'''
+        now = time.monotonic()
+        sensors, missing = self.sensors, self.missing
+        layout = tuple( [ ( sensor_id, s.address, s.command)
+                          for sensor_id, s in sensors.items() if sensor_id not in missing])
+        if( layout != self.layout):
+            self.build( layout)
+        read = [ entry[ 0] for entry in layout]
+        try:
+            for run in self.runs:
+                run()
+        except OSError:
+            #  One device did not answer, so find which, one by one.
+            self.failures += 1
+            read = [ sensor_id for sensor_id in read
+                     if self.readOne( sensor_id, sensors[ sensor_id], now)]
+        #  Devices that failed before are tried on their own.
+        for sensor_id, retry in list( missing.items()):
+            if( now >= retry and self.readOne( sensor_id, sensors[ sensor_id], now)):
+                read.append( sensor_id)
+        stamp = time.monotonic()
+        self.cycles += 1
+        records = []
+        for sensor_id in read:
+            sensor = sensors[ sensor_id]
+            if( sensor.takeFrame( sensor.buffer)):
+                records.append( ( sensor_id, stamp, sensor.dist, sensor.flux, sensor.temp))
+        return records
+
+    #  Wait for the next cycle and run it.  Returns a list of
+    #  records, which is empty if the next cycle is more than
+    #  'timeout' seconds away.  Cycles are 'period' apart, and a
+    #  cycle a period or more late is counted in 'lateCycles' and
+    #  the schedule starts again from it.
+    def poll( self, timeout = None):
+        ''' Read every device at the read rate'''
+        now = time.monotonic()
+        if( self.next is None):
+            self.next = now
+        wait = self.next - now
+        if( timeout is not None and wait > timeout):
+            time.sleep( timeout)
+            return []
+        if( wait > 0):
+            time.sleep( wait)
+        elif( wait <= -self.period):
+            self.lateCycles += 1
+            self.next = now
+        self.next += self.period
+        return self.cycle()
+
+    #  Yield records forever, or until a cycle reads nothing in
+    #  'timeout' seconds.
+    def records( self, timeout = None):
+        ''' Time ordered stream of records'''
+        while True:
+            batch = self.poll( timeout)
+            if( not batch and timeout is not None):
+                return
+            yield from batch
+
+    #  Empty the group, and close the bus if the group opened it.
+    def close( self):
+        ''' Close the group'''
+        self.sensors.clear()
+        self.missing.clear()
+        self.runs = []
+        self.layout = None
+        if( self.owned):
+            self.bus.close()
+
+    def __enter__( self):
+        return self
+
+    def __exit__( self, *exc):
+        self.close()
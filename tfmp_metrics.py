@@ -0,0 +1,119 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package:   tfmp_metrics
+ # Described: Prometheus text endpoint for TFMini-Plus metrics
+ #
+ # 'MetricsServer' serves the 'metrics()' snapshot of any number
+ # of 'TFMPlus' objects over HTTP, in the Prometheus text format,
+ # from a thread of its own.  Each device is labelled with its
+ # name.  Nothing is done on the decode path: the counters are
+ # only read when the endpoint is scraped.
+ #
+ # Example:
+ #   server = MetricsServer( { 'front': front, 'rear': rear})
+ #   ...  curl http://127.0.0.1:9464/metrics
+ #   server.close()
+ # A 'SensorGroup' can be served with 'MetricsServer( group.sensors)'.
+ # The server listens on the local host only, unless 'host' is
+ # given.  'formatMetrics()' returns the same text without a server.
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+TFMP_METRICS_PORT = 9464      # the usual port of an exporter
+
+#  Name, type and help text of each counter in 'metrics()'
+counterInfo = (
+    ( 'frames', 'tfmplus_frames_total', 'Data frames decoded'),
+    ( 'checksum_errors', 'tfmplus_checksum_errors_total', 'Frames that failed the checksum test'),
+    ( 'header_misses', 'tfmplus_header_misses_total', 'Times frame sync was lost'),
+    ( 'bytes_discarded', 'tfmplus_bytes_discarded_total', 'Bytes not part of any good frame'),
+    ( 'frames_dropped', 'tfmplus_frames_dropped_total', 'Frames lost, from gaps in frame times'),
+    ( 'reconnects', 'tfmplus_reconnects_total', 'Outages the link was restored after'),
+    ( 'weak', 'tfmplus_weak_frames_total', 'Frames with signal strength too low'),
+    ( 'strong', 'tfmplus_strong_frames_total', 'Frames with signal strength saturated'),
+    ( 'flood', 'tfmplus_flood_frames_total', 'Frames with ambient light saturated'))
+
+#  Name and help text of each frame timing estimate
+gaugeInfo = (
+    ( 'period', 'tfmplus_frame_period_seconds', 'Estimated device frame period'),
+    ( 'drift_ppm', 'tfmplus_clock_drift_ppm', 'Device frame period error in parts per million'),
+    ( 'jitter', 'tfmplus_frame_jitter_seconds', 'RMS time of reads about the frame clock'))
+
+histogramInfo = (
+    ( 'frame_gap', 'tfmplus_frame_gap_seconds', 'Time between data frames'),
+    ( 'command_latency', 'tfmplus_command_latency_seconds', 'Command to reply time'),
+    ( 'trigger_latency', 'tfmplus_trigger_latency_seconds', 'Trigger to data frame time'),
+    ( 'reconnect_time', 'tfmplus_reconnect_seconds', 'Last frame before an outage to first frame after'))
+
+#  Return the Prometheus text of the metrics of every device in
+#  'devices', a dictionary of 'TFMPlus' objects by name.
+def formatMetrics( devices):
+    ''' Prometheus text of device metrics'''
+    snapshots = [ ( str( name).replace( '\\', '\\\\').replace( '"', '\\"'), device.metrics())
+                  for name, device in list( devices.items())]
+    lines = []
+    for key, metric, text in counterInfo:
+        lines.append( f"# HELP {metric} {text}")
+        lines.append( f"# TYPE {metric} counter")
+        for name, snapshot in snapshots:
+            lines.append( f'{metric}{{sensor="{name}"}} {snapshot[ key]}')
+    for key, metric, text in gaugeInfo:
+        lines.append( f"# HELP {metric} {text}")
+        lines.append( f"# TYPE {metric} gauge")
+        for name, snapshot in snapshots:
+            lines.append( f'{metric}{{sensor="{name}"}} {snapshot[ "timing"][ key]:.9g}')
+    for key, metric, text in histogramInfo:
+        lines.append( f"# HELP {metric} {text}")
+        lines.append( f"# TYPE {metric} histogram")
+        for name, snapshot in snapshots:
+            histogram = snapshot[ key]
+            for limit, count in histogram[ 'buckets']:
+                lines.append( f'{metric}_bucket{{sensor="{name}",le="{limit:g}"}} {count}')
+            lines.append( f'{metric}_bucket{{sensor="{name}",le="+Inf"}} {histogram[ "count"]}')
+            lines.append( f'{metric}_sum{{sensor="{name}"}} {histogram[ "sum"]:.9g}')
+            lines.append( f'{metric}_count{{sensor="{name}"}} {histogram[ "count"]}')
+    return '\n'.join( lines) + '\n'
+
+class MetricsHandler( BaseHTTPRequestHandler):
+    def do_GET( self):
+        if( self.path.split( '?')[ 0] not in ( '/', '/metrics')):
+            self.send_error( 404)
+            return
+        body = formatMetrics( self.server.devices).encode()
+        self.send_response( 200)
+        self.send_header( 'Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header( 'Content-Length', str( len( body)))
+        self.end_headers()
+        self.wfile.write( body)
+
+    #  Scrapes are not logged to stderr.
+    def log_message( self, *args):
+        pass
+
+class MetricsServer:
+    ''' HTTP endpoint of device metrics'''
+
+    #  Serve 'devices', a dictionary of 'TFMPlus' objects by name,
+    #  which may change while the server runs.  'port' 0 picks a
+    #  free port, found afterwards in 'port'.
+    def __init__( self, devices, port = TFMP_METRICS_PORT, host = '127.0.0.1'):
+        self.server = ThreadingHTTPServer( ( host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.devices = devices
+        self.port = self.server.server_address[ 1]
+        self.thread = threading.Thread( target = self.server.serve_forever,
+                                        name = 'tfmplus-metrics', daemon = True)
+        self.thread.start()
+
+    def close( self):
+        ''' Stop the server'''
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__( self):
+        return self
+
+    def __exit__( self, *exc):
+        self.close()
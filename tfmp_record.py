@@ -0,0 +1,279 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package:   tfmp_record
+ # Described: Record and replay raw TFMini-Plus serial data
+ #
+ # 'Recorder' saves exactly the bytes received from the device,
+ # with the host monotonic time of each read, to a binary file.
+ # The file has a 64 byte header, the records, and an index:
+ #
+ #   Header:  magic 'TFMPREC1', format version, record header
+ #            size, baud rate, frame rate, record count, the
+ #            time of the first and last records, and where in
+ #            the file the index starts.
+ #   Record:  time (8 byte float) and byte count (4 bytes) of
+ #            one read, then the bytes read.
+ #   Index:   the time, then the file offset, of the first
+ #            record of every block of 'TFMP_RECORD_BLOCK' bytes,
+ #            in two columns.
+ #
+ # Each read is one record, so the byte stream is kept exactly
+ # as it arrived, corrupted frames and all, for 12 bytes of
+ # header a read.  Records are collected in memory and written
+ # about 'TFMP_RECORD_FLUSH' bytes at a time.  The index is kept
+ # in memory, 16 bytes a block, and written when the recording
+ # is closed.
+ #
+ # 'ReplayStream' memory maps a recording and serves it through
+ # the same calls as a serial port, so a 'TFMPlus' object can
+ # decode it as if it were live:
+ #   sensor = tfmplus.TFMPlus()
+ #   sensor.pStream = ReplayStream( 'run.tfmp', speed = 10)
+ #   dists, fluxes, temps = sensor.getFrames()
+ # 'speed' is 1 for real time, N for N times faster, or None for
+ # as fast as possible.  'seek( stamp)' jumps to any time using
+ # a binary search of the index and a walk through one block,
+ # so multi-gigabyte recordings are never loaded into memory.
+ # A recording that was not closed has no index; it is rebuilt
+ # by walking every record when the file is opened.
+ #
+ # To record a device:
+ #   sensor.record( 'run.tfmp')  ...  sensor.stopRecord()
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import os
+import mmap
+import time
+import struct
+from bisect import bisect_right
+from array import array
+
+TFMP_RECORD_MAGIC = b'TFMPREC1'
+TFMP_RECORD_VERSION = 2
+TFMP_RECORD_FLUSH = 65536     # bytes collected before a write
+TFMP_RECORD_BLOCK = 4096      # bytes of records to an index entry
+TFMP_REPLAY_READ = 65536      # most bytes offered by one read
+
+headerData = struct.Struct( '<8sHHIIQddQ')     # see description
+HEADER_SIZE = 64
+recordData = struct.Struct( '<dI')             # time and byte count of a read
+RECORD_SIZE = recordData.size                  # 12 bytes, then the data
+
+class Recorder:
+    ''' Raw serial data recorder'''
+
+    def __init__( self, path, baud = 0, frameRate = 0):
+        self.file = open( path, 'wb')
+        self.baud = baud
+        self.frameRate = frameRate
+        self.count = 0                 # records written
+        self.first = 0.0               # time of the first record
+        self.last = 0.0                # time of the last record
+        self.buffer = bytearray()      # records not yet written
+        self.offset = HEADER_SIZE      # file offset of 'buffer'
+        self.block = HEADER_SIZE       # offset where the next block starts
+        self.stamps = array( 'd')      # time of each block's first record
+        self.offsets = array( 'Q')     # file offset of each block
+        self.writeHeader( 0)
+
+    def writeHeader( self, index):
+        header = headerData.pack( TFMP_RECORD_MAGIC, TFMP_RECORD_VERSION, RECORD_SIZE,
+                                  self.baud, self.frameRate, self.count,
+                                  self.first, self.last, index)
+        self.file.write( header.ljust( HEADER_SIZE, b'\0'))
+
+    #  Record 'data' as read at host time 'stamp', or now.
+    def write( self, data, stamp = None):
+        ''' Record one read of serial data'''
+        if( not data):
+            return
+        if( stamp is None):
+            stamp = time.monotonic()
+        if( not self.count):
+            self.first = stamp
+        self.last = stamp
+        buffer = self.buffer
+        position = self.offset + len( buffer)
+        if( position >= self.block):
+            self.stamps.append( stamp)
+            self.offsets.append( position)
+            self.block = position + TFMP_RECORD_BLOCK
+        buffer += recordData.pack( stamp, len( data))
+        buffer += data
+        self.count += 1
+        if( len( buffer) >= TFMP_RECORD_FLUSH):
+            self.flush()
+
+    #  Write collected records to the file.
+    def flush( self):
+        ''' Write buffered records'''
+        self.file.write( self.buffer)
+        self.offset += len( self.buffer)
+        self.buffer.clear()
+
+    #  Write the remaining records and the index, update the
+    #  header and close.
+    def close( self):
+        ''' Finish the recording'''
+        if( self.file.closed):
+            return
+        self.flush()
+        self.file.write( self.stamps)
+        self.file.write( self.offsets)
+        self.file.seek( 0)
+        self.writeHeader( self.offset)
+        self.file.close()
+
+    def __enter__( self):
+        return self
+
+    def __exit__( self, *exc):
+        self.close()
+
+class ReplayStream:
+    ''' Memory mapped recording read as a serial port'''
+
+    def __init__( self, path, speed = 1.0):
+        self.file = open( path, 'rb')
+        self.map = mmap.mmap( self.file.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, version, size, self.baud, self.frameRate, count, first, last, index = \
+            headerData.unpack_from( self.map)
+        if( magic != TFMP_RECORD_MAGIC or version != TFMP_RECORD_VERSION or size != RECORD_SIZE):
+            raise ValueError( f"{path} is not a tfmplus recording of version {TFMP_RECORD_VERSION}")
+        if( index):
+            self.end = index             # records end where the index starts
+            blocks = ( len( self.map) - index) // 16
+            self.stamps = array( 'd', self.map[ index: index + blocks * 8])
+            self.offsets = array( 'Q', self.map[ index + blocks * 8: index + blocks * 16])
+            self.count = count
+        else:
+            self.scan()
+        self.speed = speed
+        self.timeout = None          # as for a serial port
+        self.position = HEADER_SIZE  # file offset of the next record
+        self.offset = 0              # bytes of it already read
+        self.restart()
+
+    #  Build the index of a recording that was not closed, and
+    #  count its records.  A record cut short is left out.
+    def scan( self):
+        self.stamps, self.offsets = array( 'd'), array( 'Q')
+        unpack, size = recordData.unpack_from, len( self.map)
+        position = block = HEADER_SIZE
+        count = 0
+        while( position + RECORD_SIZE <= size):
+            stamp, length = unpack( self.map, position)
+            if( position + RECORD_SIZE + length > size):
+                break
+            if( position >= block):
+                self.stamps.append( stamp)
+                self.offsets.append( position)
+                block = position + TFMP_RECORD_BLOCK
+            position += RECORD_SIZE + length
+            count += 1
+        self.end = position
+        self.count = count
+
+    #  Replay time starts again from the next record.
+    def restart( self):
+        self.startHost = time.monotonic()
+        self.startStamp = self.stamp( self.position) if self.position < self.end else 0.0
+
+    #  Return the time of the record at file offset 'position'.
+    def stamp( self, position):
+        ''' Time of one record'''
+        return recordData.unpack_from( self.map, position)[ 0]
+
+    #  Return ( stamp, data) of the record at 'position'.
+    def record( self, position):
+        ''' Read one record'''
+        stamp, length = recordData.unpack_from( self.map, position)
+        start = position + RECORD_SIZE
+        return stamp, self.map[ start: start + length]
+
+    #  Return the offset of the first record at or after 'stamp':
+    #  the last block to start before it, then its records.
+    def find( self, stamp):
+        ''' Search for a time'''
+        block = max( bisect_right( self.stamps, stamp) - 1, 0)
+        position = self.offsets[ block] if self.offsets else self.end
+        unpack = recordData.unpack_from
+        while( position < self.end):
+            first, length = unpack( self.map, position)
+            if( first >= stamp):
+                break
+            position += RECORD_SIZE + length
+        return position
+
+    #  Jump to the first record at or after 'stamp'.
+    def seek( self, stamp):
+        ''' Jump to a time in the recording'''
+        self.position = self.find( stamp)
+        self.offset = 0
+        self.restart()
+
+    #  Return the replay time now, in recorded time.
+    def now( self):
+        return self.startStamp + ( time.monotonic() - self.startHost) * self.speed
+
+    #  Return the offset of the first record not yet due, looking
+    #  no further than 'limit' bytes of data.  Also returns the
+    #  number of data bytes due.
+    def due( self, limit = TFMP_REPLAY_READ):
+        now = None if self.speed is None else self.now() + 1e-9
+        unpack = recordData.unpack_from
+        position, waiting = self.position, -self.offset
+        while( position < self.end and waiting < limit):
+            stamp, length = unpack( self.map, position)
+            if( now is not None and stamp > now):
+                break
+            position += RECORD_SIZE + length
+            waiting += length
+        return position, max( waiting, 0)
+
+    #  - - - - - - - - -  Serial port calls  - - - - - - - - - - -
+    def inWaiting( self):
+        return self.due()[ 1]
+
+    in_waiting = property( inWaiting)
+
+    #  Read up to 'size' bytes.  As a serial port does, waits for
+    #  more records to come due until 'timeout' passes, if set.
+    def read( self, size = 1):
+        out = bytearray()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        unpack = recordData.unpack_from
+        while( len( out) < size and self.position < self.end):
+            stamp, length = unpack( self.map, self.position)
+            if( self.speed is not None):
+                wait = ( stamp - self.startStamp) / self.speed - ( time.monotonic() - self.startHost)
+                if( wait > 0):
+                    #  Sleep until the next record is due.
+                    if( deadline is not None):
+                        wait = min( wait, deadline - time.monotonic())
+                        if( wait <= 0):
+                            break
+                    time.sleep( wait)
+                    continue
+            start = self.position + RECORD_SIZE + self.offset
+            piece = min( length - self.offset, size - len( out))
+            out += self.map[ start: start + piece]
+            self.offset += piece
+            if( self.offset >= length):
+                self.position += RECORD_SIZE + length
+                self.offset = 0
+        return bytes( out)
+
+    #  Commands sent to a recording are ignored.
+    def write( self, data):
+        return len( data)
+
+    def reset_input_buffer( self):
+        self.position = self.due( len( self.map))[ 0]
+        self.offset = 0
+
+    def reset_output_buffer( self):
+        pass
+
+    def close( self):
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,255 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package:   tfmp_shared
+ # Described: Share one TFMini-Plus device with many processes
+ #
+ # Only one process can open the serial port.  That process
+ # publishes every decoded frame into a ring buffer in shared
+ # memory, and any number of other processes attach to it by
+ # name and read the frames directly from memory.
+ #
+ #   Publisher process:
+ #     sensor = tfmplus.TFMPlus()
+ #     sensor.begin( '/dev/serial0', 115200)
+ #     sensor.publish( 'lidar')
+ #     while True:  sensor.getData()    # or 'startStream()'
+ #
+ #   Any other process:
+ #     lidar = Subscriber( 'lidar')
+ #     frame = lidar.latest()
+ #     for frame in lidar.read():   # every frame since the last read
+ #         ...
+ #
+ # Frames are the same tuples as in streaming mode:
+ #   ( seq, stamp, dist, flux, temp, status)
+ # 'stamp' is the host monotonic time of the frame, from the
+ # publisher's 'FrameClock', which is the same clock in every
+ # process.
+ #
+ # There is one writer and no lock.  Each slot of the ring holds
+ # the sequence number of its frame.  The writer marks the slot
+ # empty, then writes the frame, then writes its number.  A
+ # reader copies the slot, number and all, then reads the number
+ # again, so a frame overwritten while it was read is never
+ # returned: it is counted in 'overruns' instead.  Reading a
+ # frame makes no system call.
+ #
+ # Memory layout:
+ #   Header: magic 'TFMPSHM1', version, slot count, and the
+ #           sequence number of the next frame, 64 bytes.
+ #   Slot:   sequence number, stamp, dist, flux, temp and
+ #           status, 24 bytes, laid out as the frame tuple.
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import os
+import time
+import struct
+import inspect
+from multiprocessing import shared_memory, resource_tracker
+
+from tfmplus import frameStatus, TFMP_RING_SIZE
+
+TFMP_SHARED_MAGIC = b'TFMPSHM1'
+TFMP_SHARED_VERSION = 1
+TFMP_SHARED_POLL = 0.001      # seconds between looks in 'wait_next()'
+TFMP_SHARED_EMPTY = 0xFFFFFFFFFFFFFFFF   # slot sequence number while written
+#  Python 3.13 and later can attach without the resource tracker.
+TFMP_SHARED_TRACK = 'track' in inspect.signature( shared_memory.SharedMemory).parameters
+
+headerData = struct.Struct( '<8sIIQ')     # see description
+HEADER_SIZE = 64
+nextData = struct.Struct( '<Q')           # header sequence number
+NEXT_OFFSET = 16
+slotData = struct.Struct( '<QdhhhBx')     # see description
+SLOT_SIZE = slotData.size                 # 24 bytes
+seqData = struct.Struct( '<Q')            # slot sequence number
+frameData = struct.Struct( '<dhhhBx')     # slot after its sequence number
+FRAME_OFFSET = seqData.size
+
+#  Register or unregister 'memory' with the resource tracker.
+#  Only POSIX shared memory is tracked, by its name with a slash.
+def track( memory, register):
+    if( os.name == 'posix'):
+        ( resource_tracker.register if register else
+          resource_tracker.unregister)( '/' + memory.name, 'shared_memory')
+
+class Publisher:
+    ''' Single writer of a shared memory frame ring'''
+
+    #  Create the ring of 'size' frames.  If 'name' is None a
+    #  unique name is chosen, found afterwards in 'name'.
+    def __init__( self, name = None, size = TFMP_RING_SIZE):
+        self.memory = shared_memory.SharedMemory( name, create = True,
+                                                  size = HEADER_SIZE + size * SLOT_SIZE)
+        self.name = self.memory.name
+        self.buffer = self.memory.buf
+        self.size = size
+        self.seq = 0          # sequence number of the next frame
+        headerData.pack_into( self.buffer, 0, TFMP_SHARED_MAGIC, TFMP_SHARED_VERSION, size, 0)
+
+    #  Write the frames of one read, from position 'start' of the
+    #  'dists', 'fluxes' and 'temps' arrays.  The last frame has
+    #  time 'stamp' and those before it are 'period' apart.
+    def write( self, stamp, dists, fluxes, temps, start = 0, period = 0.0):
+        ''' Publish the frames of one read'''
+        buffer, size, seq = self.buffer, self.size, self.seq
+        pack, mark = frameData.pack_into, seqData.pack_into
+        first = stamp - ( len( dists) - 1) * period
+        for i in range( start, len( dists)):
+            d, f = dists[ i], fluxes[ i]
+            offset = HEADER_SIZE + ( seq % size) * SLOT_SIZE
+            #  The slot is marked empty while it is written.
+            mark( buffer, offset, TFMP_SHARED_EMPTY)
+            pack( buffer, offset + FRAME_OFFSET, first + i * period,
+                  d, f, temps[ i], frameStatus( d, f))
+            mark( buffer, offset, seq)
+            seq += 1
+        self.seq = seq
+        nextData.pack_into( buffer, NEXT_OFFSET, seq)
+
+    #  Write one frame.
+    def push( self, stamp, d, f, t):
+        ''' Publish one frame'''
+        self.write( stamp, ( d,), ( f,), ( t,))
+
+    #  Remove the ring.  Subscribers that are still attached
+    #  keep their mapping until they close.
+    def close( self):
+        ''' Remove the shared memory'''
+        if( self.buffer is None):
+            return
+        self.buffer = None
+        self.memory.close()
+        #  A subscriber forked from this process shares its resource
+        #  tracker, and may have unregistered the ring, which
+        #  'unlink()' unregisters again.
+        if( not TFMP_SHARED_TRACK):
+            track( self.memory, True)
+        self.memory.unlink()
+
+    def __enter__( self):
+        return self
+
+    def __exit__( self, *exc):
+        self.close()
+
+class Subscriber:
+    ''' Reader of a shared memory frame ring'''
+
+    #  Attach to the ring published as 'name'.
+    def __init__( self, name):
+        #  The ring belongs to the publisher.  If it were tracked,
+        #  the resource tracker would remove it when this process ends.
+        if( TFMP_SHARED_TRACK):
+            self.memory = shared_memory.SharedMemory( name, track = False)
+        else:
+            self.memory = shared_memory.SharedMemory( name)
+            track( self.memory, False)
+        self.buffer = self.memory.buf
+        magic, version, self.size, seq = headerData.unpack_from( self.buffer)
+        if( magic != TFMP_SHARED_MAGIC or version != TFMP_SHARED_VERSION):
+            self.close()
+            raise ValueError( f"{name} is not a tfmplus frame ring")
+        self.next = seq       # first frame for 'read()'
+        self.overruns = 0     # frames overwritten before they were read
+
+    #  Return the sequence number of the next frame to be written.
+    def seq( self):
+        ''' Frames published so far'''
+        return nextData.unpack_from( self.buffer, NEXT_OFFSET)[ 0]
+
+    #  Return frame 'seq', or None if it was overwritten, is
+    #  being written or has not been written yet.  The slot is
+    #  copied, then its sequence number is read again.
+    def get( self, seq):
+        ''' Read one frame'''
+        buffer = self.buffer
+        offset = HEADER_SIZE + ( seq % self.size) * SLOT_SIZE
+        frame = slotData.unpack_from( buffer, offset)
+        if( frame[ 0] != seq or seqData.unpack_from( buffer, offset)[ 0] != seq):
+            return None
+        return frame
+
+    #  Return the most recent frame, or None if there is none.
+    def latest( self):
+        ''' Read the most recent frame'''
+        seq = self.seq()
+        while( seq):
+            frame = self.get( seq - 1)
+            if( frame is not None):
+                return frame
+            seq = self.seq()    #  overwritten while read, so try again
+        return None
+
+    #  Return a list of every frame from sequence number 'seq' on,
+    #  up to but not including 'last', by default every frame
+    #  written so far.  Frames that were overwritten are counted
+    #  in 'overruns'.
+    def since( self, seq, last = None):
+        ''' Read all frames from sequence number seq'''
+        if( last is None):
+            last = self.seq()
+        first = max( last - self.size, 0)
+        if( seq < first):
+            self.overruns += first - seq
+            seq = first
+        frames = []
+        append = frames.append
+        while( seq < last):
+            #  Copy every slot up to the end of the ring at once,
+            #  then read their sequence numbers again.
+            index = seq % self.size
+            count = min( last - seq, self.size - index)
+            start = HEADER_SIZE + index * SLOT_SIZE
+            with self.buffer[ start: start + count * SLOT_SIZE] as view:
+                slots = list( slotData.iter_unpack( view))
+                with view.cast( 'Q') as words:
+                    marks = words[ ::SLOT_SIZE // 8].tolist()
+            expected = list( range( seq, seq + count))
+            if( marks == expected and [ slot[ 0] for slot in slots] == expected):
+                frames.extend( slots)
+            else:
+                for n, slot, mark in zip( expected, slots, marks):
+                    if( slot[ 0] == n and mark == n):
+                        append( slot)
+                    else:
+                        self.overruns += 1
+            seq += count
+        return frames
+
+    #  Return every frame since the last call, or since attaching.
+    #  The next call starts where this one ended, even if every
+    #  frame was overwritten while it read, so none is counted in
+    #  'overruns' twice.
+    def read( self):
+        ''' Read all new frames'''
+        last = self.seq()
+        frames = self.since( self.next, last)
+        self.next = last
+        return frames
+
+    #  Wait for frame 'seq', or the next frame, and return it.
+    #  Returns None after 'timeout' seconds.  The ring is looked
+    #  at every 'poll' seconds while waiting.
+    def wait_next( self, timeout = None, seq = None, poll = TFMP_SHARED_POLL):
+        ''' Wait for the next frame'''
+        if( seq is None):
+            seq = self.seq()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while( self.seq() <= seq):
+            if( deadline is not None and time.monotonic() > deadline):
+                return None
+            time.sleep( poll)
+        return self.get( seq)
+
+    def close( self):
+        ''' Detach from the ring'''
+        if( self.buffer is None):
+            return
+        self.buffer = None
+        self.memory.close()
+
+    def __enter__( self):
+        return self
+
+    def __exit__( self, *exc):
+        self.close()
@@ -0,0 +1,432 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package:   tfmp_store
+ # Described: Long-term store of decoded TFMini-Plus frames
+ #
+ # A 'FrameStore' keeps every decoded frame for as long as a
+ # device runs, in columns: the time of each frame as an 8 byte
+ # float and 'dist', 'flux' and 'temp' as 2 byte integers, 14
+ # bytes a frame in all.  Columns are kept in chunks of
+ # 'TFMP_STORE_CHUNK' frames.  With a 'path', each whole chunk is
+ # written to the file and dropped from memory, so only the
+ # chunk being filled is held.  Without one, every chunk stays
+ # in memory.
+ #
+ # As frames arrive the store also keeps the minimum, maximum,
+ # sum and count of the good distances, those whose frame status
+ # is READY, in buckets of 1 second, 10 seconds and 1 minute, and
+ # above those in buckets that double in width until one bucket
+ # holds everything.  Each bucket is a few numbers in arrays, so
+ # the index costs about 30 bytes a second at each level.
+ #
+ # 'summary( start, end)' takes the fewest buckets that cover
+ # the time range, at most a few at each level, found by binary
+ # search, and looks at single frames only in the part seconds
+ # at each end and in the second being filled.  So the minimum
+ # over the last 5 minutes, or the mean of a whole shift, costs
+ # about the same as that of one minute.  'series()' returns the
+ # buckets of a level for plotting, and 'frames()' the frames
+ # themselves.
+ #
+ # Times are host monotonic times, as from the 'FrameClock'.
+ #
+ # Example:
+ #   store = sensor.store( 'shift.tfms')    # every frame decoded
+ #   ...
+ #   nearest = store.recent( 300).min       # last 5 minutes
+ #   times, mins, maxs, means = store.series( width = 60)
+ # 'FrameStore.load( path)' opens a store file again, to read it
+ # or to add to it.
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import os
+import math
+import time
+import bisect
+import struct
+import threading
+import collections
+from array import array
+
+from tfmplus import frameStatus, TFMP_READY
+
+TFMP_STORE_MAGIC = b'TFMPSTO1'
+TFMP_STORE_VERSION = 1
+TFMP_STORE_CHUNK = 65536      # frames in a chunk, 896KB of columns
+TFMP_STORE_WIDTHS = ( 1, 10, 60)   # seconds in a bucket of the first levels
+
+headerData = struct.Struct( '<8sHHI')      # magic, version, 0, chunk size
+HEADER_SIZE = 64
+chunkData = struct.Struct( '<IIdd')        # frame count, 0, first and last time
+CHUNK_HEADER = 32
+FRAME_BYTES = 14                           # stamp, dist, flux, temp
+
+#  The good distances of a time range, see 'summary()'
+Summary = collections.namedtuple( 'Summary', 'min max mean count')
+
+class Chunk:
+    ''' Columns of up to one chunk of frames'''
+    __slots__ = ( 'first', 'last', 'count', 'offset', 'columns')
+
+    def __init__( self, columns = None, offset = -1):
+        self.first = self.last = 0.0   # times of the first and last frames
+        self.count = 0                 # frames in the chunk
+        self.offset = offset           # file position, or -1 if in memory only
+        self.columns = columns         # ( stamps, dists, fluxes, temps), or None if on disk
+
+class Level:
+    ''' Buckets of one width'''
+    __slots__ = ( 'width', 'keys', 'mins', 'maxs', 'sums', 'counts')
+
+    def __init__( self, width):
+        self.width = width             # seconds in a bucket
+        self.keys = array( 'q')        # bucket number, its start time / width
+        self.mins = array( 'h')
+        self.maxs = array( 'h')
+        self.sums = array( 'q')
+        self.counts = array( 'Q')
+
+    #  Add good distances 'low' to 'high', totalling 'total', to
+    #  the bucket holding second 'second'.
+    def add( self, second, low, high, total, count):
+        key = second // self.width
+        keys = self.keys
+        if( keys and keys[ -1] == key):
+            if( low < self.mins[ -1]): self.mins[ -1] = low
+            if( high > self.maxs[ -1]): self.maxs[ -1] = high
+            self.sums[ -1] += total
+            self.counts[ -1] += count
+        else:
+            keys.append( key)
+            self.mins.append( low)
+            self.maxs.append( high)
+            self.sums.append( total)
+            self.counts.append( count)
+
+    #  Return the position of the buckets from number 'a' up to,
+    #  not including, number 'b'.
+    def find( self, a, b):
+        keys = self.keys
+        i = bisect.bisect_left( keys, a)
+        return i, bisect.bisect_left( keys, b, i)
+
+class FrameStore:
+    ''' Column store of frames with a min/max/mean index'''
+
+    #  Keep frames in memory, or write them to a new file at
+    #  'path'.  'chunk' is the number of frames in a chunk.
+    def __init__( self, path = None, chunk = TFMP_STORE_CHUNK):
+        self.path = path
+        self.chunkSize = chunk
+        self.lock = threading.Lock()   # one writer and any number of readers
+        self.chunks = []               # chunks, full ones first and the one filled last
+        self.firsts = []               # time of the first frame of each chunk
+        self.levels = [ Level( width) for width in TFMP_STORE_WIDTHS]
+        self.open = None               # ( second, min, max, sum, count) not yet in the levels
+        self.count = 0                 # frames stored
+        self.last = -math.inf          # time of the last frame
+        self.cached = None             # ( chunk, columns) read back last
+        self.file = None
+        if( path is not None):
+            self.file = open( path, 'w+b')
+            self.file.write( headerData.pack( TFMP_STORE_MAGIC, TFMP_STORE_VERSION, 0,
+                                              chunk).ljust( HEADER_SIZE, b'\0'))
+        self.newChunk()
+
+    #  Open the store file at 'path' and rebuild its index.
+    #  Frames added to it are written after those in the file.
+    @classmethod
+    def load( cls, path):
+        ''' Open a store file'''
+        file = open( path, 'r+b')
+        magic, version, unused, chunk = headerData.unpack( file.read( HEADER_SIZE)[ :headerData.size])
+        if( magic != TFMP_STORE_MAGIC or version != TFMP_STORE_VERSION):
+            file.close()
+            raise ValueError( f"{path} is not a tfmplus frame store")
+        store = cls( None, chunk)
+        store.path, store.file = path, file
+        store.chunks.clear()
+        store.firsts.clear()
+        offset, end = HEADER_SIZE, os.fstat( file.fileno()).st_size
+        #  A chunk cut short by a crash is left out, and written over.
+        while( offset + CHUNK_HEADER <= end):
+            count, unused, first, last = chunkData.unpack_from( os.pread( file.fileno(), CHUNK_HEADER, offset))
+            if( offset + CHUNK_HEADER + count * FRAME_BYTES > end):
+                break
+            part = Chunk( None, offset)
+            part.count, part.first, part.last = count, first, last
+            stamps, dists, fluxes, temps = store.columns( part)
+            store.index( stamps, dists, fluxes, 0)
+            store.chunks.append( part)
+            store.firsts.append( first)
+            store.count += count
+            store.last = last
+            offset += CHUNK_HEADER + count * FRAME_BYTES
+        file.truncate( offset)
+        file.seek( offset)
+        store.newChunk()
+        return store
+
+    def __len__( self):
+        return self.count
+
+    def __enter__( self):
+        return self
+
+    def __exit__( self, *exc):
+        self.close()
+
+    #  - - - - - - - - -  Adding frames  - - - - - - - - - - - - -
+    #  Start a chunk to fill.
+    def newChunk( self):
+        self.chunks.append( Chunk( ( array( 'd'), array( 'h'), array( 'h'), array( 'h'))))
+        self.firsts.append( math.inf)
+
+    #  Write the chunk being filled to the file, if there is one,
+    #  and drop its columns from memory.
+    def seal( self):
+        chunk = self.chunks[ -1]
+        if( self.file is None or not chunk.count):
+            return
+        stamps, dists, fluxes, temps = chunk.columns
+        chunk.offset = self.file.tell()
+        self.file.write( chunkData.pack( chunk.count, 0, chunk.first, chunk.last).ljust( CHUNK_HEADER, b'\0'))
+        for column in chunk.columns:
+            self.file.write( column)
+        self.file.flush()
+        chunk.columns = None
+
+    #  Store the frames of one read, from position 'start' of the
+    #  'dists', 'fluxes' and 'temps' arrays.  The last frame has
+    #  time 'stamp' and those before it are 'period' apart.  These
+    #  are the arguments of 'Publisher.write()' in 'tfmp_shared',
+    #  so a 'TFMPlus' object calls both the same way.
+    def write( self, stamp, dists, fluxes, temps, start = 0, period = 0.0):
+        ''' Store the frames of one read'''
+        first = stamp - ( len( dists) - 1) * period
+        stamps = array( 'd', [ first + i * period for i in range( start, len( dists))])
+        self.append( stamps, dists[ start:], fluxes[ start:], temps[ start:])
+
+    #  Store one frame.
+    def push( self, stamp, d, f, t):
+        ''' Store one frame'''
+        self.append( array( 'd', ( stamp,)), ( d,), ( f,), ( t,))
+
+    #  Store frames with the times in 'stamps'.  A time earlier
+    #  than the frame before it is taken as that time, so times
+    #  never go back.
+    def append( self, stamps, dists, fluxes, temps):
+        ''' Store frames'''
+        if( not len( stamps)):
+            return
+        if( stamps[ 0] < self.last):
+            stamps = array( 'd', [ max( s, self.last) for s in stamps])
+        with self.lock:
+            chunk = self.chunks[ -1]
+            columns = chunk.columns
+            start = len( columns[ 0])
+            columns[ 0].extend( stamps)
+            columns[ 1].extend( dists)
+            columns[ 2].extend( fluxes)
+            columns[ 3].extend( temps)
+            if( not chunk.count):
+                chunk.first = self.firsts[ -1] = stamps[ 0]
+            chunk.count += len( stamps)
+            chunk.last = self.last = stamps[ -1]
+            self.count += len( stamps)
+            self.index( columns[ 0], columns[ 1], columns[ 2], start)
+            if( chunk.count >= self.chunkSize):
+                self.seal()
+                self.newChunk()
+
+    #  Add the good distances of frames from position 'start' of
+    #  the columns to the index, a second at a time.  The second
+    #  being filled is kept in 'open', and added to every level
+    #  once a frame of a later second arrives.
+    def index( self, stamps, dists, fluxes, start):
+        i, n = start, len( stamps)
+        while( i < n):
+            second = math.floor( stamps[ i])
+            j = bisect.bisect_left( stamps, second + 1, i, n)
+            values = dists[ i:j]
+            #  Frames are only looked at one by one if some are not READY.
+            if( -1 in values or -4 in values or -1 in fluxes[ i:j]):
+                values = [ d for d, f in zip( values, fluxes[ i:j]) if frameStatus( d, f) == TFMP_READY]
+            i = j
+            if( not values):
+                continue
+            low, high, total, count = min( values), max( values), sum( values), len( values)
+            bucket = self.open
+            if( bucket is not None and bucket[ 0] == second):
+                self.open = ( second, min( low, bucket[ 1]), max( high, bucket[ 2]),
+                              total + bucket[ 3], count + bucket[ 4])
+                continue
+            if( bucket is not None):
+                self.addSecond( bucket)
+            self.open = ( second, low, high, total, count)
+
+    #  Add a whole second to every level.  A level of wider
+    #  buckets is added while the widest level has more than one.
+    def addSecond( self, bucket):
+        levels = self.levels
+        for level in levels:
+            level.add( *bucket)
+        while( len( levels[ -1].keys) > 1):
+            self.addLevel()
+
+    #  Add a level of buckets twice as wide as the widest.
+    def addLevel( self):
+        top = self.levels[ -1]
+        level = Level( top.width * 2)
+        for i in range( len( top.keys)):
+            level.add( top.keys[ i] * top.width, top.mins[ i], top.maxs[ i],
+                       top.sums[ i], top.counts[ i])
+        self.levels.append( level)
+
+    #  - - - - - - - - -  Queries  - - - - - - - - - - - - - - - -
+    #  Return the columns of 'chunk', reading them from the file
+    #  if they are not in memory.  The chunk read last is kept.
+    #  Once the store is closed, the file is opened again to read.
+    def columns( self, chunk):
+        if( chunk.columns is not None):
+            return chunk.columns
+        if( self.cached is not None and self.cached[ 0] is chunk):
+            return self.cached[ 1]
+        count = chunk.count
+        if( self.file is None):
+            with open( self.path, 'rb') as file:
+                data = os.pread( file.fileno(), count * FRAME_BYTES, chunk.offset + CHUNK_HEADER)
+        else:
+            data = os.pread( self.file.fileno(), count * FRAME_BYTES, chunk.offset + CHUNK_HEADER)
+        columns = ( array( 'd'), array( 'h'), array( 'h'), array( 'h'))
+        columns[ 0].frombytes( data[ :8 * count])
+        for n in range( 3):
+            columns[ n + 1].frombytes( data[ ( 8 + 2 * n) * count: ( 10 + 2 * n) * count])
+        self.cached = ( chunk, columns)
+        return columns
+
+    #  Return the frames from time 'start' up to, not including,
+    #  'end' as four arrays: 'stamps', 'dists', 'fluxes', 'temps'.
+    def frames( self, start = -math.inf, end = math.inf):
+        ''' Frames of a time range'''
+        out = ( array( 'd'), array( 'h'), array( 'h'), array( 'h'))
+        with self.lock:
+            chunks = self.chunks
+            k = max( bisect.bisect_right( self.firsts, start) - 1, 0)
+            while( k < len( chunks) and chunks[ k].first < end):
+                chunk = chunks[ k]
+                k += 1
+                if( not chunk.count or chunk.last < start):
+                    continue
+                columns = self.columns( chunk)
+                i = bisect.bisect_left( columns[ 0], start)
+                j = bisect.bisect_left( columns[ 0], end, i)
+                for column, part in zip( out, columns):
+                    column.extend( part[ i:j])
+        return out
+
+    #  Return ( min, max, sum, count) of the good distances of
+    #  the frames from 'start' to 'end'.
+    def scan( self, start, end):
+        stamps, dists, fluxes, temps = self.frames( start, end)
+        if( -1 in dists or -4 in dists or -1 in fluxes):
+            dists = [ d for d, f in zip( dists, fluxes) if frameStatus( d, f) == TFMP_READY]
+        if( not dists):
+            return None
+        return min( dists), max( dists), sum( dists), len( dists)
+
+    #  Return ( min, max, sum, count) of the buckets that cover
+    #  whole seconds 'low' up to 'high', using levels up to 'k'.
+    #  The widest level with a whole bucket in the range gives
+    #  the middle, and narrower levels the two ends.
+    def gather( self, low, high, k):
+        levels = self.levels
+        while( True):
+            width = levels[ k].width
+            a, b = -( -low // width), high // width
+            if( a < b):
+                break
+            k -= 1
+        level = levels[ k]
+        i, j = level.find( a, b)
+        parts = []
+        if( i < j):
+            parts.append( ( min( level.mins[ i:j]), max( level.maxs[ i:j]),
+                            sum( level.sums[ i:j]), sum( level.counts[ i:j])))
+        if( low < a * width):
+            parts.append( self.gather( low, a * width, k - 1))
+        if( b * width < high):
+            parts.append( self.gather( b * width, high, k - 1))
+        return combine( parts)
+
+    #  Return a 'Summary' of the good distances of the frames
+    #  from time 'start' up to, not including, 'end', or None if
+    #  there are none.  Whole seconds come from the index, and
+    #  only the frames of part seconds at either end, and of the
+    #  second being filled, are read.
+    def summary( self, start = None, end = None):
+        ''' Minimum, maximum and mean distance of a time range'''
+        if( not self.count):
+            return None
+        first = self.firsts[ 0]
+        start = first if start is None else max( start, first)
+        end = self.last + 1 if end is None else min( end, self.last + 1)
+        low, high = math.ceil( start), math.floor( end)
+        if( self.open is not None):
+            high = min( high, self.open[ 0])
+        if( low >= high):
+            result = self.scan( start, end)
+        else:
+            with self.lock:
+                middle = self.gather( low, high, len( self.levels) - 1)
+            result = combine( [ self.scan( start, low), middle, self.scan( high, end)])
+        if( result is None):
+            return None
+        low, high, total, count = result
+        return Summary( low, high, total / count, count)
+
+    #  Return a 'Summary' of the last 'seconds' up to now.
+    def recent( self, seconds):
+        ''' Minimum, maximum and mean distance of recent frames'''
+        return self.summary( time.monotonic() - seconds)
+
+    #  Return the buckets of the widest level no wider than
+    #  'width' seconds from 'start' to 'end', as four arrays: the
+    #  start time of each bucket and its minimum, maximum and
+    #  mean distance.  Seconds with no good distance, and the
+    #  second being filled, are left out.
+    def series( self, start = -math.inf, end = math.inf, width = 1):
+        ''' Downsampled distances for plotting'''
+        with self.lock:
+            level = self.levels[ 0]
+            for candidate in self.levels:
+                if( candidate.width <= width):
+                    level = candidate
+            size = level.width
+            a = math.floor( start / size) if start > -math.inf else -2**63
+            b = math.ceil( end / size) if end < math.inf else 2**63 - 1
+            i, j = level.find( a, b)
+            times = array( 'd', [ key * size for key in level.keys[ i:j]])
+            means = array( 'd', [ s / c for s, c in zip( level.sums[ i:j], level.counts[ i:j])])
+            return times, level.mins[ i:j], level.maxs[ i:j], means
+
+    #  Write the chunk being filled and close the file.  The
+    #  store can still be queried: chunks on disk are read by
+    #  opening the file again.  To add frames, open it with 'load()'.
+    def close( self):
+        ''' Finish the store file'''
+        if( self.file is None):
+            return
+        with self.lock:
+            self.seal()
+            self.newChunk()
+            self.cached = None
+            self.file.close()
+            self.file = None
+
+#  Combine ( min, max, sum, count) parts, any of them None.
+def combine( parts):
+    parts = [ part for part in parts if part is not None]
+    if( not parts):
+        return None
+    return ( min( [ part[ 0] for part in parts]), max( [ part[ 1] for part in parts]),
+             sum( [ part[ 2] for part in parts]), sum( [ part[ 3] for part in parts]))
@@ -0,0 +1,260 @@
+'''=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
+ # Package:   tfmp_supervisor
+ # Described: Keep a TFMini-Plus stream alive across disconnects
+ #
+ # A USB serial device that browns out or is plugged in again
+ # leaves '/dev' and comes back.  A 'Supervisor' runs a 'TFMPlus'
+ # object in streaming mode and looks after its port from a
+ # thread of its own:
+ #   1. When the reader thread finds the port gone, the port is
+ #      closed and the supervisor waits for the device node to
+ #      come back.  It is woken by inotify on the node's folder,
+ #      or looks every 'TFMP_PLUG_POLL' seconds without inotify.
+ #   2. The port is opened again, and the link is ready on the
+ #      first frame that passes the checksum test, not after a
+ #      fixed wait.
+ #   3. The last frame rate, output format and output setting
+ #      sent with 'sendCommand()' are sent again, since a device
+ #      that restarted has only its saved settings.
+ # A device that sends nothing for 'silence' seconds, or ten
+ # frame periods if longer, is taken to have restarted with the
+ # port still open, and the port is opened again the same way.
+ #
+ # The 'TFMPlus' object, its ring buffer, counters and frame
+ # clock are kept throughout, so readers of 'latest()', 'since()'
+ # and 'wait_next()' see only a gap in the frame times.  Each
+ # outage, from the last frame before it to the first frame
+ # after it, is added to the 'reconnectTime' histogram of the
+ # device and counted in 'reconnects'.  Both are in 'metrics()'.
+ #
+ # Give the port by a name that stays the same when the device
+ # comes back, such as its link in '/dev/serial/by-id'.
+ #
+ # Example:
+ #   sensor = tfmplus.TFMPlus()
+ #   with Supervisor( sensor, '/dev/serial/by-id/usb-...', 115200, FRAME_100):
+ #       while True:
+ #           frame = sensor.wait_next( 1.0)
+=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
+
+import os
+import time
+import ctypes
+import select
+import threading
+import serial
+
+from tfmplus import FrameRing, TFMP_RING_SIZE, TFMP_STREAM_WAIT, TFMP_SERIAL
+from tfmplus import SET_FRAME_RATE, DISABLE_OUTPUT, GET_FIRMWARE_VERSION
+
+TFMP_PLUG_POLL  = 0.02    # seconds between looks for the node without inotify
+TFMP_PLUG_CHECK = 0.25    # longest wait on inotify before looking anyway
+TFMP_BOOT_TIME  = 1.0     # seconds for an opened device to send a frame
+TFMP_SILENCE    = 1.0     # seconds without frames before the port is opened again
+TFMP_WATCH_TICK = 0.1     # seconds between looks at a running stream
+
+#  inotify events that can mean the node is there
+IN_ATTRIB   = 0x004
+IN_MOVED_TO = 0x080
+IN_CREATE   = 0x100
+
+class NodeWatch:
+    ''' Wait for a device node to appear'''
+
+    #  Watch the folder of 'path'.  Without inotify, or if the
+    #  folder is not there, 'wait()' looks for the node in turn.
+    def __init__( self, path):
+        self.path = path
+        self.fd = -1
+        try:
+            libc = ctypes.CDLL( None, use_errno = True)
+            fd = libc.inotify_init1( os.O_NONBLOCK | os.O_CLOEXEC)
+        except ( OSError, AttributeError):
+            return
+        if( fd < 0):
+            return
+        folder = os.path.dirname( os.path.abspath( path))
+        if( libc.inotify_add_watch( fd, os.fsencode( folder),
+                                    IN_CREATE | IN_ATTRIB | IN_MOVED_TO) < 0):
+            os.close( fd)
+            return
+        self.fd = fd
+
+    #  Return True once the node exists, or False after 'timeout'
+    #  seconds.  A watch is not trusted alone: if its folder was
+    #  removed it sees nothing, so the node is looked for anyway
+    #  every 'TFMP_PLUG_CHECK' seconds.
+    def wait( self, timeout):
+        ''' Wait for the node'''
+        deadline = time.monotonic() + timeout
+        while( not os.path.exists( self.path)):
+            left = deadline - time.monotonic()
+            if( left <= 0):
+                return False
+            if( self.fd < 0):
+                time.sleep( min( left, TFMP_PLUG_POLL))
+            elif( select.select( [ self.fd], [], [], min( left, TFMP_PLUG_CHECK))[ 0]):
+                try:
+                    os.read( self.fd, 4096)     #  the events themselves do not matter
+                except BlockingIOError:
+                    pass
+        return True
+
+    def close( self):
+        if( self.fd >= 0):
+            os.close( self.fd)
+            self.fd = -1
+
+class Supervisor:
+    ''' Reconnecting streaming mode for one device'''
+
+    #  Run 'sensor' on 'port' at 'baud'.  'frameRate', if given,
+    #  is sent each time the device is connected, as if it had
+    #  been sent with 'sendCommand()'.
+    def __init__( self, sensor, port, baud = 115200, frameRate = None,
+                  size = TFMP_RING_SIZE, silence = TFMP_SILENCE):
+        self.sensor = sensor
+        self.port = port
+        self.baud = baud
+        self.size = size              # ring buffer frames, if a new ring is needed
+        self.silence = silence        # 0 to never open a silent port again
+        self.connected = threading.Event()    # set while the link is up
+        self.lost = None              # time of the last frame before the outage
+        self.outage = 0.0             # seconds of the last outage
+        self.running = False
+        self.thread = None
+        if( frameRate is not None):
+            sensor.settings[ 'rate'] = ( SET_FRAME_RATE, frameRate)
+            sensor.clock.setRate( frameRate)
+
+    def __enter__( self):
+        self.start()
+        return self
+
+    def __exit__( self, *exc):
+        self.stop()
+
+    #  Start the supervisor thread.  The ring buffer can be read
+    #  at once, and fills as soon as the device is connected.
+    def start( self):
+        ''' Start looking after the device'''
+        sensor = self.sensor
+        sensor.stopStream()
+        if( sensor.ring is None):
+            sensor.ring = FrameRing( self.size)
+        sensor.clock.setBaud( self.baud)
+        sensor.supervised = True      #  readers wait through outages
+        self.running = True
+        self.thread = threading.Thread( target = self.run,
+                                        name = 'tfmplus-supervisor', daemon = True)
+        self.thread.start()
+
+    #  Stop the supervisor and reader threads and close the port.
+    #  Threads waiting for frames are woken, see 'FrameRing.end()'.
+    def stop( self):
+        ''' Stop looking after the device'''
+        self.running = False
+        if( self.thread is not None):
+            self.thread.join()
+            self.thread = None
+        self.sensor.supervised = False
+        self.sensor.ring.end()
+
+    #  Wait up to 'timeout' seconds for the link to be up.
+    def ready( self, timeout = None):
+        ''' Wait for the device to be connected'''
+        return self.connected.wait( timeout)
+
+    #  - - - - - - - - -  Supervisor thread  - - - - - - - - - - -
+    def run( self):
+        try:
+            while( self.running):
+                if( self.connect()):
+                    self.watch()
+                self.disconnect()
+        finally:
+            self.disconnect()
+
+    #  Return True if the device is set to send frames by itself.
+    def streams( self):
+        settings = self.sensor.settings
+        return ( settings.get( 'rate', ( 0, 1))[ 1] != 0
+                 and settings.get( 'output', ( 0, 0))[ 0] != DISABLE_OUTPUT)
+
+    #  Wait for the node, open the port and start the reader
+    #  thread.  Returns True once the device answers, with its
+    #  settings restored.
+    def connect( self):
+        sensor = self.sensor
+        watch = NodeWatch( self.port)
+        try:
+            while( self.running):
+                if( not watch.wait( TFMP_PLUG_CHECK)):
+                    continue
+                try:
+                    sensor.pStream = serial.Serial( self.port, self.baud, timeout = TFMP_STREAM_WAIT)
+                except ( serial.SerialException, OSError):
+                    time.sleep( TFMP_PLUG_POLL)     #  not ready yet, such as its permissions
+                    continue
+                if( self.answered()):
+                    return True
+                self.disconnect()
+        finally:
+            watch.close()
+        return False
+
+    #  Start the reader thread on the new port and wait for the
+    #  first good frame, or for a command reply from a device
+    #  that is not set to send frames.
+    def answered( self):
+        sensor = self.sensor
+        ring = sensor.ring
+        sensor.rxBuffer.clear()
+        sensor.hunting = False
+        sensor.clock.restart()          #  the gap is not lost frames
+        seq = ring.seq
+        sensor.resumeStream()
+        frame = ring.wait_next( TFMP_BOOT_TIME, seq)
+        if( frame is not None):
+            first = frame[ 1]
+        elif( not self.streams() and sensor.sendCommand( GET_FIRMWARE_VERSION, 0)):
+            first = time.monotonic()
+        else:
+            return False
+        if( self.lost is not None):
+            self.outage = first - self.lost
+            sensor.reconnectTime.add( self.outage)
+            sensor.reconnects += 1
+        for cmnd, param in list( sensor.settings.values()):
+            sensor.sendCommand( cmnd, param)
+        self.connected.set()
+        return True
+
+    #  Wait while the link is up.  Returns when the reader thread
+    #  has ended, or the device has been silent too long.
+    def watch( self):
+        sensor = self.sensor
+        ring, thread = sensor.ring, sensor.readerThread
+        seq, heard = ring.seq, time.monotonic()
+        while( self.running and thread.is_alive()):
+            thread.join( TFMP_WATCH_TICK)
+            now = time.monotonic()
+            if( ring.seq != seq):
+                seq, heard = ring.seq, now
+            elif( self.silence and self.streams()
+                  and now - heard > max( self.silence, 10 * sensor.clock.period)):
+                return
+
+    #  Stop the reader thread and close the port.
+    def disconnect( self):
+        sensor = self.sensor
+        self.connected.clear()
+        sensor.stopStream()
+        if( sensor.ring.seq):
+            self.lost = sensor.ring.latest()[ 1]
+        if( sensor.pStream is not None):
+            try:
+                sensor.pStream.close()
+            except ( serial.SerialException, OSError):
+                pass
+            sensor.status = TFMP_SERIAL
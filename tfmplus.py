@@ -38,29 +38,40 @@
  #  defined values. Incorrect values can render the device
  #  permanently uncommunicative.
  #
+ # 'TFMPlus()' creates a device object with its own serial port,
+ #  buffers, status and data variables, and its own copy of each
+ #  function above, so one program can drive many devices.  The
+ #  module functions and variables belong to one default device.
+ #
 =-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-'''
 
+import os
+import re
 import time
+import select
+import struct
+import threading
+import collections
+from array import array
 import serial
 
-status = 0           # error status code
-dist =   0           # distance to target
-flux =   0           # signal quality or intensity
-temp =   0           # internal chip temperature
-version = bytearray( 3)   # firmware version number
-
 # Buffer sizes
 TFMP_FRAME_SIZE =  9   # Size of one data frame = 9 bytes
 TFMP_COMMAND_MAX = 8   # Longest command = 8 bytes
 TFMP_REPLY_SIZE =  8   # Longest command reply = 8 bytes
-# Buffers
-frame = bytearray( TFMP_FRAME_SIZE)   # firmware version number
-reply = bytearray( TFMP_REPLY_SIZE)   # firmware version number
 
 # Timeout Limits for various functions
 TFMP_MAX_READS          = 20   # readData() sets SERIAL error
 MAX_BYTES_BEFORE_HEADER = 20   # getData() sets HEADER error
 MAX_ATTEMPTS_TO_MEASURE = 20
+TFMP_DATA_TIMEOUT       = 1.0  # getData() seconds to wait for a frame
+TFMP_READY_TIMEOUT      = 0.2  # begin() seconds to wait for a first frame
+TFMP_TRIGGER_DEPTH      = 4    # measure_many() triggers in flight
+
+#  Frame, status and timing metrics are kept by the decoder unless
+#  TFMP_NO_METRICS is set in the environment when the module is
+#  loaded, which leaves them out of the decode path altogether.
+TFMP_METRICS = not os.environ.get( 'TFMP_NO_METRICS')
 
 TFMP_DEFAULT_ADDRESS    = 0x10  # default I2C slave address
                                 # as hexidecimal integer
@@ -80,20 +91,7 @@ TFMP_WEAK         = 10  # Signal Strength ≤ 100
 TFMP_STRONG       = 11  # Signal Strength saturation
 TFMP_FLOOD        = 12  # Ambient Light saturation
 TFMP_MEASURE      = 13
-
-#  Return TRUE/FALSE whether receiving serial data from
-#  device, and set system status to provide more information.
-def begin( port, rate):
-    ''' Set serial port and test for data'''
-    global pStream
-    pStream = serial.Serial( port, rate)
-    time.sleep(0.2)             #  Give port 200ms to initalize
-    if pStream.inWaiting() > 0:    #  If data present...
-        status = TFMP_READY     #  return status as READY
-        return True
-    else:                       #  Otherwise...
-        status = TFMP_SERIAL    #  return status as SERIAL ERROR
-        return False
+TFMP_I2CNACK      = 14  # I2C transaction not acknowledged
 
 ''' - - - - - -  TFMini Plus data formats  - - - - - - - - -
   Data Frame format:
@@ -106,83 +104,7 @@ def begin( port, rate):
   0x5A   Length  Cmd ID  Payload if any   Checksum
 - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - '''
 
-#  Return TRUE/FALSE whether data received without error
-#  and set system status to provide more information.
-def getData():
-    ''' Get serial frame data from device'''
-    
-    # make data variables global
-    global status, dist, flux, temp
-
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Step 1 - Get data from the device.
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Set 1 second timeout if HEADER code never appears
-    #  or serial data never becomes available.
-    serialTimeout = time.time() + 1000
-    #  Flush all but last frame of data from the serial buffer.
-    while( pStream.inWaiting() > TFMP_FRAME_SIZE):
-        pStream.read()
-    #  Read one byte from the serial buffer into the data buffer's
-    #  'plus one' position, then left shift the whole array 1 byte
-    #  and repeat until the two HEADER bytes show up as the first
-    #  two bytes in the array.
-    frame = bytearray( TFMP_FRAME_SIZE)   #  'frame' data buffer
-    while( frame[ 0] != 0x59) or ( frame[ 1] != 0x59):
-        if pStream.inWaiting():
-            #  Read 1 byte into the 'frame' plus one position.
-            frame.append( pStream.read()[0])
-            #  Shift entire length of 'frame' one byte left.
-            frame = frame[ 1:]
-        #  If no HEADER or serial data not available
-        #  after more than one second...
-        if time.time() >  serialTimeout:
-            status = TFMP_HEADER   #  ...then set error
-            return False
-
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Step 2 - Perform a checksum test.
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Clear the 'chkSum' variable declared in 'TFMPlus.h'
-    chkSum = 0
-    #  Add together all bytes but the last.
-    for i in range( TFMP_FRAME_SIZE -1):
-        chkSum += frame[ i]
-    #   If the low order byte does not equal the last byte...
-    if( ( chkSum & 0xFF) != frame[ TFMP_FRAME_SIZE -1]):
-        status = TFMP_CHECKSUM  #  ...then set error
-        return False
-
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Step 3 - Interpret the frame data
-    #           and if okay, then go home
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    dist = (frame[3] * 256) + frame[2]
-    flux = (frame[5] * 256) + frame[4]
-    temp = (frame[7] * 256) + frame[6]
-    #  Convert temp code to degrees Celsius.
-    temp = ( temp >> 3) - 256
-    #  Convert Celsius to degrees Farenheit
-    #  temp = ( temp * 9 / 5) + 32
-
-    #  - - Evaluate Abnormal Data Values - -
-    #  Values are from the TFMini-S Product Manual
-    #  Signal strength <= 100
-    if( dist == -1):     status = TFMP_WEAK
-    #  Signal Strength saturation
-    elif( flux == -1):   status = TFMP_STRONG
-    #  Ambient Light saturation
-    elif( dist == -4):   status = TFMP_FLOOD
-    #  Data is apparently okay
-    else:                status = TFMP_READY
-
-    if( status != TFMP_READY):
-        return False;
-    else:
-        return True;
-
-
-#  = = = = =  SEND A COMMAND TO THE DEVICE  = = = = = = = = = =0
+#  = = = = =  COMMANDS AND PARAMETERS  = = = = = = = = = = = =
 #
 #  - - -  Command Codes - - - - -
 #  The 'sendCommand()' function expects the command
@@ -237,15 +159,12 @@ FRAME_200          = 0x00C8
 FRAME_250          = 0x00FA
 FRAME_500          = 0x01F4
 FRAME_1000         = 0x03E8
-#
-#  Create a proper command byte array, send the command,
-#  get a repsonse, and return the status
-def sendCommand( cmnd, param):
-    ''' Send serial command and get reply data'''
-
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Step 1 - Build the command data to send to the device
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+#  - - - - - - - - -  Command encoding  - - - - - - - - - - - -
+#  Create a proper command byte array for 'cmnd' and 'param'.
+#  Returns the command bytes and the expected reply length.
+def buildCommand( cmnd, param):
+    ''' Build the command data to send to the device'''
     # From 32bit 'cmnd' integer, create a four byte array of:
     # reply length, command length, command number and a one byte parameter
     cmndData = bytearray( cmnd.to_bytes( TFMP_COMMAND_MAX, byteorder = 'little'))
@@ -258,9 +177,11 @@ def sendCommand( cmnd, param):
         cmndData[3:2] = param.to_bytes( 2, byteorder = 'little')     #  add the 2 byte FrameRate parameter.
     elif( cmnd == SET_BAUD_RATE):                                    #  If the command is Set BaudRate...
         cmndData[3:3] = param.to_bytes( 3, byteorder = 'little')     #  add the 3 byte BaudRate parameter.
+    elif( cmnd == SET_I2C_ADDRESS and param):                        #  If the command is Set I2C Address...
+        cmndData[3] = param                                          #  replace the default address.
 
     cmndData = cmndData[0:cmndLen]  # re-establish command data length
-    
+
     #  Create a checksum byte for the command data array.
     chkSum = 0
     #  Add together all bytes but the last.
@@ -268,63 +189,35 @@ def sendCommand( cmnd, param):
         chkSum += cmndData[ i]
     #  and save it as the last byte of command data.
     cmndData[ cmndLen -1] = ( chkSum & 0xFF)
-    
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Step 2 - Send the command data array to the device
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    pStream.reset_input_buffer()    #  flush input buffer
-    pStream.reset_output_buffer()   #  flush output buffer
-    pStream.write( cmndData)        #  send command data
-        
-    #  + + + + + + + + + + + + + + + + + + + + + + + + +
-    #  If the command does not expect a reply, then we're
-    #  finished here. Go home.
-    if( replyLen == 0):
-        return True
-    #  + + + + + + + + + + + + + + + + + + + + + + + + +
-
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Step 3 - Get command reply data back from the device.
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Set a one second timer to timeout if HEADER never appears
-    #  or serial data never becomes available
-    serialTimeout = time.time() + 1000
-    #  Establish 'reply' bytearray and fill with zeros
-    reply = bytearray( replyLen)
-    
-    #  1) Read one byte from serial buffer
-    #  2) Append byte to end of 'reply'
-    #  3) Left shift entire array by one byte.
-    #  4) Repeat until 'HEADER' and 'replyLen'
-    #     appear as first two bytes in array.
-    while( reply[ 0] != 0x5A) or (reply[ 1] != replyLen):
-        if( pStream.inWaiting()):
-            #  Read 1 byte into the 'frame' plus one position.
-            reply.append( pStream.read()[0])
-            #  Shift entire length of 'frame' one byte left.
-            reply = reply[ 1:]
-        #  If HEADER/replyLen combo does do not
-        #  appear after more than one second...
-        if( time.time() >  serialTimeout):
-            status = TFMP_HEADER   #  ...then set error type
-            return False           # and return 'False'.
-
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Step 4 - Perform a checksum test.
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Clear the 'chkSum' variable declared in 'TFMPlus.h'
-    chkSum = 0
-    #  Add together all bytes but the last.
-    for i in range( replyLen -1):
-        chkSum += reply[ i]
-    #  If the low order byte does not equal the last byte...
-    if( ( chkSum & 0xFF) != reply[ replyLen - 1]):
-      status = TFMP_CHECKSUM  #  ...then set error
-      return False            #  and return 'False.'
-
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Step 5 - Interpret different command responses.
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    return bytes( cmndData), replyLen
+
+#  Time limits for a command reply.  Benewake says commands that
+#  modify internal parameters take about 1ms, some take several ms,
+#  and those that erase FLASH may take several hundred ms.  Both
+#  limits allow for the reply to cross the link at 9600 baud.
+TFMP_REPLY_TIMEOUT = 0.1   # seconds, most commands
+TFMP_FLASH_TIMEOUT = 1.0   # seconds, SAVE_SETTINGS and resets
+
+#  Commands that change a setting a 'Supervisor' restores after
+#  the device restarts, by the setting they change.  Only the
+#  last command sent for each setting is kept, in 'settings'.
+settingCommands = { SET_FRAME_RATE: 'rate',
+                    STANDARD_FORMAT_CM: 'format', STANDARD_FORMAT_MM: 'format',
+                    PIXHAWK_FORMAT: 'format',
+                    ENABLE_OUTPUT: 'output', DISABLE_OUTPUT: 'output' }
+
+#  Return the reply time limit for 'cmnd' in seconds.
+def replyTimeout( cmnd):
+    ''' Reply time limit of a command'''
+    if( cmnd == SOFT_RESET or cmnd == HARD_RESET or cmnd == SAVE_SETTINGS):
+        return TFMP_FLASH_TIMEOUT
+    return TFMP_REPLY_TIMEOUT
+
+#  Interpret a reply that has passed the checksum test and
+#  return the status code.  The firmware version from a
+#  'GET_FIRMWARE_VERSION' reply is copied into 'version'.
+def replyStatus( cmnd, reply, version):
+    ''' Interpret different command responses'''
     if( cmnd == GET_FIRMWARE_VERSION):
         version[ 0] = reply[ 5]  #  set firmware version.
         version[ 1] = reply[ 4]
@@ -334,62 +227,1388 @@ def sendCommand( cmnd, param):
             cmnd == HARD_RESET or
             cmnd == SAVE_SETTINGS ):
             if( reply[ 3] == 1):    #  If PASS/FAIL byte non-zero...
-                status = TFMP_FAIL  #  then set status to 'FAIL'...
-                return False        #  and return 'False'.
-
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #  Step 6 - Set status to 'READY' and return 'True'
-    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-    status = TFMP_READY
-    return True
-
-#  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-#  - - - - -    The following are for testing purposes   - - - -
-#     They interpret error status codes and display HEX data
-#  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+                return TFMP_FAIL    #  then status is 'FAIL'.
+    return TFMP_READY
+
+#  - - - - - - - - -  Precompiled commands  - - - - - - - - - -
+#  All of the module's commands and defined parameters are
+#  built once, when the module is loaded, and kept in
+#  'commandFrames' by ( cmnd, param).  Any other command, such
+#  as an I2C address or a frame rate not listed, is built each
+#  time it is sent and not kept, so the table cannot grow.
+commandList = ( GET_FIRMWARE_VERSION, TRIGGER_DETECTION, SOFT_RESET,
+                HARD_RESET, SAVE_SETTINGS, SET_FRAME_RATE, SET_BAUD_RATE,
+                STANDARD_FORMAT_CM, PIXHAWK_FORMAT, STANDARD_FORMAT_MM,
+                ENABLE_OUTPUT, DISABLE_OUTPUT, SET_I2C_ADDRESS,
+                SET_SERIAL_MODE, SET_I2C_MODE, I2C_FORMAT_CM, I2C_FORMAT_MM)
+baudRates = ( BAUD_9600, BAUD_14400, BAUD_19200, BAUD_56000,
+              BAUD_115200, BAUD_460800, BAUD_921600)
+frameRates = ( FRAME_0, FRAME_1, FRAME_2, FRAME_5, FRAME_10, FRAME_20,
+               FRAME_25, FRAME_50, FRAME_100, FRAME_125, FRAME_200,
+               FRAME_250, FRAME_500, FRAME_1000)
+commandFrames = {}
+
+#  Return the command bytes and reply length for 'cmnd' and
+#  'param' from 'commandFrames', or build them if not there.
+def encodeCommand( cmnd, param):
+    ''' Get precompiled command data'''
+    if( cmnd != SET_FRAME_RATE and cmnd != SET_BAUD_RATE and cmnd != SET_I2C_ADDRESS):
+        param = 0                  #  parameter is not used
+    encoded = commandFrames.get( ( cmnd, param))
+    if( encoded is None):
+        encoded = buildCommand( cmnd, param)
+    return encoded
+
+for cmnd in commandList:
+    for param in ( frameRates if cmnd == SET_FRAME_RATE else
+                   baudRates if cmnd == SET_BAUD_RATE else ( 0,)):
+        commandFrames[ ( cmnd, param)] = buildCommand( cmnd, param)
+del cmnd, param
+
+#  The result of one command, returned by 'sendCommands()':
+#  'status' code, 'reply' bytes, or None if there was no reply,
+#  and 'elapsed' seconds from sending to reply.
+CommandResult = collections.namedtuple( 'CommandResult',
+                                        'cmnd param status reply elapsed')
+
+#  One command waiting for its reply.
+class Transaction:
+    ''' A command waiting for its reply'''
+    __slots__ = ( 'cmnd', 'param', 'header', 'replyLen', 'start',
+                  'deadline', 'finish', 'status', 'reply')
+
+    def __init__( self, cmnd, param, cmndData, replyLen, start, deadline):
+        self.cmnd = cmnd
+        self.param = param
+        self.header = bytes( ( 0x5A, replyLen, cmndData[ 2]))
+        self.replyLen = replyLen
+        self.start = start
+        self.deadline = deadline
+        self.finish = start
+        self.status = None         #  None until finished
+        self.reply = None
+
+    #  Finish with a 'status' code and the 'reply', if any.
+    def done( self, status, reply = None):
+        self.finish = time.monotonic()
+        self.status = status
+        self.reply = reply
+
+    def result( self):
+        return CommandResult( self.cmnd, self.param, self.status, self.reply,
+                              self.finish - self.start)
+
+#  - - - - - - - - -  Bulk frame decoder  - - - - - - - - - - -
+#  Every read pulls the whole serial buffer in one call and
+#  decodes all of the frames in it at once.  A partial frame
+#  at the end of a read is carried over to the next one.
+#
+#  Frame sync is a two state machine kept in the buffer itself:
+#  while in sync, each frame is checked where the one before it
+#  ended; when a header is missing or a checksum fails, the
+#  decoder hunts for the next header from the very next byte,
+#  so no more bytes are discarded than are certainly not part
+#  of a good frame.
+TFMP_HEADER_BYTES = b'\x59\x59'        # two byte data frame header
+frameData = struct.Struct( '<hhH')     # Dist, Flux and Temp, low byte first
+
+#  Decode every valid data frame in 'data' and append the values
+#  to the 'dists', 'fluxes' and 'temps' arrays.  Temperature is
+#  converted to degrees Celsius.  Returns the number of bytes used,
+#  the number of frames that failed the checksum test, the
+#  position of the last good frame, or -1 if there was none, and
+#  the number of times sync was lost and a header was hunted for.
+def decodeFrames( data, dists, fluxes, temps):
+    ''' Decode all data frames in a byte buffer'''
+    find = data.find
+    unpack = frameData.unpack_from
+    end = len( data)
+    last = end - TFMP_FRAME_SIZE   # last possible frame start
+    errors = 0
+    misses = 0
+    good = -1
+    start = 0                   # where the last search began
+    with memoryview( data) as view:
+        pos = find( TFMP_HEADER_BYTES)
+        if( pos != 0 and end > 1):
+            misses += 1         #  Not in sync at the start
+        while( 0 <= pos <= last):
+            #  Low order byte of the sum of the first eight
+            #  bytes must equal the ninth, checksum byte.
+            if( ( sum( view[ pos: pos + 8]) & 0xFF) == data[ pos + 8]):
+                d, f, t = unpack( data, pos + 2)
+                dists.append( d)
+                fluxes.append( f)
+                temps.append( ( t >> 3) - 256)
+                good = pos
+                pos += TFMP_FRAME_SIZE
+            else:
+                errors += 1     #  Bad frame or false header,
+                pos += 1        #  so resync on the next byte.
+            start = pos
+            next = find( TFMP_HEADER_BYTES, pos)
+            if( next != pos and end - pos > 1):
+                misses += 1     #  Lost sync, hunted for a header
+            pos = next
+    #  Keep a partial frame, or a single trailing header
+    #  byte that is not the end of a good frame, for the
+    #  next read.
+    if( pos < 0):
+        pos = end - ( end > start and data[ -1:] == b'\x59')
+    return pos, errors, good, misses
+
+#  Set the 'status' code for a decoded set of values.
+def frameStatus( d, f):
+    ''' Evaluate abnormal data values'''
+    #  Values are from the TFMini-S Product Manual
+    #  Signal strength <= 100
+    if( d == -1):     return TFMP_WEAK
+    #  Signal Strength saturation
+    elif( f == -1):   return TFMP_STRONG
+    #  Ambient Light saturation
+    elif( d == -4):   return TFMP_FLOOD
+    #  Data is apparently okay
+    else:             return TFMP_READY
+
+#  - - - - - - - - -  Output formats  - - - - - - - - - - - - -
+#  The device sends one of three output formats, chosen with
+#  'sendCommand()':
+#    STANDARD_FORMAT_CM - 9 byte binary frames, 'dist' in cm
+#    STANDARD_FORMAT_MM - the same frames, 'dist' in mm
+#    PIXHAWK_FORMAT     - text lines of the distance in metres,
+#                         such as '1.23\r\n', with no flux or
+#                         temperature, which are given as 0
+#  Each format has its own bulk decoder in 'frameDecoders', with
+#  the same arguments as 'decodeFrames()'.  Each returns the
+#  bytes used, the checksum errors, the position of the last
+#  good frame, the times sync was lost and the bytes discarded.
+#  Another format can be added to the table.
+#
+#  A 'FrameDecoder' finds the format from the data, by the first
+#  whole frame that one of the decoders accepts.  The two binary
+#  formats are alike, so which of them is in use is known only
+#  from 'setFormat()', which 'sendCommand()' calls, and is kept
+#  while the format is found again.  Distances are given in the
+#  unit the device sends, mm for 'STANDARD_FORMAT_MM' and cm
+#  otherwise.  If 'millimeters' is set to True or False they are
+#  converted to mm or to cm, with integers only.
+TFMP_LINE_MAX    = 8    # longest Pixhawk line, '-99.99\r\n'
+TFMP_DETECT_KEEP = 16   # bytes kept while the format is not known
+TFMP_DETECT_BYTES = 27  # bytes of no good frame before it is found again
+lineData = re.compile( rb'((-?\d{1,2})\.(\d\d)\r?\n)')
+
+#  'decodeFrames()' for the decoder table
+def decodeStandard( data, dists, fluxes, temps):
+    ''' Decode all binary data frames in a byte buffer'''
+    count = len( dists)
+    used, errors, good, misses = decodeFrames( data, dists, fluxes, temps)
+    return used, errors, good, misses, used - ( len( dists) - count) * TFMP_FRAME_SIZE
+
+#  Decode every whole Pixhawk text line in 'data'.  Each line is
+#  the distance in metres to two places, so without its point
+#  it is the distance in cm.  Lines that are not a distance are
+#  discarded and counted as sync lost.
+def decodeLines( data, dists, fluxes, temps):
+    ''' Decode all Pixhawk text lines in a byte buffer'''
+    end = data.rfind( b'\n') + 1     #  keep a partial line
+    if( not end):
+        used = max( len( data) - TFMP_LINE_MAX, 0)
+        return used, 0, -1, int( used > 0), used
+    lines = lineData.findall( data, 0, end)
+    count = len( lines)
+    dists.extend( [ int( whole + part) for line, whole, part in lines])
+    zeros = bytes( 2 * count)
+    fluxes.frombytes( zeros)
+    temps.frombytes( zeros)
+    kept = sum( [ len( line) for line, whole, part in lines])
+    good = data.rfind( lines[ -1][ 0], 0, end) if count else -1
+    return end, 0, good, data.count( b'\n', 0, end) - count, end - kept
+
+#  Decoder of each output format, whether its distances are in
+#  mm, and whether it is binary, with frames that begin with
+#  'TFMP_HEADER_BYTES'.  Binary formats come first.
+frameDecoders = { STANDARD_FORMAT_CM: ( decodeStandard, False, True),
+                  STANDARD_FORMAT_MM: ( decodeStandard, True, True),
+                  PIXHAWK_FORMAT:     ( decodeLines, False, False) }
+
+#  Return the output format of the first whole frame in 'data'
+#  that a decoder accepts, or None if there is none yet.  The
+#  first 'TFMP_DETECT_SPAN' bytes are tried before the rest.
+TFMP_DETECT_SPAN = 64
+
+def detectFormat( data):
+    ''' Find the output format of a byte buffer'''
+    spans = ( data[ :TFMP_DETECT_SPAN], data) if len( data) > TFMP_DETECT_SPAN else ( data,)
+    for span in spans:
+        tried = []
+        for format, ( decode, mm, binary) in frameDecoders.items():
+            if( decode not in tried):
+                tried.append( decode)
+                if( decode( span, array( 'h'), array( 'h'), array( 'h'))[ 2] >= 0):
+                    return format
+    return None
+
+#  Convert the distances in 'dists' from position 'count' on,
+#  in place, from cm to mm if 'toMM', or else from mm to cm.
+#  Error codes, below zero, are kept as they are.
+def scaleDists( dists, count, toMM):
+    ''' Convert distances between cm and mm'''
+    if( toMM):
+        dists[ count:] = array( 'h', [ min( d, 3276) * 10 if d > 0 else d for d in dists[ count:]])
+    else:
+        dists[ count:] = array( 'h', [ ( d + 5) // 10 if d > 0 else d for d in dists[ count:]])
+
+class FrameDecoder:
+    ''' Decoder of any output format'''
+    __slots__ = ( 'format', 'decode', 'mm', 'binary', 'millimeters')
+
+    #  Decode 'format', or find it from the data if None.
+    def __init__( self, format = None, millimeters = None):
+        self.millimeters = millimeters    # give distances in mm, cm, or as sent if None
+        self.setFormat( format)
+
+    #  Decode output format 'format' from now on, or find the
+    #  format from the data if None.
+    def setFormat( self, format):
+        ''' Set the output format'''
+        self.format = format
+        if( format is None):
+            self.decode = None
+        else:
+            self.decode, self.mm, self.binary = frameDecoders[ format]
+
+    #  Find the format from 'data'.  A binary format found is
+    #  taken to be the binary format set last.  Returns False if
+    #  there is no whole frame of any format yet.
+    def detect( self, data):
+        format = detectFormat( data)
+        if( format is None):
+            return False
+        last = frameDecoders.get( self.format)
+        if( last is None or last[ 0] is not frameDecoders[ format][ 0]):
+            self.format = format
+        self.setFormat( self.format)
+        return True
+
+    #  Decode 'data' as the decoders in 'frameDecoders' do, and
+    #  convert the distances if asked to.  While the format is not known
+    #  nothing is decoded and all but the last 'TFMP_DETECT_KEEP'
+    #  bytes are discarded.  If a format stops giving good
+    #  frames, it is looked for again.
+    def frames( self, data, dists, fluxes, temps):
+        ''' Decode a byte buffer in the present format'''
+        if( self.decode is None and not self.detect( data)):
+            used = max( len( data) - TFMP_DETECT_KEEP, 0)
+            return used, 0, -1, 0, used
+        count = len( dists)
+        result = self.decode( data, dists, fluxes, temps)
+        if( len( dists) > count):
+            if( self.millimeters is not None and self.mm != self.millimeters):
+                scaleDists( dists, count, self.millimeters)
+        elif( result[ 4] >= TFMP_DETECT_BYTES):
+            self.decode = None
+        return result
+
+#  - - - - - - - - -  Streaming mode  - - - - - - - - - - - - -
+#  'startStream()' runs a reader thread that keeps draining the
+#  serial port, decodes every frame and writes it, along with a
+#  host monotonic timestamp, into a fixed size ring buffer.
+#  Nothing is allocated per frame once the ring is created.
+#  Consumers read from the ring with 'latest()', 'since( seq)'
+#  and 'wait_next()'.  Each frame is returned as a tuple of:
+#  ( seq, stamp, dist, flux, temp, status)
+#  where 'seq' counts every frame since the stream started.
+#  If the reader thread loses the port, 'end()' wakes every
+#  waiter, so none waits for frames that cannot come.
+TFMP_RING_SIZE     = 4096   # frames held in the ring buffer
+TFMP_STREAM_WAIT   = 0.1    # reader thread serial read timeout
+
+class FrameRing:
+    ''' Fixed size ring buffer of timestamped frames'''
+    __slots__ = ( 'size', 'stamps', 'dists', 'fluxes', 'temps',
+                  'statuses', 'seq', 'overruns', 'ready', 'ended')
+
+    def __init__( self, size = TFMP_RING_SIZE):
+        self.size = size
+        self.stamps   = array( 'd', bytes( 8 * size))  # host time
+        self.dists    = array( 'h', bytes( 2 * size))
+        self.fluxes   = array( 'h', bytes( 2 * size))
+        self.temps    = array( 'h', bytes( 2 * size))
+        self.statuses = array( 'B', bytes( size))
+        self.seq = 0        # sequence number of the next frame
+        self.overruns = 0   # frames overwritten before they were read
+        self.ready = threading.Condition()
+        self.ended = False  # set when the stream has ended
+
+    #  Write one frame.  Called only by the reader thread.
+    #  Call 'notify()' once all frames of a read are written.
+    def push( self, stamp, d, f, t, s):
+        ''' Write one frame into the ring'''
+        i = self.seq % self.size
+        self.stamps[ i] = stamp
+        self.dists[ i] = d
+        self.fluxes[ i] = f
+        self.temps[ i] = t
+        self.statuses[ i] = s
+        self.seq += 1
+
+    #  Wake every thread waiting in 'wait_next()'.
+    def notify( self):
+        ''' Signal that new frames are available'''
+        with self.ready:
+            self.ready.notify_all()
+
+    #  Mark the stream ended and wake every thread waiting in
+    #  'wait_next()'.  Cleared when the stream is resumed.
+    def end( self):
+        ''' Signal that no more frames will arrive'''
+        with self.ready:
+            self.ended = True
+            self.ready.notify_all()
+
+    #  Return the frame with sequence number 'seq' as a tuple.
+    def get( self, seq):
+        ''' Read one frame from the ring'''
+        i = seq % self.size
+        return ( seq, self.stamps[ i], self.dists[ i], self.fluxes[ i],
+                 self.temps[ i], self.statuses[ i])
+
+    #  Return the most recent frame, or None if there is none yet.
+    def latest( self):
+        ''' Read the most recent frame'''
+        seq = self.seq
+        return self.get( seq - 1) if seq else None
+
+    #  Return a list of every frame from sequence number 'seq'
+    #  onward.  If the consumer fell behind and frames were
+    #  overwritten, the lost frames are added to 'overruns' and
+    #  the list starts with the oldest frame still in the ring.
+    def since( self, seq):
+        ''' Read all frames from sequence number seq'''
+        last = self.seq
+        first = last - self.size + 1   # oldest frame that is safe to read
+        if( seq < first):
+            self.overruns += first - seq
+            seq = first
+        return [ self.get( n) for n in range( max( seq, 0), last)]
+
+    #  Block until a new frame arrives and return it.  Returns
+    #  None if no frame arrives within 'timeout' seconds, or at
+    #  once if the stream has ended.  If
+    #  'seq' is given, wait for the frame with that sequence
+    #  number instead, which returns at once if it has arrived.
+    def wait_next( self, timeout = None, seq = None):
+        ''' Wait for the next frame'''
+        if( seq is None):
+            seq = self.seq
+        with self.ready:
+            self.ready.wait_for( lambda: self.seq > seq or self.ended, timeout)
+            if( self.seq <= seq):
+                return None
+        return self.get( seq)
+
+#  - - - - - - - - -  Frame timing  - - - - - - - - - - - - - -
+#  A frame carries no time or sequence number, so 'FrameClock'
+#  gives each one a host monotonic time.  Each read is stamped
+#  as it returns.  The last frame of the read began to arrive
+#  the time of its own nine bytes, and of any partial frame after
+#  it, before that, at the baud rate.
 #
-#  Called by either 'printFrame()' or 'printReply()'
-#  Print status condition either 'READY' or error type
-def printStatus():
-    ''' Print status condition'''
-    print("Status: ", end= '')
-    if( status == TFMP_READY):       print( "READY", end= '')
-    elif( status == TFMP_SERIAL):    print( "SERIAL", end= '')
-    elif( status == TFMP_HEADER):    print( "HEADER", end= '')
-    elif( status == TFMP_CHECKSUM):  print( "CHECKSUM", end= '')
-    elif( status == TFMP_TIMEOUT):   print( "TIMEOUT", end= '')
-    elif( status == TFMP_PASS):      print( "PASS", end= '')
-    elif( status == TFMP_FAIL):      print( "FAIL", end= '')
-    elif( status == TFMP_I2CREAD):   print( "I2C-READ", end= '')
-    elif( status == TFMP_I2CWRITE):  print( "I2C-WRITE", end= '')
-    elif( status == TFMP_I2CLENGTH): print( "I2C-LENGTH", end= '')
-    elif( status == TFMP_WEAK):      print( "Signal weak", end= '')
-    elif( status == TFMP_STRONG):    print( "Signal saturation", end= '')
-    elif( status == TFMP_FLOOD):     print( "Ambient light saturation", end= '')
-    else:                            print( "OTHER", end= '')
-    print()
+#  Frames reach the host late by a varying time, but never
+#  early.  So frame times follow the earliest reads: each frame
+#  is timed one period after the last, or at its read if that
+#  is earlier, and moved only a little later by a late read.
+#  This removes the jitter of the host.  Frames before the last
+#  of a read are one period apart.
 #
-#  Print error type and HEX values
-#  of each byte in the data frame
-def printFrame():
-    '''Print status and frame data'''
-    printStatus();
-    print("Data:", end= '')  # no carriage return
-    for i in range( TFMP_FRAME_SIZE):
-        #  >>> f"{value:#0{padding}X}"
-        # Pad hex number with 0s to length of n characters
-        print(f" {frame[ i]:0{2}X}", end='')
-    print()
-#   
-#  Print error type and HEX values of
-#  each byte in the command response frame.
-def printReply():
-    '''Print status and reply data'''
-    printStatus()
-    #  Print the Hex value of each byte
-    for i in range( TFMP_REPLY_SIZE):
-        print(f" {reply[ i]:0{2}X}", end='')    
-    print()
+#  The device's real output period is found by a linear
+#  regression of the times of reads that are close to on time
+#  against frame number.  The fit forgets old reads
+#  exponentially, so it follows drift of the device clock.  It
+#  is used, in place of the frame rate set, once the standard
+#  error of its period is small.
+#
+#  A read about a period or more late holds fewer frames than
+#  the time says, so frames were lost.  A read delayed by the
+#  host looks the same, but the next reads are on time again.
+#  So the gap is only counted as dropped frames, and the frame
+#  numbers moved on past it, once 'TFMP_GAP_READS' reads in a
+#  row are late.  Until then late reads are timed as if frames
+#  were lost.
+TFMP_CLOCK_MEMORY  = 0.999   # weight kept of the fit per read
+TFMP_CLOCK_READS   = 16      # reads before the fitted period is used
+TFMP_CLOCK_PRECISION = 0.001 # largest standard error of the period used
+TFMP_CLOCK_RISE    = 0.05    # part of a late read that frame times follow
+TFMP_CLOCK_EARLY   = 0.25    # most periods late of a read in the fit
+TFMP_GAP_READS     = 4       # late reads in a row before frames are dropped
+TFMP_GAP_TOLERANCE = 0.8     # periods late of a read after a lost frame
+
+class FrameClock:
+    ''' Frame time, period and drop estimator'''
+    __slots__ = ( 'nominal', 'byteTime', 'period', 'index', 'last', 'phase', 'frames', 'dropped',
+                  'lateReads', 'leastLate', 'weight', 'meanIndex', 'meanTime',
+                  'varIndex', 'covar', 'scatter', 'jitter')
+
+    #  'frameRate' is the rate set in the device, 0 in triggered
+    #  mode, or None if not known.
+    def __init__( self, frameRate = None, baud = 115200):
+        self.frames = 0         # frames timed, never reset
+        self.dropped = 0        # frames lost, never reset
+        self.setBaud( baud)
+        self.setRate( frameRate)
+
+    #  Start again at a new frame rate.
+    def setRate( self, frameRate):
+        ''' Set the device frame rate'''
+        self.nominal = 1 / frameRate if frameRate else frameRate
+        self.restart()
+
+    #  Start again at the same frame rate, after a gap that is
+    #  not lost frames, such as the device restarting.
+    def restart( self):
+        ''' Forget the frames timed so far'''
+        self.period = self.nominal or 0.0   # period in use, 0 if not known
+        self.index = -1         # number of the last frame
+        self.last = 0.0         # time of the last frame
+        self.phase = 0.0        # earliest time it could have been sent
+        self.lateReads = 0      # late reads in a row
+        self.leastLate = 0.0    # periods late of the least late of them
+        self.weight = 0.0       # weighted count of reads in the fit
+        self.meanIndex = 0.0
+        self.meanTime = 0.0
+        self.varIndex = 0.0     # weighted sums of squares
+        self.covar = 0.0
+        self.scatter = 0.0      # mean square of times about the fit
+        self.jitter = 0.0       # mean square time of reads after frames
+
+    def setBaud( self, baud):
+        ''' Set the baud rate'''
+        self.byteTime = 10 / baud    # seconds to send one byte
+
+    #  Time 'count' new frames read at host time 'stamp', with
+    #  'trailing' bytes of the next frame after them.  Returns
+    #  the time of the last of them.
+    def update( self, stamp, count, trailing):
+        ''' Time the frames of one read'''
+        start = stamp - ( trailing + TFMP_FRAME_SIZE) * self.byteTime
+        index = self.index + count
+        self.frames += count
+        if( self.nominal == 0):
+            self.index = index
+            self.last = self.phase = start     #  Triggered, so each frame stands alone
+            return start
+        period = self.period
+        if( not period or self.index < 0):
+            self.index = index
+            self.last = self.phase = start
+            self.fit( index, start)
+            return start
+        expected = self.phase + count * period
+        late = ( start - expected) / period
+        if( late < TFMP_GAP_TOLERANCE):
+            self.lateReads = 0
+        else:
+            self.leastLate = min( late, self.leastLate) if self.lateReads else late
+            self.lateReads += 1
+            if( self.lateReads < TFMP_GAP_READS):
+                #  Timed as if frames were lost, but not yet counted
+                self.index = index
+                self.phase = expected
+                self.last = expected + int( late + 1 - TFMP_GAP_TOLERANCE) * period
+                return self.last
+            missed = int( self.leastLate + 1 - TFMP_GAP_TOLERANCE)
+            self.dropped += missed
+            index += missed
+            expected += missed * period
+            late -= missed
+            self.lateReads = 0
+        self.index = index
+        if( late < 0):
+            self.phase = start
+        else:
+            self.phase = expected + late * period * TFMP_CLOCK_RISE
+            self.jitter += 0.01 * ( ( late * period) ** 2 - self.jitter)
+        self.last = self.phase
+        if( late < TFMP_CLOCK_EARLY):
+            self.fit( index, start)
+        return self.last
+
+    #  Add the time of frame 'index' to the regression.
+    def fit( self, index, start):
+        weight = self.weight = self.weight * TFMP_CLOCK_MEMORY + 1
+        dx = index - self.meanIndex
+        self.meanIndex += dx / weight
+        self.meanTime += ( start - self.meanTime) / weight
+        self.varIndex = self.varIndex * TFMP_CLOCK_MEMORY + dx * ( index - self.meanIndex)
+        self.covar = self.covar * TFMP_CLOCK_MEMORY + dx * ( start - self.meanTime)
+        if( weight >= TFMP_CLOCK_READS):
+            slope = self.covar / self.varIndex
+            error = start - ( self.meanTime + ( index - self.meanIndex) * slope)
+            self.scatter += ( error * error - self.scatter) / min( weight, 100)
+            #  The standard error of the slope is small enough.
+            if( self.scatter < ( TFMP_CLOCK_PRECISION * slope) ** 2 * self.varIndex):
+                self.period = slope
+
+    #  Return the time of frame number 'index'.
+    def time( self, index):
+        ''' Time of a frame'''
+        return self.last + ( index - self.index) * self.period
+
+    #  Return an array of the times of the last 'count' frames.
+    def stamps( self, count):
+        ''' Times of the most recent frames'''
+        last, period = self.last, self.period
+        return array( 'd', [ last - i * period for i in range( count - 1, -1, -1)])
+
+    #  Return a dictionary of the estimates.  'drift_ppm' is how
+    #  much longer the device period is than it should be, as
+    #  measured by the host clock.  'jitter' is the RMS time by
+    #  which reads come after their frames, in seconds.
+    def stats( self):
+        ''' Timing estimates'''
+        period = self.period
+        return { 'frames': self.frames,
+                 'dropped': self.dropped,
+                 'period': period,
+                 'rate': 1 / period if period else 0.0,
+                 'drift_ppm': ( period / self.nominal - 1) * 1e6 if self.nominal else 0.0,
+                 'jitter': self.jitter ** 0.5 }
+
+#  - - - - - - - - -  Latency histogram  - - - - - - - - - - -
+#  Times are counted in buckets that double in width: bucket 'i'
+#  holds times of less than 2**i microseconds, and at least half
+#  that.  Adding a time is a few integer operations and nothing
+#  is allocated, so one can be kept on every hot path.
+TFMP_HISTOGRAM_BUCKETS = 32    # up to 2**31 us, about 36 minutes
+
+class Histogram:
+    ''' Power of two histogram of times'''
+    __slots__ = ( 'counts', 'count', 'total', 'high')
+
+    def __init__( self):
+        self.counts = array( 'Q', bytes( 8 * TFMP_HISTOGRAM_BUCKETS))
+        self.count = 0      # times added
+        self.total = 0.0    # sum of all times in seconds
+        self.high = 0.0     # longest time in seconds
+
+    #  Count 'count' times of 'seconds' each.
+    def add( self, seconds, count = 1):
+        ''' Add one time'''
+        us = int( seconds * 1e6)
+        self.counts[ min( us.bit_length(), TFMP_HISTOGRAM_BUCKETS - 1)] += count
+        self.count += count
+        self.total += seconds * count
+        if( seconds > self.high):
+            self.high = seconds
+
+    def clear( self):
+        ''' Remove all times'''
+        self.__init__()
+
+    def mean( self):
+        ''' Mean time in seconds'''
+        return self.total / self.count if self.count else 0.0
+
+    #  Return the upper limit, in seconds, of the bucket that
+    #  holds fraction 'p' of all times, or 0 if there are none.
+    def percentile( self, p):
+        ''' Time below which fraction p of times fall'''
+        rank = p * self.count
+        seen = 0
+        for i, n in enumerate( self.counts):
+            seen += n
+            if( n and seen >= rank):
+                return ( 1 << i) / 1e6
+        return 0.0
+
+    #  Return a dictionary of the count, the sum and the longest
+    #  time in seconds, and a list of ( limit, count) pairs, one
+    #  for each bucket, where 'count' is the number of times below
+    #  'limit' seconds.
+    def snapshot( self):
+        ''' Copy of the histogram'''
+        buckets = []
+        seen = 0
+        for i, n in enumerate( self.counts):
+            seen += n
+            buckets.append( ( ( 1 << i) / 1e6, seen))
+        return { 'count': self.count, 'sum': self.total, 'max': self.high,
+                 'buckets': buckets }
+
+    #  Print one line for each bucket that holds any times.
+    def printHistogram( self, width = 40):
+        ''' Print the histogram'''
+        most = max( self.counts)
+        for i, n in enumerate( self.counts):
+            if( n):
+                print( f" < {1 << i:10d}us {n:8d} " + '#' * max( 1, n * width // most))
+        print( f" mean {self.mean() * 1e6:.1f}us  p50 < {self.percentile( 0.5) * 1e6:.0f}us"
+               f"  p99 < {self.percentile( 0.99) * 1e6:.0f}us  max {self.high * 1e6:.1f}us")
+
+
+#  = = = = = = = = =  THE DEVICE CLASS  = = = = = = = = = = = =
+#  One 'TFMPlus' object drives one device on one serial port,
+#  so a single program can run any number of devices.  Every
+#  buffer is allocated once, when the object is created.
+class TFMPlus:
+    ''' Benewake TFMini-Plus Lidar device on a serial port'''
+    __slots__ = ( 'pStream', 'status', 'dist', 'flux', 'temp', 'version',
+                  'frame', 'reply', 'rxBuffer', 'dists', 'fluxes', 'temps',
+                  'ring', 'readerThread', 'streaming', 'recorder',
+                  'pending', 'cmndBuffer', 'replied',
+                  'checksumErrors', 'headerMisses', 'bytesDiscarded', 'hunting',
+                  'triggers', 'triggerLatency', 'frameCount', 'statusCounts',
+                  'lastFrame', 'frameGap', 'commandLatency', 'publisher',
+                  'clock', 'stamp', 'settings', 'reconnects', 'reconnectTime', 'decoder',
+                  'frameStore', 'sinkLock', 'supervised')
+
+    def __init__( self):
+        self.pStream = None                          # serial port
+        self.status = 0                              # error status code
+        self.dist = 0                                # distance to target
+        self.flux = 0                                # signal quality or intensity
+        self.temp = 0                                # internal chip temperature
+        self.version = bytearray( 3)                 # firmware version number
+        self.frame = bytearray( TFMP_FRAME_SIZE)     # last data frame received
+        self.reply = bytearray( TFMP_REPLY_SIZE)     # last command reply received
+        self.rxBuffer = bytearray()                  # partial frame between reads
+        self.decoder = FrameDecoder()                # output format, found from the data
+        #  Decode arrays reused by 'getData()'
+        self.dists, self.fluxes, self.temps = array( 'h'), array( 'h'), array( 'h')
+        self.ring = None           # ring buffer of the running stream
+        self.readerThread = None   # reader thread of the running stream
+        self.streaming = False     # cleared to stop the reader thread, or when it ends
+        self.supervised = False    # set while a 'Supervisor' looks after the port
+        self.recorder = None       # records raw serial data if set
+        self.publisher = None      # shares decoded frames if set
+        self.frameStore = None     # keeps decoded frames if set
+        self.sinkLock = threading.Lock()   # held to write or swap the three above
+        self.pending = []          # commands waiting for a reply
+        self.cmndBuffer = bytearray()           # bytes searched for replies
+        self.replied = threading.Condition()    # signals a reply
+        #  Frame sync counters, never reset
+        self.checksumErrors = 0    # frames that failed the checksum test
+        self.headerMisses = 0      # times sync was lost
+        self.bytesDiscarded = 0    # bytes not part of any good frame
+        self.hunting = False       # last read ended out of sync
+        #  Triggered mode
+        self.triggers = 0                    # triggered frames received
+        self.triggerLatency = Histogram()    # trigger to frame times
+        #  Metrics, see 'metrics()'
+        self.frameCount = 0              # data frames decoded
+        self.statusCounts = array( 'Q', bytes( 8 * ( TFMP_I2CNACK + 1)))   # frames not READY and failed reads, by status
+        self.lastFrame = 0.0             # time of the last read with frames
+        self.frameGap = Histogram()      # time between frames
+        self.commandLatency = Histogram()   # command to reply times
+        #  Frame timing, see 'FrameClock'
+        self.clock = FrameClock()        # frame times, period and drops
+        self.stamp = 0.0                 # host time of the last frame
+        #  Settings and outages, see 'tfmp_supervisor'
+        self.settings = {}               # last ( cmnd, param) of each setting
+        self.reconnects = 0              # outages recovered from
+        self.reconnectTime = Histogram() # last frame before to first frame after
+
+    #  Return TRUE/FALSE whether receiving data frames from
+    #  device, and set system status to provide more information.
+    #  If 'stream' is True, also start the streaming mode reader
+    #  thread, see 'startStream()'.
+    def begin( self, port, rate, stream = False):
+        ''' Set serial port and test for data'''
+        self.pStream = serial.Serial( port, rate)
+        self.clock.setBaud( rate)
+        if( self.awaitFrame()):            #  If a good frame arrives...
+            self.status = TFMP_READY       #  return status as READY
+            if( stream):
+                self.startStream()
+            return True
+        else:                              #  Otherwise...
+            self.status = TFMP_SERIAL      #  return status as SERIAL ERROR
+            return False
+
+    #  Wait up to 'timeout' seconds for a data frame that passes
+    #  the checksum test.  Returns True as soon as one arrives,
+    #  so the link is ready without a fixed wait.  The frames
+    #  are left in 'rxBuffer' to be decoded by the next read.
+    def awaitFrame( self, timeout = TFMP_READY_TIMEOUT):
+        ''' Wait for the first good frame'''
+        deadline = time.monotonic() + timeout
+        dists, fluxes, temps = array( 'h'), array( 'h'), array( 'h')
+        rxBuffer = self.rxBuffer
+        while True:
+            self.readSerial( deadline, max( TFMP_FRAME_SIZE - len( rxBuffer), 1))
+            if( detectFormat( rxBuffer) is not None):
+                return True
+            if( time.monotonic() >= deadline):
+                return False
+
+    #  Read everything waiting in the serial buffer into 'rxBuffer'.
+    #  If nothing is waiting and a 'deadline' is given, sleep until
+    #  some data arrives or the deadline passes.  A port with a file
+    #  handle is waited on with 'select()', since setting its
+    #  'timeout' is a 'tcsetattr()' call each read.  Other streams
+    #  sleep in their own read until the rest of a partial frame,
+    #  or at least one byte, arrives.  There is never a busy wait.
+    #  Returns the data read.
+    def readSerial( self, deadline = None, need = 1):
+        ''' Read waiting serial data, or wait for some'''
+        pStream = self.pStream
+        waiting = pStream.inWaiting()
+        if( waiting):
+            data = pStream.read( waiting)
+        elif( deadline is None):
+            return b''
+        elif( hasattr( pStream, 'fileno')):
+            ready = select.select( [ pStream.fileno()], [], [], max( deadline - time.monotonic(), 0))[ 0]
+            if( not ready):
+                return b''
+            waiting = pStream.inWaiting()
+            if( not waiting):
+                #  Readable with nothing to read: the port hung up.
+                raise serial.SerialException( 'device reports readiness to read but returned no data')
+            data = pStream.read( waiting)
+        else:
+            pStream.timeout = max( deadline - time.monotonic(), 0)
+            data = pStream.read( need)
+            if( not data):
+                return data
+            waiting = pStream.inWaiting()
+            if( waiting):
+                data += pStream.read( waiting)
+        self.takeData( data)
+        return data
+
+    #  Pass 'data' read from the port, at time 'stamp', to the
+    #  recorder and to pending commands, and add it to 'rxBuffer'
+    #  to be decoded.  Every read of the port goes through here.
+    def takeData( self, data, stamp = None):
+        ''' Take in data read from the port'''
+        if( self.recorder is not None):
+            with self.sinkLock:
+                recorder = self.recorder
+                if( recorder is not None):
+                    recorder.write( data, stamp)
+        if( self.pending):
+            self.matchReplies( data)
+        self.rxBuffer.extend( data)
+
+    #  Decode 'rxBuffer' into the 'dists', 'fluxes' and 'temps'
+    #  arrays in the output format of 'decoder', keep a partial
+    #  frame and count sync faults.  Copies the last good frame
+    #  into 'frame' for 'printFrame()', and sets 'stamp' to its
+    #  time from 'clock'.
+    #  Returns the number of frames that failed the checksum test.
+    #  This is 'syncFrames()' when metrics are left out.
+    def decodeBuffer( self, dists, fluxes, temps):
+        ''' Decode the receive buffer'''
+        rxBuffer = self.rxBuffer
+        count = len( dists)
+        #  A hunt carried on from the last read is not a new one.
+        carried = self.hunting and len( rxBuffer) > 1 and rxBuffer[ :2] != TFMP_HEADER_BYTES
+        used, errors, good, misses, discarded = self.decoder.frames( rxBuffer, dists, fluxes, temps)
+        if( good >= 0):
+            self.frame[:] = rxBuffer[ good: good + TFMP_FRAME_SIZE]
+        if( errors or misses or discarded):
+            self.checksumErrors += errors
+            self.headerMisses += max( misses - carried, 0)
+            self.bytesDiscarded += discarded
+        del rxBuffer[ :used]
+        if( len( dists) > count):
+            clock = self.clock
+            self.stamp = clock.update( time.monotonic(), len( dists) - count, len( rxBuffer))
+            if( self.publisher is not None or self.frameStore is not None):
+                with self.sinkLock:
+                    publisher, frameStore = self.publisher, self.frameStore
+                    if( publisher is not None):
+                        publisher.write( self.stamp, dists, fluxes, temps, count, clock.period)
+                    if( frameStore is not None):
+                        frameStore.write( self.stamp, dists, fluxes, temps, count, clock.period)
+        #  Out of sync unless the last good frame ended the data
+        #  or a partial frame is waiting to be completed.
+        decoder = self.decoder
+        self.hunting = ( decoder.decode is not None and decoder.binary
+                         and good != used - TFMP_FRAME_SIZE and rxBuffer[ :2] != TFMP_HEADER_BYTES)
+        return errors
+
+    if( TFMP_METRICS):
+        def syncFrames( self, dists, fluxes, temps):
+            ''' Decode the receive buffer and count frames'''
+            count = len( dists)
+            errors = self.decodeBuffer( dists, fluxes, temps)
+            if( len( dists) > count):
+                self.countFrames( dists, fluxes, count)
+            return errors
+    else:
+        syncFrames = decodeBuffer
+
+    #  Count the frames decoded into 'dists' and 'fluxes' from
+    #  position 'count' on, by status, and the time between them.
+    #  Frames of one read arrived together, so the time since the
+    #  last read is shared out between them.
+    def countFrames( self, dists, fluxes, count):
+        now = time.monotonic()
+        frames = len( dists) - count
+        if( self.lastFrame):
+            self.frameGap.add( ( now - self.lastFrame) / frames, frames)
+        self.lastFrame = now
+        self.frameCount += frames
+        if( count):
+            dists, fluxes = dists[ count:], fluxes[ count:]
+        #  Searching the arrays is fast, so frames are only
+        #  looked at one by one if some are not READY.
+        if( -1 in dists or -1 in fluxes or -4 in dists):
+            statusCounts = self.statusCounts
+            for d, f in zip( dists, fluxes):
+                status = frameStatus( d, f)
+                if( status != TFMP_READY):
+                    statusCounts[ status] += 1
+
+    #  Return a dictionary of every counter and histogram.  The
+    #  counters only ever grow, so rates can be found from the
+    #  difference between two snapshots.
+    def metrics( self):
+        ''' Snapshot of the device metrics'''
+        statusCounts = self.statusCounts
+        return { 'frames': self.frameCount,
+                 'checksum_errors': self.checksumErrors,
+                 'header_misses': self.headerMisses,
+                 'bytes_discarded': self.bytesDiscarded,
+                 'frames_dropped': self.clock.dropped,
+                 'weak': statusCounts[ TFMP_WEAK],
+                 'strong': statusCounts[ TFMP_STRONG],
+                 'flood': statusCounts[ TFMP_FLOOD],
+                 'frame_gap': self.frameGap.snapshot(),
+                 'command_latency': self.commandLatency.snapshot(),
+                 'trigger_latency': self.triggerLatency.snapshot(),
+                 'reconnects': self.reconnects,
+                 'reconnect_time': self.reconnectTime.snapshot(),
+                 'timing': self.clock.stats() }
+
+    #  Read everything waiting in the serial buffer, decode it into
+    #  the 'dists', 'fluxes' and 'temps' arrays and update the
+    #  public variables from the last frame found.  With a
+    #  'deadline', waits for data as 'readSerial()' does.  Returns
+    #  the number of frames that failed the checksum test.
+    def readFrames( self, dists, fluxes, temps, deadline = None):
+        ''' Bulk read and decode serial data'''
+        self.readSerial( deadline, max( TFMP_FRAME_SIZE - len( self.rxBuffer), 1))
+        errors = self.syncFrames( dists, fluxes, temps)
+        if( dists):
+            self.dist = d = dists[ -1]
+            self.flux = f = fluxes[ -1]
+            self.temp = temps[ -1]
+            self.status = frameStatus( d, f)
+        elif( errors):
+            self.status = TFMP_CHECKSUM
+        return errors
+
+    #  Return three arrays, 'dists', 'fluxes' and 'temps', holding
+    #  every frame received since the last call.  The arrays are
+    #  empty if no complete frame has arrived.  Sets 'dist', 'flux',
+    #  'temp' and 'status' from the most recent frame.
+    def getFrames( self):
+        ''' Get all frame data received since the last call'''
+        dists, fluxes, temps = array( 'h'), array( 'h'), array( 'h')
+        self.readFrames( dists, fluxes, temps)
+        return dists, fluxes, temps
+
+    #  Return TRUE/FALSE whether data received without error
+    #  and set system status to provide more information.
+    def getData( self):
+        ''' Get serial frame data from device'''
+
+        #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+        #  Step 1 - Get data from the device.
+        #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+        #  Set 1 second timeout if HEADER code never appears
+        #  or serial data never becomes available.
+        deadline = time.monotonic() + TFMP_DATA_TIMEOUT
+        #  Read and decode the whole serial buffer until at least
+        #  one frame is found.  Only the last, most recent frame
+        #  is kept.  Frames that fail the checksum test are skipped.
+        #  Between reads the thread sleeps until data arrives.
+        dists, fluxes, temps = self.dists, self.fluxes, self.temps
+        readFrames = self.readFrames
+        errors = 0
+        while True:
+            errors += readFrames( dists, fluxes, temps, deadline)
+            if( dists):
+                #  Empty the decode arrays without releasing memory.
+                del dists[ :], fluxes[ :], temps[ :]
+                break
+            #  If no HEADER or serial data not available
+            #  after more than one second...
+            if( time.monotonic() > deadline):
+                #  ...then set error
+                self.status = TFMP_CHECKSUM if errors else TFMP_HEADER
+                return False
+
+        #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+        #  Step 2 - Checksum test and data values are evaluated
+        #           by 'readFrames()', which also sets 'status'.
+        #  - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+        #  Convert Celsius to degrees Farenheit
+        #  temp = ( temp * 9 / 5) + 32
+        if( self.status != TFMP_READY):
+            return False;
+        else:
+            return True;
+
+    #  - - - - - - - - -  Streaming mode  - - - - - - - - - - - - -
+    #  The reader thread.  Blocks in 'read()' until data arrives,
+    #  then decodes the whole serial buffer at once.
+    def streamReader( self):
+        ''' Decode serial data into the ring buffer'''
+        dists, fluxes, temps = array( 'h'), array( 'h'), array( 'h')
+        pStream = self.pStream
+        ring = self.ring
+        push = ring.push
+        clock = self.clock
+        while( self.streaming):
+            try:
+                data = pStream.read( max( pStream.inWaiting(), 1))
+            except ( serial.SerialException, OSError):
+                #  The device is gone.  The thread ends and the
+                #  ring is kept, for a 'Supervisor' to carry on.
+                self.streamLost()
+                break
+            stamp = time.monotonic()
+            if( not data):
+                continue
+            self.takeData( data, stamp)
+            if( self.syncFrames( dists, fluxes, temps)):
+                self.status = TFMP_CHECKSUM
+            #  Frames of the read are one period apart, see 'FrameClock'.
+            last = len( dists) - 1
+            first, period = self.stamp - last * clock.period, clock.period
+            for i in range( len( dists)):
+                d, f = dists[ i], fluxes[ i]
+                status = frameStatus( d, f)
+                push( first + i * period, d, f, temps[ i], status)
+            if( dists):
+                self.dist, self.flux, self.temp = dists[ -1], fluxes[ -1], temps[ -1]
+                self.status = status
+                ring.notify()
+                #  Empty the decode arrays without releasing memory.
+                del dists[ :], fluxes[ :], temps[ :]
+
+    #  The reader thread lost the port.  Streaming mode ends, so
+    #  'streaming' is False, and pending commands fail at once.
+    #  Threads waiting for frames are woken too, unless a
+    #  'Supervisor' will open the port again.
+    def streamLost( self):
+        ''' End streaming mode after the port is lost'''
+        self.streaming = False
+        self.status = TFMP_SERIAL
+        with self.replied:
+            for transaction in self.pending:
+                transaction.done( TFMP_SERIAL)
+            self.pending = []
+            self.replied.notify_all()
+        if( not self.supervised):
+            self.ring.end()
+
+    #  Start the reader thread with a new ring buffer of 'size' frames.
+    def startStream( self, size = TFMP_RING_SIZE):
+        ''' Start streaming mode'''
+        self.stopStream()
+        self.ring = FrameRing( size)
+        self.resumeStream()
+
+    #  Start the reader thread again on the ring buffer it had,
+    #  so frame sequence numbers carry on, such as after the
+    #  port is opened again.
+    def resumeStream( self):
+        ''' Restart streaming mode on the same ring'''
+        self.stopStream()
+        self.pStream.timeout = TFMP_STREAM_WAIT   #  so the thread can stop
+        self.ring.ended = False
+        self.streaming = True
+        self.readerThread = threading.Thread( target = self.streamReader,
+                                              name = 'tfmplus-reader', daemon = True)
+        self.readerThread.start()
+
+    #  Stop the reader thread.  The ring buffer is kept for reading.
+    def stopStream( self):
+        ''' Stop streaming mode'''
+        self.streaming = False
+        if( self.readerThread is not None):
+            self.readerThread.join()
+            self.readerThread = None
+
+    #  Streaming mode accessors, see 'FrameRing'
+    def latest( self):
+        ''' Read the most recent frame'''
+        return self.ring.latest()
+
+    def since( self, seq):
+        ''' Read all frames from sequence number seq'''
+        return self.ring.since( seq)
+
+    def wait_next( self, timeout = None, seq = None):
+        ''' Wait for the next frame'''
+        return self.ring.wait_next( timeout, seq)
+
+    #  - - - - - - - - -  Recording  - - - - - - - - - - - - - - -
+    #  Save every byte read from the device, and the time it was
+    #  read, to the file 'path'.  See 'tfmp_record'.
+    def record( self, path, frameRate = 0):
+        ''' Start recording raw serial data'''
+        from tfmp_record import Recorder
+        self.stopRecord()
+        self.recorder = Recorder( path, getattr( self.pStream, 'baudrate', 0), frameRate)
+
+    #  The recorder is swapped out under 'sinkLock', so the
+    #  reader thread is never writing to it when it is closed.
+    def stopRecord( self):
+        ''' Stop recording and close the file'''
+        with self.sinkLock:
+            recorder, self.recorder = self.recorder, None
+        if( recorder is not None):
+            recorder.close()
+
+    #  - - - - - - - - -  Shared memory  - - - - - - - - - - - - -
+    #  Write every decoded frame into a shared memory ring that
+    #  other processes can read.  Returns the name to attach with.
+    #  See 'tfmp_shared'.
+    def publish( self, name = None, size = TFMP_RING_SIZE):
+        ''' Share decoded frames with other processes'''
+        from tfmp_shared import Publisher
+        self.stopPublish()
+        self.publisher = Publisher( name, size)
+        return self.publisher.name
+
+    def stopPublish( self):
+        ''' Stop sharing and remove the shared memory'''
+        with self.sinkLock:
+            publisher, self.publisher = self.publisher, None
+        if( publisher is not None):
+            publisher.close()
+
+    #  - - - - - - - - -  Frame store  - - - - - - - - - - - - - -
+    #  Keep every decoded frame, in memory or in the file 'path',
+    #  with a min/max/mean index for queries over long times.
+    #  Returns the 'FrameStore'.  See 'tfmp_store'.
+    def store( self, path = None):
+        ''' Keep decoded frames for later queries'''
+        from tfmp_store import FrameStore
+        self.stopStore()
+        self.frameStore = FrameStore( path)
+        return self.frameStore
+
+    #  Stop keeping frames.  The store can still be queried.
+    def stopStore( self):
+        ''' Stop keeping frames and finish the file'''
+        with self.sinkLock:
+            frameStore, self.frameStore = self.frameStore, None
+        if( frameStore is not None):
+            frameStore.close()
+
+    #  - - - - - - - - -  Send commands  - - - - - - - - - - - - -
+    #  Look for the replies of pending commands in 'data'.  Called
+    #  with every read while commands are pending, so data frames
+    #  keep being decoded as replies arrive.
+    def matchReplies( self, data):
+        ''' Match replies to pending commands'''
+        with self.replied:
+            buffer = self.cmndBuffer
+            buffer.extend( data)
+            keep = max( len( buffer) - TFMP_REPLY_SIZE + 1, 0)
+            for transaction in self.pending:
+                header, replyLen = transaction.header, transaction.replyLen
+                pos = buffer.find( header)
+                while( pos >= 0):
+                    if( pos > len( buffer) - replyLen):
+                        keep = min( keep, pos)     #  reply not complete yet
+                        break
+                    reply = bytes( buffer[ pos: pos + replyLen])
+                    if( ( sum( reply[ :-1]) & 0xFF) == reply[ -1]):
+                        transaction.done( TFMP_READY, reply)
+                        del buffer[ pos: pos + replyLen]
+                        keep = max( min( keep, len( buffer) - TFMP_REPLY_SIZE + 1), 0)
+                        break
+                    pos = buffer.find( header, pos + 1)
+            #  Remove finished commands and keep only the bytes that
+            #  could be the start of a reply.
+            self.pending = [ t for t in self.pending if t.status is None]
+            del buffer[ :keep]
+            if( not self.pending):
+                buffer.clear()
+            self.replied.notify_all()
+
+    #  Send every ( cmnd, param) pair in 'commands' at once, then
+    #  wait for all of the replies, matched to their commands by
+    #  command number.  Each command has its own time limit from
+    #  'replyTimeout()' plus the time to cross the link.  Data
+    #  frames are decoded as usual while waiting.  Returns a list
+    #  of 'CommandResult', one for each command, in order.
+    def sendCommands( self, commands):
+        ''' Send a batch of commands and get their replies'''
+        pStream = self.pStream
+        baud = getattr( pStream, 'baudrate', 0) or 115200
+        now = time.monotonic()
+        transactions = []
+        data = bytearray()
+        for cmnd, param in commands:
+            cmndData, replyLen = encodeCommand( cmnd, param)
+            data += cmndData
+            #  Allow for every byte sent so far and the reply.
+            link = ( len( data) + replyLen) * 10 / baud
+            transactions.append( Transaction( cmnd, param, cmndData, replyLen,
+                                              now, now + link + replyTimeout( cmnd)))
+        with self.replied:
+            for transaction in transactions:
+                if( transaction.replyLen):
+                    self.pending.append( transaction)
+                else:
+                    #  If the command does not expect a reply,
+                    #  then it is finished.
+                    transaction.done( TFMP_READY)
+        try:
+            pStream.write( data)
+        except ( serial.SerialException, OSError):
+            #  The device is gone, so no reply will come.
+            with self.replied:
+                for transaction in transactions:
+                    if( transaction.status is None):
+                        transaction.done( TFMP_SERIAL)
+                self.pending = [ t for t in self.pending if t.status is None]
+        self.awaitReplies( transactions)
+        if( TFMP_METRICS):
+            for t in transactions:
+                if( t.reply is not None):
+                    self.commandLatency.add( t.finish - t.start)
+        return [ t.result() for t in transactions]
+
+    #  Wait until every transaction has its reply or its time
+    #  limit has passed.  The reader thread reads the port in
+    #  streaming mode.  Otherwise it is read here, and if the
+    #  port is gone the waiting commands fail.
+    def awaitReplies( self, transactions):
+        while True:
+            now = time.monotonic()
+            with self.replied:
+                for t in self.pending:
+                    if( t in transactions and now > t.deadline):
+                        t.done( TFMP_HEADER)     #  timed out
+                self.pending = [ t for t in self.pending if t.status is None]
+                waiting = [ t.deadline for t in transactions if t.status is None]
+                if( not waiting):
+                    return
+                if( self.streaming):
+                    self.replied.wait( min( waiting) - now)
+                    continue
+            try:
+                self.readSerial( min( waiting))
+            except ( serial.SerialException, OSError):
+                with self.replied:
+                    for t in transactions:
+                        if( t.status is None):
+                            t.done( TFMP_SERIAL)
+                    self.pending = [ t for t in self.pending if t.status is None]
+
+    #  Send one command and get its reply.  Returns TRUE/FALSE
+    #  and sets an explanatory 'status' code.
+    def sendCommand( self, cmnd, param):
+        ''' Send serial command and get reply data'''
+        if( cmnd == TRIGGER_DETECTION):
+            #  The answer is a data frame, not a reply.
+            return self.measure_now() is not None and self.status == TFMP_READY
+        result = self.sendCommands( ( ( cmnd, param),))[ 0]
+        self.status = result.status
+        if( result.reply is not None):
+            #  Keep the reply for 'printReply()'
+            self.reply[:] = bytes( TFMP_REPLY_SIZE)
+            self.reply[ :len( result.reply)] = result.reply
+            self.status = replyStatus( cmnd, result.reply, self.version)
+        if( self.status == TFMP_READY):
+            if( cmnd in settingCommands):
+                self.settings[ settingCommands[ cmnd]] = ( cmnd, param)
+            #  Frames are decoded in the new format from now on.
+            if( cmnd in frameDecoders):
+                self.decoder.setFormat( cmnd)
+            #  Frames are timed at the new rate from now on.
+            if( cmnd == SET_FRAME_RATE):
+                self.clock.setRate( param)
+            elif( cmnd == SET_BAUD_RATE):
+                self.clock.setBaud( param)
+        return self.status == TFMP_READY
+
+    #  - - - - - - - - -  Triggered mode  - - - - - - - - - - - -
+    #  With the frame rate set to zero the device measures only
+    #  when sent 'TRIGGER_DETECTION', and answers with one data
+    #  frame.  Each trigger to frame time is added to the
+    #  'triggerLatency' histogram.  Frames are returned as the
+    #  same tuple as in streaming mode:
+    #  ( seq, stamp, dist, flux, temp, status)
+    #  where 'seq' counts the frames received, from the ring in
+    #  streaming mode or from 'triggers' otherwise.  To leave
+    #  triggered mode, send 'SET_FRAME_RATE' with any other rate.
+    def triggerMode( self):
+        ''' Set the frame rate to zero for triggered measurement'''
+        if( not self.sendCommand( SET_FRAME_RATE, FRAME_0)):
+            return False
+        #  Frames sent before the rate changed are not answers.
+        if( not self.streaming):
+            self.pStream.reset_input_buffer()
+            self.rxBuffer.clear()
+        return True
+
+    #  Wait until 'deadline' for the next triggered frames and
+    #  return them as a list, which is empty if none arrived.
+    #  In streaming mode 'seq' is the ring sequence number to
+    #  wait for.
+    def triggerFrames( self, deadline, seq):
+        if( self.streaming):
+            if( self.ring.wait_next( max( deadline - time.monotonic(), 0), seq) is None):
+                return []
+            return self.ring.since( seq)
+        dists, fluxes, temps = self.dists, self.fluxes, self.temps
+        while True:
+            self.readFrames( dists, fluxes, temps, deadline)
+            if( dists or time.monotonic() > deadline):
+                break
+        stamp = self.stamp
+        frames = []
+        for i in range( len( dists)):
+            frames.append( ( self.triggers, stamp, dists[ i], fluxes[ i], temps[ i],
+                             frameStatus( dists[ i], fluxes[ i])))
+            self.triggers += 1
+        del dists[ :], fluxes[ :], temps[ :]
+        return frames
+
+    #  Trigger one measurement and return its frame, or None
+    #  if no frame arrives within 'timeout' seconds.
+    def measure_now( self, timeout = TFMP_REPLY_TIMEOUT):
+        ''' Trigger one measurement and wait for it'''
+        frames = self.measure_many( 1, 1, timeout)
+        return frames[ 0] if frames else None
+
+    #  Trigger 'n' measurements and return their frames, oldest
+    #  first.  Up to 'depth' triggers are kept in flight, so the
+    #  device starts the next measurement as soon as it sends a
+    #  frame.  Returns fewer than 'n' frames, and sets status to
+    #  HEADER, if a trigger is not answered within 'timeout'.
+    def measure_many( self, n, depth = TFMP_TRIGGER_DEPTH, timeout = TFMP_REPLY_TIMEOUT):
+        ''' Trigger many measurements and wait for them all'''
+        pStream = self.pStream
+        trigger = commandFrames[ ( TRIGGER_DETECTION, 0)][ 0]
+        latency = self.triggerLatency
+        frames = []
+        sent = collections.deque()    # send times of triggers in flight
+        if( self.streaming):
+            seq = self.ring.seq
+        else:
+            #  Stale frames would be taken for answers.
+            pStream.reset_input_buffer()
+            self.rxBuffer.clear()
+            seq = self.triggers
+        while( len( frames) < n):
+            count = min( depth - len( sent), n - len( frames) - len( sent))
+            if( count > 0):
+                start = time.monotonic()
+                pStream.write( trigger * count)
+                sent.extend( [ start] * count)
+            answers = self.triggerFrames( sent[ 0] + timeout, seq)
+            if( not answers):
+                self.status = TFMP_HEADER
+                break
+            for frame in answers[ :len( sent)]:
+                latency.add( frame[ 1] - sent.popleft())
+                frames.append( frame)
+            seq += len( answers)
+        if( frames):
+            seq, stamp, self.dist, self.flux, self.temp, status = frames[ -1]
+            if( len( frames) == n):      #  a short count keeps HEADER
+                self.status = status
+        return frames
+
+    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    #  - - - - -    The following are for testing purposes   - - - -
+    #     They interpret error status codes and display HEX data
+    #  - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    #
+    #  Called by either 'printFrame()' or 'printReply()'
+    #  Print status condition either 'READY' or error type
+    def printStatus( self):
+        ''' Print status condition'''
+        status = self.status
+        print("Status: ", end= '')
+        if( status == TFMP_READY):       print( "READY", end= '')
+        elif( status == TFMP_SERIAL):    print( "SERIAL", end= '')
+        elif( status == TFMP_HEADER):    print( "HEADER", end= '')
+        elif( status == TFMP_CHECKSUM):  print( "CHECKSUM", end= '')
+        elif( status == TFMP_TIMEOUT):   print( "TIMEOUT", end= '')
+        elif( status == TFMP_PASS):      print( "PASS", end= '')
+        elif( status == TFMP_FAIL):      print( "FAIL", end= '')
+        elif( status == TFMP_I2CREAD):   print( "I2C-READ", end= '')
+        elif( status == TFMP_I2CWRITE):  print( "I2C-WRITE", end= '')
+        elif( status == TFMP_I2CLENGTH): print( "I2C-LENGTH", end= '')
+        elif( status == TFMP_I2CNACK):   print( "I2C-NACK", end= '')
+        elif( status == TFMP_WEAK):      print( "Signal weak", end= '')
+        elif( status == TFMP_STRONG):    print( "Signal saturation", end= '')
+        elif( status == TFMP_FLOOD):     print( "Ambient light saturation", end= '')
+        else:                            print( "OTHER", end= '')
+        print()
+    #
+    #  Print error type and HEX values
+    #  of each byte in the data frame
+    def printFrame( self):
+        '''Print status and frame data'''
+        self.printStatus();
+        print("Data:", end= '')  # no carriage return
+        for i in range( TFMP_FRAME_SIZE):
+            #  >>> f"{value:#0{padding}X}"
+            # Pad hex number with 0s to length of n characters
+            print(f" {self.frame[ i]:0{2}X}", end='')
+        print()
+    #
+    #  Print error type and HEX values of
+    #  each byte in the command response frame.
+    def printReply( self):
+        '''Print status and reply data'''
+        self.printStatus()
+        #  Print the Hex value of each byte
+        for i in range( TFMP_REPLY_SIZE):
+            print(f" {self.reply[ i]:0{2}X}", end='')
+        print()
+
+#  - - - - - - - - -  Module functions  - - - - - - - - - - - -
+#  The module level functions and variables are those of one
+#  default 'TFMPlus' object, so existing programs that use
+#  'tfmplus.begin()', 'tfmplus.getData()', 'tfmplus.dist' and
+#  so on keep working unchanged.
+device = TFMPlus()
+
+begin       = device.begin
+getData     = device.getData
+getFrames   = device.getFrames
+sendCommand = device.sendCommand
+sendCommands = device.sendCommands
+startStream = device.startStream
+stopStream  = device.stopStream
+latest      = device.latest
+since       = device.since
+wait_next   = device.wait_next
+printStatus = device.printStatus
+printFrame  = device.printFrame
+printReply  = device.printReply
+record      = device.record
+stopRecord  = device.stopRecord
+triggerMode = device.triggerMode
+measure_now = device.measure_now
+measure_many = device.measure_many
+metrics     = device.metrics
+publish     = device.publish
+stopPublish = device.stopPublish
+store       = device.store
+stopStore   = device.stopStore
+
+#  Module variables such as 'tfmplus.dist' read the
+#  current value from the default device.
+def __getattr__( name):
+    if( name in TFMPlus.__slots__):
+        return getattr( device, name)
+    raise AttributeError( f"module 'tfmplus' has no attribute '{name}'")
 
 #  Definitions that need to be exported
 __all__ = ['GET_FIRMWARE_VERSION', 'TRIGGER_DETECTION', 'SOFT_RESET',